@@ -0,0 +1,13 @@
+from django.apps import AppConfig
+
+
+class BmstuLabConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'bmstu_lab'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        # Times the queries of every new database connection.
+        from . import metrics  # noqa: F401
+        # Registers the background jobs for run_jobs.
+        from . import images, popularity, utils  # noqa: F401
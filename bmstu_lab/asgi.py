@@ -12,5 +12,8 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bmstu_lab.settings')
+# Serve the async variants of the I/O-bound endpoints (bmstu_lab/async_views.py);
+# ASYNC_VIEWS=0 keeps every request on the sync views.
+os.environ.setdefault('ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
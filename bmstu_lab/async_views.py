@@ -0,0 +1,152 @@
+"""
+Async variants of the I/O-bound endpoints, routed instead of the DRF views when
+ASYNC_VIEWS is on (asgi.py turns it on). Session lookups and the catalogue
+cache go through redis.asyncio; ORM and MinIO work runs on the bounded executor
+(clients.run_sync), so a slow database or object store holds up executor
+threads, not the event loop.
+
+Anything without an async variant - other methods, token/basic auth, the
+browsable API - is handed to the DRF view on the executor, so responses are the
+same whichever path serves them.
+"""
+from django.contrib.auth.models import AnonymousUser, User
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.decorators import classonlymethod
+from django.utils.http import quote_etag
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import APIException
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from . import views
+from .authentication import aresolve_session
+from .cache import aget_catalogue_page, aget_catalogue_version
+from .clients import run_sync
+from .etags import catalogue_etag_value
+from .pagination import MapPagination
+from .pools import draft_summary
+from .replicas import replica_reads
+
+INVALID_SESSION = {'status': 'error', 'error': 'Invalid session'}
+PERMISSION_DENIED = {'status': 'error', 'error': 'Permission denied'}
+
+
+def render(data, status=200, headers=None):
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json',
+                        headers=headers)
+
+
+class AsyncAPIView(View):
+    drf_view = None
+    # Without a session_id cookie the request goes to the DRF view (it may use another authenticator).
+    session_only = False
+
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        # Same as APIView: CSRF is checked by RedisSessionAuthentication, which
+        # also guards the unsafe methods delegated to the DRF views.
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        handler = getattr(self, request.method.lower(), None)
+        if handler is None or not self.handles(request):
+            return await self.delegate(request, *args, **kwargs)
+        return await handler(request, *args, **kwargs)
+
+    def handles(self, request):
+        if 'Authorization' in request.headers or 'text/html' in request.headers.get('Accept', ''):
+            return False
+        return not self.session_only or 'session_id' in request.COOKIES
+
+    async def authenticate(self, request, required=True):
+        """Sets request.user from the session cookie; returns the 403 to send back, if any."""
+        request.user = AnonymousUser()
+        session_id = request.COOKIES.get('session_id')
+        if not session_id:
+            return None
+        row = await aresolve_session(session_id)
+        if row is None:
+            return render(INVALID_SESSION, status=403) if required else None
+        user_id, username, is_staff = row
+        request.user = User(id=user_id, username=username, is_staff=is_staff)
+        return None
+
+    async def delegate(self, request, *args, **kwargs):
+        return await run_sync(self._run_drf_view, request, *args, **kwargs)
+
+    def _run_drf_view(self, request, *args, **kwargs):
+        response = self.drf_view.as_view()(request, *args, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+
+class MapList(AsyncAPIView):
+    drf_view = views.MapList
+
+    async def get(self, request):
+        denied = await self.authenticate(request)
+        if denied:
+            return denied
+        with replica_reads(request):
+            return await self._get(request)
+
+    async def _get(self, request):
+        # Gives the paginator query_params and build_absolute_uri; never authenticates.
+        drf_request = Request(request)
+        authenticated = request.user.is_authenticated
+        paginator = MapPagination()
+        params = views.catalogue_params(drf_request, paginator)
+        version = await aget_catalogue_version()
+        draft = await run_sync(draft_summary, request) if authenticated else None
+
+        etag = quote_etag(catalogue_etag_value(version, drf_request.query_params.urlencode(), authenticated, draft))
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+        try:
+            catalogue = await aget_catalogue_page(
+                params, lambda: views.build_catalogue_page(drf_request, paginator, params), version)
+        except APIException as e:
+            return render({'detail': e.detail}, status=e.status_code)
+        response = render(views.catalogue_data(drf_request, paginator, catalogue, authenticated, draft),
+                          headers=paginator.get_headers())
+        response.headers['ETag'] = etag
+        return response
+
+    async def post(self, request):
+        return await self.delegate(request)
+
+
+class MapDetail(AsyncAPIView):
+    drf_view = views.MapDetail
+
+    async def get(self, request, id):
+        # The session is resolved here, so the DRF view finds it in session_cache.
+        await self.authenticate(request, required=False)
+        return await self.delegate(request, id=id)
+
+    async def put(self, request, id):
+        return await self.delegate(request, id=id)
+
+    async def delete(self, request, id):
+        await self.authenticate(request, required=False)
+        if not request.user.is_staff:
+            return render(PERMISSION_DENIED, status=403)
+        return await self.delegate(request, id=id)
+
+
+class UploadImageForMap(AsyncAPIView):
+    drf_view = views.UploadImageForMap
+    session_only = True
+
+    async def post(self, request, id):
+        # Turned away before the upload takes an executor thread.
+        denied = await self.authenticate(request)
+        if denied:
+            return denied
+        if not request.user.is_staff:
+            return render(PERMISSION_DENIED, status=403)
+        return await self.delegate(request, id=id)
@@ -0,0 +1,90 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, CSRFCheck
+
+from .cache import LRUCache
+from .sessions import aload_session, load_session
+
+
+class SessionCache(LRUCache):
+    """session_id -> (user_id, username, is_staff)."""
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            stale = [key for key, (_, value) in self._data.items() if value[0] == user_id]
+            for key in stale:
+                del self._data[key]
+
+
+session_cache = SessionCache(settings.SESSION_CACHE_SIZE, settings.SESSION_CACHE_TTL)
+
+
+def resolve_session(session_id):
+    cached = session_cache.get(session_id)
+    if cached is not None:
+        return cached
+    row = load_session(session_id)
+    if row is None:
+        return None
+    session_cache.set(session_id, row)
+    return row
+
+
+async def aresolve_session(session_id):
+    cached = session_cache.get(session_id)
+    if cached is not None:
+        return cached
+    row = await aload_session(session_id)
+    if row is None:
+        return None
+    session_cache.set(session_id, row)
+    return row
+
+
+class RedisSessionAuthentication(BaseAuthentication):
+    """
+    Resolves the ``session_id`` cookie once per request into ``request.user``.
+
+    The user is built from the cached (id, username, is_staff) triple without
+    touching the database, so it is only good for permission checks and
+    foreign-key lookups. Load the full row before saving it.
+
+    A cookie is sent by the browser on its own, so unsafe requests authenticated
+    by it must carry the CSRF token (X-CSRFToken header matching the csrftoken
+    cookie), as with DRF's SessionAuthentication.
+    """
+    raise_on_invalid = True
+
+    def authenticate(self, request):
+        session_id = request.COOKIES.get('session_id')
+        if not session_id:
+            return None
+        row = resolve_session(session_id)
+        if row is None:
+            if self.raise_on_invalid:
+                raise exceptions.AuthenticationFailed({'status': 'error', 'error': 'Invalid session'})
+            return None
+        self.enforce_csrf(request)
+        user_id, username, is_staff = row
+        return User(id=user_id, username=username, is_staff=is_staff), session_id
+
+    def enforce_csrf(self, request):
+        def dummy_get_response(request):
+            return None
+
+        # The check looks for the token in POST before the header. On the DRF
+        # request that parses the whole body with the view's parsers while we are
+        # still authenticating; Django's own request only parses form bodies, and
+        # does so with the upload handlers the view installed in initialize_request.
+        django_request = request._request
+        check = CSRFCheck(dummy_get_response)
+        check.process_request(django_request)
+        reason = check.process_view(django_request, None, (), {})
+        if reason:
+            raise exceptions.PermissionDenied(f'CSRF Failed: {reason}')
+
+
+class OptionalRedisSessionAuthentication(RedisSessionAuthentication):
+    """Same as above, but a stale cookie makes the request anonymous instead of 403."""
+    raise_on_invalid = False
@@ -0,0 +1,139 @@
+"""
+NDJSON import and export of maps: one JSON object per line, so neither side
+ever has to hold the whole catalogue in memory.
+"""
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from .cache import bump_catalogue_version
+from .images import schedule_variants
+from .models import Map
+from .serializers import MapSerializer
+from .utils import object_name_from_url, relink_images
+
+EXPORT_FIELDS = ('id', 'title', 'description', 'status', 'image_url', 'players', 'tileset', 'overview')
+IMPORT_FIELDS = EXPORT_FIELDS[1:]
+
+
+class ImportAborted(Exception):
+    pass
+
+
+class MapImport:
+    """
+    Reads rows, validates each with MapSerializer and writes them in
+    ``batch_size`` chunks: rows with an ``id`` update that map, the rest are
+    created. Invalid rows are skipped and reported by line number; with
+    ``strict`` any invalid row rolls the whole import back.
+    """
+
+    def __init__(self, strict=False, batch_size=None):
+        self.strict = strict
+        self.batch_size = batch_size or settings.MAP_BULK_BATCH_SIZE
+        self.created = 0
+        self.updated = 0
+        self.errors = []
+        self._pending = []
+
+    def run(self, lines):
+        try:
+            with transaction.atomic():
+                for line_number, line in enumerate(lines, start=1):
+                    line = line.strip()
+                    if line:
+                        self._add(line_number, line)
+                self._flush()
+                # JSON errors are found while reading, validation errors only when their batch is flushed.
+                self.errors.sort(key=lambda error: error['line'])
+                if self.strict and self.errors:
+                    raise ImportAborted()
+                if self.created or self.updated:
+                    transaction.on_commit(bump_catalogue_version)
+        except ImportAborted:
+            self.created = self.updated = 0
+        return self.result()
+
+    def result(self):
+        return {'created': self.created, 'updated': self.updated, 'errors': self.errors}
+
+    def _add(self, line_number, line):
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            self.errors.append({'line': line_number, 'errors': f'Неверный JSON: {e}'})
+            return
+        if not isinstance(row, dict):
+            self.errors.append({'line': line_number, 'errors': 'Ожидался JSON-объект'})
+            return
+        self._pending.append((line_number, row))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        ids = [row['id'] for _, row in self._pending if isinstance(row.get('id'), int)]
+        existing = Map.objects.in_bulk(ids)
+        to_create = []
+        to_update = {}
+        image_changes = []
+        for line_number, row in self._pending:
+            map_id = row.get('id')
+            if map_id is not None and map_id not in existing:
+                self.errors.append({'line': line_number, 'errors': f'Карта {map_id} не найдена'})
+                continue
+            instance = existing.get(map_id)
+            data = {key: row[key] for key in IMPORT_FIELDS if key in row}
+            # A map without an image is exported with image_url "", which URLField
+            # rejects; "" and null both mean "no image", as stored in the column.
+            clear_image = 'image_url' in data and not data['image_url']
+            if clear_image:
+                del data['image_url']
+            serializer = MapSerializer(instance, data=data, partial=instance is not None)
+            if not serializer.is_valid():
+                self.errors.append({'line': line_number, 'errors': serializer.errors})
+                continue
+            values = dict(serializer.validated_data)
+            if clear_image:
+                values['image_url'] = ''
+            if instance is None:
+                instance = Map(**values)
+                to_create.append(instance)
+                image_changes.append((None, instance))
+            else:
+                old_image_url = instance.image_url
+                for field, value in values.items():
+                    setattr(instance, field, value)
+                if instance.image_url != old_image_url:
+                    instance.image_variants = {}
+                    image_changes.append((old_image_url, instance))
+                to_update[instance.id] = instance
+        self._pending = []
+
+        # bulk_* skip save() and auto_now, and therefore signals and updated_at (used by ETags).
+        if to_create:
+            Map.objects.bulk_create(to_create, batch_size=self.batch_size)
+            self.created += len(to_create)
+        if to_update:
+            for instance in to_update.values():
+                Map._meta.get_field('updated_at').pre_save(instance, add=False)
+            Map.objects.bulk_update(list(to_update.values()), IMPORT_FIELDS + ('image_variants', 'updated_at'),
+                                    batch_size=self.batch_size)
+            self.updated += len(to_update)
+        # Same bookkeeping as MapDetail.put: references move with image_url, and variants are
+        # rebuilt for images in our bucket (not for every external URL in a large import).
+        linked = relink_images([(old_image_url, instance.image_url) for old_image_url, instance in image_changes])
+        for _, instance in image_changes:
+            if instance.image_url and object_name_from_url(instance.image_url) in linked:
+                schedule_variants(instance)
+
+
+def export_maps(queryset=None):
+    """Yields the maps as NDJSON lines, read through a server-side cursor."""
+    queryset = Map.objects.all() if queryset is None else queryset
+    rows = queryset.order_by('id').values(*EXPORT_FIELDS).iterator(chunk_size=settings.MAP_EXPORT_CHUNK_SIZE)
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False, cls=DjangoJSONEncoder) + '\n'
@@ -0,0 +1,112 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+from django.conf import settings
+
+from .clients import get_async_redis, get_redis, run_sync
+from .replicas import primary_reads
+
+CATALOGUE_VERSION_KEY = 'catalogue:version'
+
+
+class LRUCache:
+    """Small thread-safe per-process LRU with a TTL."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+catalogue_l1 = LRUCache(settings.CATALOGUE_L1_SIZE, settings.CATALOGUE_CACHE_TTL)
+
+
+def get_catalogue_version():
+    return int(get_redis().get(CATALOGUE_VERSION_KEY) or 0)
+
+
+async def aget_catalogue_version():
+    return int(await get_async_redis().get(CATALOGUE_VERSION_KEY) or 0)
+
+
+def bump_catalogue_version():
+    get_redis().incr(CATALOGUE_VERSION_KEY)
+
+
+def catalogue_key(version, params):
+    return f'catalogue:{version}:{urlencode(sorted(params.items()))}'
+
+
+def get_catalogue_page(params, build):
+    """
+    Returns the serialized catalogue page for ``params``, calling ``build()``
+    only on a miss. Keys embed the catalogue version, so a bump makes every
+    cached page unreachable at once; Redis drops them later by TTL.
+
+    Pages are built from the primary even in replica-routed views: a lagging
+    replica would store the pre-bump catalogue under the new version for the
+    whole TTL. Misses only follow a bump, so this costs the primary little.
+    """
+    key = catalogue_key(get_catalogue_version(), params)
+    page = catalogue_l1.get(key)
+    if page is not None:
+        return page
+    raw = get_redis().get(key)
+    if raw is not None:
+        page = json.loads(raw)
+    else:
+        with primary_reads():
+            page = build()
+        get_redis().set(key, json.dumps(page), ex=settings.CATALOGUE_CACHE_TTL)
+    catalogue_l1.set(key, page)
+    return page
+
+
+async def aget_catalogue_page(params, build, version=None):
+    """get_catalogue_page() for async views; ``build`` runs on the executor."""
+    if version is None:
+        version = await aget_catalogue_version()
+    key = catalogue_key(version, params)
+    page = catalogue_l1.get(key)
+    if page is not None:
+        return page
+    raw = await get_async_redis().get(key)
+    if raw is not None:
+        page = json.loads(raw)
+    else:
+        with primary_reads():
+            page = await run_sync(build)
+        await get_async_redis().set(key, json.dumps(page), ex=settings.CATALOGUE_CACHE_TTL)
+    catalogue_l1.set(key, page)
+    return page
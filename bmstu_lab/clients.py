@@ -0,0 +1,135 @@
+"""
+Per-process registry of network clients.
+
+Clients are built on first use, so importing views does not open sockets, and
+the registry is dropped in forked children (gunicorn --preload) so a worker
+never shares a socket with its parent.
+"""
+import asyncio
+import os
+import socket
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import redis
+import redis.asyncio
+import urllib3
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from .metrics import AsyncInstrumentedRedis, InstrumentedMinio, InstrumentedRedis
+
+_clients = {}
+_lock = threading.Lock()
+# redis.asyncio connections belong to the event loop they were opened on.
+_async_redis = weakref.WeakKeyDictionary()
+
+
+def _reset_after_fork():
+    global _lock
+    _clients.clear()
+    _async_redis.clear()
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _get_or_create(name, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory()
+    return client
+
+
+def _create_redis():
+    pool = redis.ConnectionPool(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+        socket_keepalive=True,
+        health_check_interval=30,
+    )
+    return InstrumentedRedis(connection_pool=pool)
+
+
+def _create_async_redis():
+    pool = redis.asyncio.ConnectionPool(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+        socket_keepalive=True,
+        health_check_interval=30,
+    )
+    return AsyncInstrumentedRedis(connection_pool=pool)
+
+
+def _create_executor():
+    # Bounds the blocking ORM/MinIO work async views hand off; each thread keeps its own DB connection.
+    return ThreadPoolExecutor(max_workers=settings.ASYNC_EXECUTOR_WORKERS, thread_name_prefix='async-views')
+
+
+def _create_minio():
+    http_client = urllib3.PoolManager(
+        num_pools=2,
+        maxsize=settings.MINIO_MAX_POOL_SIZE,
+        block=False,
+        timeout=urllib3.Timeout(connect=settings.MINIO_CONNECT_TIMEOUT, read=settings.MINIO_READ_TIMEOUT),
+        retries=urllib3.Retry(total=3, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+        socket_options=urllib3.connection.HTTPConnection.default_socket_options + [
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+        ],
+    )
+    return InstrumentedMinio(settings.MINIO_STORAGE_ENDPOINT,
+                             access_key=settings.MINIO_STORAGE_ACCESS_KEY,
+                             secret_key=settings.MINIO_STORAGE_SECRET_KEY,
+                             secure=settings.MINIO_STORAGE_USE_HTTPS,
+                             # A fixed region lets presigned URLs be built without asking the server.
+                             region=settings.MINIO_STORAGE_REGION,
+                             http_client=http_client)
+
+
+def get_redis():
+    return _get_or_create('redis', _create_redis)
+
+
+def get_minio():
+    return _get_or_create('minio', _create_minio)
+
+
+def get_async_redis():
+    """redis.asyncio client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_redis.get(loop)
+    if client is None:
+        client = _async_redis[loop] = _create_async_redis()
+    return client
+
+
+def get_executor():
+    return _get_or_create('executor', _create_executor)
+
+
+def _call_with_connection(func, args, kwargs):
+    # Executor threads outlive requests, so they recycle their DB connection the
+    # way request_started/request_finished do for request threads.
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_sync(func, *args, **kwargs):
+    """Runs blocking ``func`` on the bounded executor without holding up the event loop."""
+    return await sync_to_async(_call_with_connection, thread_sensitive=False,
+                               executor=get_executor())(func, args, kwargs)
@@ -0,0 +1,44 @@
+import hashlib
+
+from django.db.models import Max
+
+from .cache import get_catalogue_version
+from .models import Map, MapPool
+from .pools import draft_summary
+
+# ETag functions for django.views.decorators.http.condition. Each one reads a
+# couple of columns instead of the whole row, so a 304 costs neither a full
+# fetch nor the serializer. Returning None means "no ETag", and the view runs.
+
+
+def map_etag(request, id):
+    updated_at = Map.objects.filter(id=id, status='active').values_list('updated_at', flat=True).first()
+    if updated_at is None:
+        return None
+    return f'map-{id}-{updated_at.timestamp():.6f}'
+
+
+def map_pool_etag(request, id):
+    row = MapPool.objects.filter(id=id).annotate(maps_updated_at=Max('mapmappool__map__updated_at')) \
+        .values_list('user_id', 'updated_at', 'maps_updated_at').first()
+    if row is None:
+        return None
+    user_id, updated_at, maps_updated_at = row
+    if not request.user.is_staff and user_id != request.user.id:
+        return None
+    maps_version = f'{maps_updated_at.timestamp():.6f}' if maps_updated_at else '0'
+    return f'pool-{id}-{updated_at.timestamp():.6f}-{maps_version}'
+
+
+def catalogue_etag(request):
+    draft = draft_summary(request) if request.user.is_authenticated else None
+    return catalogue_etag_value(get_catalogue_version(), request.query_params.urlencode(),
+                                request.user.is_authenticated, draft)
+
+
+def catalogue_etag_value(version, query, authenticated, draft):
+    # Shared with async_views.MapList, which gets the version and the draft its own way.
+    parts = [str(version), query]
+    if authenticated:
+        parts.append(f'{draft[0]}-{draft[1].timestamp():.6f}' if draft else 'no-draft')
+    return 'catalogue-' + hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
@@ -0,0 +1,119 @@
+import io
+import logging
+import posixpath
+
+from django.conf import settings
+from django.utils import timezone
+from minio import S3Error
+
+from .cache import bump_catalogue_version
+from .clients import get_minio
+from .jobs import job
+from .models import Map
+from .utils import object_name_from_url, object_url
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional: without it maps keep serving the original only.
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'avif': ('AVIF', 'image/avif', {'quality': 60}),
+}
+
+
+def available_formats():
+    if Image is None:
+        return []
+    Image.init()
+    return [name for name, (pil_format, _, _) in FORMATS.items() if pil_format in Image.SAVE]
+
+
+def variant_object_name(source_object_name, variant, extension):
+    """
+    ``images/ab/<sha256>.png`` -> ``images/ab/<sha256>/card.webp``.
+
+    Variants are keyed by the source object, not laid out as ``<map_id>/<variant>/``:
+    images are content-addressed and shared by every map with the same bytes, so
+    - maps sharing an image share one set of variants instead of rendering their own;
+    - a variant URL never changes meaning, so it can be served ``immutable`` like the
+      original (a fixed per-map URL would stay cached after the image is replaced);
+    - utils.collect_object deletes the variants with their source once no map uses it,
+      by listing the source's prefix.
+    """
+    return f"{posixpath.splitext(source_object_name)[0]}/{variant}.{extension}"
+
+
+def render_variants(source, source_object_name):
+    """Encodes every size/format pair and uploads it. Returns the image_variants dict."""
+    bucket_name = settings.MINIO_STORAGE_BUCKET_NAME
+    formats = available_formats()
+    image = Image.open(source)
+    image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+    variants = {}
+    for variant, width in settings.MAP_IMAGE_VARIANTS.items():
+        resized = image.copy()
+        # Never upscale: small originals are simply re-encoded.
+        resized.thumbnail((width, width * 4), Image.LANCZOS)
+        variants[variant] = {'width': resized.width}
+        for extension in formats:
+            pil_format, content_type, options = FORMATS[extension]
+            buffer = io.BytesIO()
+            resized.save(buffer, pil_format, **options)
+            object_name = variant_object_name(source_object_name, variant, extension)
+            get_minio().put_object(bucket_name, object_name, io.BytesIO(buffer.getvalue()), buffer.tell(),
+                                   content_type=content_type, metadata={'Cache-Control': settings.IMAGE_CACHE_CONTROL})
+            variants[variant][extension] = object_url(object_name)
+    return variants
+
+
+@job('images.generate_variants')
+def generate_variants(map_id, source_object_name):
+    if Image is None:
+        return
+    expected_url = object_url(source_object_name)
+    # Maps sharing the same content-addressed image share its variants too.
+    variants = Map.objects.filter(image_url=expected_url).exclude(image_variants={}) \
+        .values_list('image_variants', flat=True).first()
+    if variants:
+        _attach_variants(map_id, expected_url, variants)
+        return
+    try:
+        response = get_minio().get_object(settings.MINIO_STORAGE_BUCKET_NAME, source_object_name)
+    except S3Error as e:
+        if e.code == 'NoSuchKey':
+            # Replaced by a newer upload before we got to it.
+            return
+        raise
+    try:
+        variants = render_variants(io.BytesIO(response.read()), source_object_name)
+    except (Image.UnidentifiedImageError, Image.DecompressionBombError):
+        # Retrying cannot fix a file Pillow does not understand.
+        logger.warning('Не удалось построить варианты изображения карты %s', map_id, exc_info=True)
+        return
+    finally:
+        response.close()
+        response.release_conn()
+
+    _attach_variants(map_id, expected_url, variants)
+
+
+def _attach_variants(map_id, expected_url, variants):
+    # A newer upload may have landed meanwhile; only attach variants of the current image.
+    updated = Map.objects.filter(id=map_id, image_url=expected_url) \
+        .update(image_variants=variants, updated_at=timezone.now())
+    if updated:
+        bump_catalogue_version()
+
+
+def schedule_variants(map_obj):
+    """Queues variant generation for the map's current image; the run_jobs worker builds them."""
+    if Image is None or not map_obj.image_url:
+        return
+    source_object_name = object_name_from_url(map_obj.image_url)
+    generate_variants.enqueue(map_obj.id, source_object_name, key=f'variants:{map_obj.id}:{source_object_name}')
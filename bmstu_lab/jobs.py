@@ -0,0 +1,182 @@
+"""
+Small Redis-backed job queue for side effects that must not run inside a request.
+
+Layout in Redis:
+  jobs:queue        list of ready jobs (LPUSH in, BLMOVE out)
+  jobs:processing   jobs a worker has taken but not finished yet
+  jobs:delayed      zset of retries, scored by the time they become ready
+  jobs:dead         jobs that ran out of attempts, with the last error
+  jobs:key:<key>    idempotency marker, set while a job with that key is pending
+
+Jobs are plain functions registered with ``@job``; ``fn.enqueue(...)`` defers
+the push until the current transaction commits. Run them with
+``manage.py run_jobs``.
+"""
+import json
+import logging
+import time
+import traceback
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from redis.exceptions import WatchError
+
+from .clients import get_redis
+
+logger = logging.getLogger(__name__)
+
+QUEUE_KEY = 'jobs:queue'
+PROCESSING_KEY = 'jobs:processing'
+DELAYED_KEY = 'jobs:delayed'
+DEAD_KEY = 'jobs:dead'
+IDEMPOTENCY_PREFIX = 'jobs:key:'
+
+registry = {}
+
+
+class JobError(Exception):
+    pass
+
+
+def job(name):
+    def decorator(func):
+        registry[name] = func
+        func.job_name = name
+        func.enqueue = lambda *args, key=None: enqueue(name, *args, key=key)
+        return func
+    return decorator
+
+
+def _push(payload):
+    redis_client = get_redis()
+    if payload['key'] is None:
+        redis_client.lpush(QUEUE_KEY, json.dumps(payload))
+        return payload['id']
+    marker = IDEMPOTENCY_PREFIX + payload['key']
+    # Marker and job go in one MULTI, so a crash in between cannot leave a marker with nothing queued.
+    with redis_client.pipeline() as pipe:
+        try:
+            pipe.watch(marker)
+            if pipe.exists(marker):
+                return None
+            pipe.multi()
+            # The marker outlives any sane backlog; it is dropped as soon as the job finishes.
+            pipe.set(marker, payload['id'], ex=settings.JOB_KEY_TTL)
+            pipe.lpush(QUEUE_KEY, json.dumps(payload))
+            pipe.execute()
+        except WatchError:
+            # Another process queued a job with this key in the meantime.
+            return None
+    return payload['id']
+
+
+def enqueue(name, *args, key=None):
+    """Queues ``name(*args)`` once the surrounding transaction (if any) commits."""
+    if name not in registry:
+        raise JobError(f'Неизвестная задача {name}')
+    payload = {'id': uuid.uuid4().hex, 'name': name, 'args': list(args), 'key': key, 'attempts': 0}
+    transaction.on_commit(lambda: _push(payload))
+    return payload['id']
+
+
+def backoff(attempts):
+    return min(settings.JOB_RETRY_BACKOFF * 2 ** (attempts - 1), settings.JOB_RETRY_BACKOFF_MAX)
+
+
+def promote_delayed(now=None):
+    """Moves retries whose time has come back onto the ready queue."""
+    redis_client = get_redis()
+    due = redis_client.zrangebyscore(DELAYED_KEY, 0, now or time.time(), start=0, num=100)
+    moved = 0
+    for raw in due:
+        # ZREM decides which worker owns the job when several promote at once.
+        if redis_client.zrem(DELAYED_KEY, raw):
+            redis_client.lpush(QUEUE_KEY, raw)
+            moved += 1
+    return moved
+
+
+def requeue_processing():
+    """Puts jobs left in ``jobs:processing`` by a killed worker back on the queue."""
+    redis_client = get_redis()
+    moved = 0
+    while redis_client.lmove(PROCESSING_KEY, QUEUE_KEY, 'RIGHT', 'LEFT') is not None:
+        moved += 1
+    return moved
+
+
+def _finish(raw, payload):
+    pipe = get_redis().pipeline()
+    pipe.lrem(PROCESSING_KEY, 1, raw)
+    if payload.get('key') is not None:
+        pipe.delete(IDEMPOTENCY_PREFIX + payload['key'])
+    pipe.execute()
+
+
+def _fail(raw, payload, error):
+    payload['attempts'] += 1
+    payload['error'] = error
+    if payload['attempts'] >= settings.JOB_MAX_ATTEMPTS:
+        logger.error('Задача %s (%s) перемещена в %s: %s', payload['name'], payload['id'], DEAD_KEY, error)
+        payload['failed_at'] = time.time()
+        pipe = get_redis().pipeline()
+        pipe.lrem(PROCESSING_KEY, 1, raw)
+        pipe.lpush(DEAD_KEY, json.dumps(payload))
+        pipe.ltrim(DEAD_KEY, 0, settings.JOB_DEAD_LETTER_SIZE - 1)
+        if payload.get('key') is not None:
+            pipe.delete(IDEMPOTENCY_PREFIX + payload['key'])
+        pipe.execute()
+        return
+    delay = backoff(payload['attempts'])
+    logger.warning('Задача %s (%s) упала, повтор через %s с: %s', payload['name'], payload['id'], delay, error)
+    pipe = get_redis().pipeline()
+    pipe.lrem(PROCESSING_KEY, 1, raw)
+    pipe.zadd(DELAYED_KEY, {json.dumps(payload): time.time() + delay})
+    pipe.execute()
+
+
+def run_one(timeout=1):
+    """Takes one job and runs it. Returns False when the queue stayed empty for ``timeout`` seconds."""
+    raw = get_redis().blmove(QUEUE_KEY, PROCESSING_KEY, timeout, 'RIGHT', 'LEFT')
+    if raw is None:
+        return False
+    payload = json.loads(raw)
+    func = registry.get(payload['name'])
+    if func is None:
+        _fail(raw, dict(payload, attempts=settings.JOB_MAX_ATTEMPTS), 'unknown job')
+        return True
+    try:
+        func(*payload['args'])
+    except Exception:
+        _fail(raw, payload, traceback.format_exc(limit=5))
+    else:
+        _finish(raw, payload)
+    return True
+
+
+def retry_dead(limit=None):
+    """Moves dead-lettered jobs back to the queue with a fresh attempt counter."""
+    redis_client = get_redis()
+    moved = 0
+    while limit is None or moved < limit:
+        raw = redis_client.rpop(DEAD_KEY)
+        if raw is None:
+            break
+        payload = json.loads(raw)
+        payload.pop('error', None)
+        payload.pop('failed_at', None)
+        payload['attempts'] = 0
+        redis_client.lpush(QUEUE_KEY, json.dumps(payload))
+        moved += 1
+    return moved
+
+
+def queue_stats():
+    pipe = get_redis().pipeline()
+    pipe.llen(QUEUE_KEY)
+    pipe.llen(PROCESSING_KEY)
+    pipe.zcard(DELAYED_KEY)
+    pipe.llen(DEAD_KEY)
+    ready, processing, delayed, dead = pipe.execute()
+    return {'ready': ready, 'processing': processing, 'delayed': delayed, 'dead': dead}
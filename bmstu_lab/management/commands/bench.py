@@ -0,0 +1,538 @@
+import asyncio
+import io
+import json
+import resource
+import time
+import uuid
+from collections import Counter
+from urllib.parse import urlencode, urlsplit
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import URLResolver, get_resolver, reverse
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+from PIL import Image
+from prometheus_client.parser import text_string_to_metric_families
+
+from bmstu_lab.clients import get_minio
+from bmstu_lab.metrics import exposition
+from bmstu_lab.models import Map, MapMapPool, MapPool
+from bmstu_lab.pools import RANK_STEP
+from bmstu_lab.sessions import create_session, delete_session
+from bmstu_lab.uploads import create_presigned_upload
+
+from .bench_http import Connection, percentile
+
+
+class Call:
+    """One request of a scenario: a JSON (or raw) body and the session to send it with."""
+
+    def __init__(self, method, path, data=None, session=None, content_type='application/json'):
+        self.method = method
+        self.path = path
+        self.session = session
+        self.content_type = content_type
+        self.body = data if isinstance(data, bytes) else json.dumps(data).encode('utf-8') if data else b''
+
+
+class Scenario:
+    """
+    ``build(fx, state, i)`` returns the i-th Call; ``prepare(fx, total)``, if
+    given, creates what the calls consume (drafts to submit, maps to delete)
+    and returns it as ``state``. ``limit`` caps the requests of slow endpoints.
+    """
+
+    def __init__(self, name, route, build, prepare=None, write=False, expected=(200,), limit=None):
+        self.name = name
+        self.route = route
+        self.build = build
+        self.prepare = prepare
+        self.write = write
+        self.expected = expected
+        self.limit = limit
+
+
+def png_bytes(index):
+    buffer = io.BytesIO()
+    Image.new('RGB', (256, 256), (index * 37 % 256, index * 91 % 256, 120)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def multipart(name, filename, content, content_type):
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n').encode('utf-8') + content + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+class Fixtures:
+    """Users, sessions and objects the scenarios run against; picked from the generated data."""
+
+    def __init__(self, password):
+        self.run = uuid.uuid4().hex[:8]
+        self.password = password
+        self._password_hash = None
+        self._sessions = []
+        self._users = 0
+        self.staff = User.objects.filter(is_staff=True).order_by('id').first()
+        player_id = MapPool.objects.filter(status='submitted', user__is_staff=False) \
+            .order_by('id').values_list('user_id', flat=True).first()
+        if self.staff is None or player_id is None:
+            raise CommandError('Нужны модератор и пользователь с заявками: сначала запустите generate_data')
+        self.player = User.objects.get(id=player_id)
+        self.staff_session = self.session(self.staff)
+        self.player_session = self.session(self.player)
+        self.map_ids = list(Map.objects.filter(status='active').order_by('?').values_list('id', flat=True)[:1000])
+        self.player_pools = list(MapPool.objects.filter(user=self.player).exclude(status='deleted')
+                                 .values_list('id', flat=True)[:200])
+
+    def session(self, user):
+        session_id = create_session(user)
+        self._sessions.append(session_id)
+        return session_id
+
+    def users(self, count):
+        if self._password_hash is None:
+            self._password_hash = make_password(self.password)
+        users = [User(username=f'bench-run-{self.run}-{self._users + number}', password=self._password_hash)
+                 for number in range(count)]
+        self._users += count
+        return User.objects.bulk_create(users)
+
+    def pools(self, user, status, count, maps_each):
+        now = timezone.now()
+        pools = MapPool.objects.bulk_create([
+            MapPool(user=user, status=status, player_login='bench', map_count=maps_each,
+                    submit_date=None if status == 'draft' else now)
+            for _ in range(count)
+        ])
+        MapMapPool.objects.bulk_create([
+            MapMapPool(map_pool=pool, map_id=map_id, rank=(position + 1) * RANK_STEP)
+            for pool in pools for position, map_id in enumerate(self.map_ids[:maps_each])
+        ])
+        return pools
+
+    def maps(self, count):
+        return Map.objects.bulk_create([
+            Map(title=f'Bench {self.run} {number}', description='d', image_url='', players='2', tileset='t',
+                overview='o')
+            for number in range(count)
+        ])
+
+    def close(self):
+        for session_id in self._sessions:
+            delete_session(session_id)
+
+
+def _fresh_user(fx, total):
+    user = fx.users(1)[0]
+    return {'user': user, 'session': fx.session(user)}
+
+
+def _pool_with_maps(maps_each):
+    def prepare(fx, total):
+        state = _fresh_user(fx, total)
+        state['pool'] = fx.pools(state['user'], 'submitted', 1, maps_each)[0]
+        state['map_ids'] = fx.map_ids[:maps_each]
+        return state
+    return prepare
+
+
+def _drafts_to_submit(fx, total):
+    users = fx.users(total)
+    pools = []
+    for user in users:
+        pools += fx.pools(user, 'draft', 1, 3)
+    return [(pool.id, fx.session(user)) for user, pool in zip(users, pools)]
+
+
+def _pools_to_delete(fx, total):
+    state = _fresh_user(fx, total)
+    state['pools'] = fx.pools(state['user'], 'submitted', total, 3)
+    return state
+
+
+def _sessions_to_close(fx, total):
+    # Not in fx's list: logout deletes them.
+    return [create_session(fx.player) for _ in range(total)]
+
+
+def _presigned_uploads(fx, total):
+    uploads = []
+    for index, map_obj in enumerate(fx.maps(total)):
+        upload = create_presigned_upload(map_obj, 'image/png')
+        content = png_bytes(index)
+        # What the browser would POST to upload['url'] with upload['fields'].
+        get_minio().put_object(settings.MINIO_STORAGE_BUCKET_NAME, upload['fields']['key'], io.BytesIO(content),
+                               len(content), content_type='image/png')
+        uploads.append((map_obj.id, upload['upload_id']))
+    return uploads
+
+
+def _upload_body(map_id, index, session):
+    body, content_type = multipart('image', f'bench-{index}.png', png_bytes(index), 'image/png')
+    return Call('POST', reverse('upload-image', args=[map_id]), body, session, content_type)
+
+
+def scenarios():
+    """Every endpoint in urls.py; reads first, as the writes change the data they read."""
+    def map_id(fx, i):
+        return fx.map_ids[i % len(fx.map_ids)]
+
+    def pool_id(fx, i):
+        return fx.player_pools[i % len(fx.player_pools)]
+
+    return [
+        Scenario('catalogue-anon', 'map-list', lambda fx, s, i: Call('GET', reverse('map-list'))),
+        Scenario('catalogue-user', 'map-list',
+                 lambda fx, s, i: Call('GET', reverse('map-list'), session=fx.player_session)),
+        Scenario('catalogue-search', 'map-list',
+                 lambda fx, s, i: Call('GET', reverse('map-list') + '?' + urlencode({'search': 'храм'}))),
+        Scenario('catalogue-title', 'map-list', lambda fx, s, i: Call('GET', reverse('map-list') + '?title=Temple')),
+        Scenario('map-detail', 'map-detail',
+                 lambda fx, s, i: Call('GET', reverse('map-detail', args=[map_id(fx, i)]))),
+        Scenario('map-export', 'map-export',
+                 lambda fx, s, i: Call('GET', reverse('map-export'), session=fx.staff_session), limit=5),
+        Scenario('pools-user', 'map_pool_list',
+                 lambda fx, s, i: Call('GET', reverse('map_pool_list'), session=fx.player_session)),
+        Scenario('pools-staff', 'map_pool_list',
+                 lambda fx, s, i: Call('GET', reverse('map_pool_list') + '?status_query=submitted',
+                                       session=fx.staff_session)),
+        Scenario('pool-detail', 'map_pool-detail',
+                 lambda fx, s, i: Call('GET', reverse('map_pool-detail', args=[pool_id(fx, i)]),
+                                       session=fx.player_session)),
+        Scenario('popularity', 'popularity', lambda fx, s, i: Call('GET', reverse('popularity') + '?scope=map')),
+        Scenario('api-root', 'api-root', lambda fx, s, i: Call('GET', reverse('api-root'))),
+        Scenario('swagger-json', 'schema-json', lambda fx, s, i: Call('GET', reverse('schema-json')), limit=10),
+        Scenario('swagger-ui', 'schema-swagger-ui', lambda fx, s, i: Call('GET', reverse('schema-swagger-ui'))),
+        Scenario('metrics', 'metrics', lambda fx, s, i: Call('GET', reverse('metrics'))),
+
+        Scenario('map-create', 'map-list', write=True, expected=(201,),
+                 build=lambda fx, s, i: Call('POST', reverse('map-list'), {
+                     'title': f'Bench {fx.run} new {i}', 'description': 'd', 'players': '2',
+                     'tileset': 't', 'overview': 'o'}, fx.staff_session)),
+        Scenario('map-update', 'map-detail', write=True, prepare=lambda fx, total: fx.maps(total),
+                 build=lambda fx, s, i: Call('PUT', reverse('map-detail', args=[s[i].id]), {
+                     'title': f'{s[i].title} v2', 'description': 'd', 'players': '2',
+                     'tileset': 't', 'overview': 'o'}, fx.staff_session)),
+        Scenario('map-delete', 'map-detail', write=True, expected=(204,), prepare=lambda fx, total: fx.maps(total),
+                 build=lambda fx, s, i: Call('DELETE', reverse('map-detail', args=[s[i].id]),
+                                             session=fx.staff_session)),
+        Scenario('map-bulk-import', 'map-bulk-import', write=True,
+                 build=lambda fx, s, i: Call('POST', reverse('map-bulk-import'), ''.join(
+                     json.dumps({'title': f'Bench {fx.run} bulk {i}-{n}', 'description': 'd', 'players': '2',
+                                 'tileset': 't', 'overview': 'o'}) + '\n' for n in range(20)).encode('utf-8'),
+                     fx.staff_session, 'application/x-ndjson')),
+        Scenario('image-upload-url', 'image-upload-url', write=True, expected=(201,),
+                 build=lambda fx, s, i: Call('POST', reverse('image-upload-url', args=[map_id(fx, i)]),
+                                             {'content_type': 'image/png'}, fx.staff_session)),
+        Scenario('upload-image', 'upload-image', write=True, prepare=lambda fx, total: fx.maps(total),
+                 build=lambda fx, s, i: _upload_body(s[i].id, i, fx.staff_session)),
+        Scenario('image-upload-complete', 'image-upload-complete', write=True, prepare=_presigned_uploads,
+                 build=lambda fx, s, i: Call('POST', reverse('image-upload-complete', args=[s[i][0]]),
+                                             {'upload_id': s[i][1]}, fx.staff_session)),
+        Scenario('draft-add', 'add-map-to-draft', write=True, expected=(201,), prepare=_fresh_user,
+                 build=lambda fx, s, i: Call('POST', reverse('add-map-to-draft'), {'map_id': map_id(fx, i)},
+                                             s['session'])),
+        Scenario('pool-maps', 'map_pool-maps', write=True, prepare=_pool_with_maps(20),
+                 build=lambda fx, s, i: Call('PATCH', reverse('map_pool-maps', args=[s['pool'].id]), {
+                     'maps': s['map_ids'][i % 20:] + s['map_ids'][:i % 20]}, s['session'])),
+        Scenario('pool-move', 'update-map-position', write=True, prepare=_pool_with_maps(20),
+                 build=lambda fx, s, i: Call('PUT', reverse('update-map-position', args=[
+                     s['pool'].id, s['map_ids'][i % 20]]), {'position': (i * 7) % 20 + 1}, s['session'])),
+        Scenario('pool-remove-map', 'remove-map-from-map-pool', write=True, expected=(204,),
+                 prepare=lambda fx, total: _pool_with_maps(min(total, len(fx.map_ids)))(fx, total),
+                 build=lambda fx, s, i: Call('DELETE', reverse('remove-map-from-map-pool', args=[
+                     s['pool'].id, s['map_ids'][i % len(s['map_ids'])]]), session=s['session'])),
+        Scenario('pool-update', 'map_pool-detail', write=True, prepare=_pool_with_maps(5),
+                 build=lambda fx, s, i: Call('PUT', reverse('map_pool-detail', args=[s['pool'].id]),
+                                             {'player_login': f'player{i}'}, s['session'])),
+        Scenario('pool-submit', 'map_pool-submit', write=True, prepare=_drafts_to_submit,
+                 build=lambda fx, s, i: Call('PUT', reverse('map_pool-submit', args=[s[i][0]]), session=s[i][1])),
+        Scenario('pool-complete', 'map_pool-complete', write=True,
+                 prepare=lambda fx, total: fx.pools(fx.users(1)[0], 'submitted', total, 5),
+                 build=lambda fx, s, i: Call('PUT', reverse('map_pool-complete', args=[s[i].id]),
+                                             {'action': 'complete' if i % 4 else 'reject'}, fx.staff_session)),
+        Scenario('pool-delete', 'map_pool-detail', write=True, prepare=_pools_to_delete,
+                 build=lambda fx, s, i: Call('DELETE', reverse('map_pool-detail', args=[s['pools'][i].id]),
+                                             session=s['session'])),
+        Scenario('register', 'user-register', write=True, expected=(201,), limit=30,
+                 build=lambda fx, s, i: Call('POST', reverse('user-register'), {
+                     'username': f'bench-reg-{fx.run}-{i}', 'password': fx.password, 'email': 'r@example.com'})),
+        Scenario('login', 'login', write=True, limit=30, prepare=lambda fx, total: fx.users(1)[0],
+                 build=lambda fx, s, i: Call('POST', reverse('login'),
+                                             {'username': s.username, 'password': fx.password})),
+        Scenario('logout', 'logout', write=True, prepare=_sessions_to_close,
+                 build=lambda fx, s, i: Call('POST', reverse('logout'), session=s[i])),
+        Scenario('profile', 'user-profile', write=True, prepare=_fresh_user,
+                 build=lambda fx, s, i: Call('PUT', reverse('user-profile'), {'first_name': f'Bench {i}'},
+                                             s['session'])),
+    ]
+
+
+def scrape_metrics(url=None):
+    """The server's /metrics text, or this process's own metrics when there is no URL (client mode)."""
+    if url is None:
+        return exposition().decode('utf-8')
+    headers = {'Authorization': f'Bearer {settings.METRICS_TOKEN}'} if settings.METRICS_TOKEN else {}
+    return urlopen(Request(url, headers=headers)).read().decode('utf-8')
+
+
+def query_stats(text):
+    """route -> (sum, count) of http_request_db_queries from a /metrics page."""
+    stats = {}
+    for family in text_string_to_metric_families(text):
+        if family.name != 'http_request_db_queries':
+            continue
+        for sample in family.samples:
+            if sample.name.endswith(('_sum', '_count')):
+                total, count = stats.get(sample.labels['route'], (0.0, 0.0))
+                if sample.name.endswith('_sum'):
+                    total += sample.value
+                else:
+                    count += sample.value
+                stats[sample.labels['route']] = (total, count)
+    return stats
+
+
+def queries_per_request(before, after, route):
+    total, count = after.get(route, (0, 0))
+    total_before, count_before = before.get(route, (0, 0))
+    return round((total - total_before) / (count - count_before), 2) if count > count_before else None
+
+
+def peak_rss_mb(pid=None):
+    """Peak RSS of this process, or the largest one of a server and its workers (Linux /proc)."""
+    if pid is None:
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    peaks = []
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as children:
+            pids = [pid] + [int(child) for child in children.read().split()]
+        for process in pids:
+            with open(f'/proc/{process}/status') as status:
+                peaks += [int(line.split()[1]) for line in status if line.startswith('VmHWM:')]
+    except OSError:
+        return None
+    return round(max(peaks) / 1024, 1) if peaks else None
+
+
+def dataset_summary():
+    return {
+        'maps': Map.objects.count(),
+        'users': User.objects.count(),
+        'map_pools': MapPool.objects.count(),
+        'map_map_pools': MapMapPool.objects.count(),
+        'database': connection.vendor,
+    }
+
+
+def url_names(patterns, namespaced=False):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            # Included apps (rest_framework's login pages) are not ours to measure.
+            yield from url_names(pattern.url_patterns, namespaced or bool(pattern.namespace))
+        elif pattern.name and not namespaced:
+            yield pattern.name
+
+
+class Command(BaseCommand):
+    help = ('Прогоняет сценарии по всем адресам urls.py через тестовый клиент (--mode client) и/или по HTTP '
+            '(--mode http, сервер должен смотреть в ту же базу и Redis) и печатает p50/p95/p99, пропускную '
+            'способность, SQL-запросов на запрос (из /metrics) и пиковый RSS. --output сохраняет результат в '
+            'JSON, --baseline сравнивает с сохранённым и завершается ошибкой при регрессии. Данные готовит '
+            'generate_data; сценарии с записью (--writes) меняют базу')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=['client', 'http', 'both'], default='client')
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Адрес сервера для --mode http')
+        parser.add_argument('--server-pid', type=int, help='PID мастера gunicorn: пиковый RSS его воркеров')
+        parser.add_argument('--requests', type=int, default=200, help='Запросов на сценарий')
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument('--concurrency', type=int, default=16, help='Соединений в --mode http')
+        parser.add_argument('--writes', action='store_true', help='Запускать и сценарии, которые меняют данные')
+        parser.add_argument('--only', nargs='+', help='Только эти сценарии')
+        parser.add_argument('--exclude', nargs='+', default=[], help='Пропустить эти сценарии')
+        parser.add_argument('--password', default='bench-password', help='Пароль пользователей generate_data')
+        parser.add_argument('--output', help='Куда сохранить результат в JSON')
+        parser.add_argument('--baseline', help='JSON прошлого прогона для сравнения')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Допустимое ухудшение p95 и пропускной способности, доля')
+        parser.add_argument('--list', action='store_true', help='Показать сценарии и непокрытые адреса')
+
+    def handle(self, *args, **options):
+        selected = self._select(options)
+        if options['list']:
+            for scenario in selected:
+                self.stdout.write(f"{scenario.name:<24} {scenario.route:<26} {'запись' if scenario.write else ''}")
+            return
+
+        fx = Fixtures(options['password'])
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'dataset': dataset_summary(),
+            'options': {key: options[key] for key in ('requests', 'warmup', 'concurrency', 'writes')},
+            'results': {},
+        }
+        modes = ['client', 'http'] if options['mode'] == 'both' else [options['mode']]
+        try:
+            for mode in modes:
+                self.stdout.write(f'\n{mode}:')
+                self.stdout.write(f"{'сценарий':<24} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+                                  f"{'SQL':>7} {'RSS MB':>8}  коды")
+                results = report['results'][mode] = {}
+                for scenario in selected:
+                    results[scenario.name] = result = self._run(mode, scenario, fx, options)
+                    self.stdout.write(
+                        f"{scenario.name:<24} {result['rps']:>8.1f} {result['p50_ms']:>8.1f} "
+                        f"{result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f} "
+                        f"{'' if result['queries'] is None else result['queries']:>7} "
+                        f"{'' if result['peak_rss_mb'] is None else result['peak_rss_mb']:>8}  {result['codes']}"
+                        + ('  ОШИБКИ' if result['errors'] else ''))
+        finally:
+            fx.close()
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, ensure_ascii=False, indent=2)
+            self.stdout.write(f"\nРезультат записан в {options['output']}")
+        if options['baseline']:
+            self._compare(report, options['baseline'], options['tolerance'])
+
+    def _select(self, options):
+        selected = [scenario for scenario in scenarios()
+                    if (options['writes'] or not scenario.write)
+                    and (not options['only'] or scenario.name in options['only'])
+                    and scenario.name not in options['exclude']]
+        unknown = set(options['only'] or []) | set(options['exclude'])
+        unknown -= {scenario.name for scenario in scenarios()}
+        if unknown:
+            raise CommandError(f"Нет таких сценариев: {', '.join(sorted(unknown))}")
+        uncovered = set(url_names(get_resolver().url_patterns)) - {scenario.route for scenario in scenarios()}
+        if uncovered:
+            self.stdout.write(f"Адреса без сценария: {', '.join(sorted(uncovered))}")
+        return selected
+
+    def _run(self, mode, scenario, fx, options):
+        requests = min(options['requests'], scenario.limit or options['requests'])
+        warmup = min(options['warmup'], requests)
+        state = scenario.prepare(fx, warmup + requests) if scenario.prepare else None
+        calls = [scenario.build(fx, state, index) for index in range(warmup + requests)]
+        if mode == 'client':
+            run, metrics_url = self._client(calls), None
+        else:
+            run = self._http(calls, options['url'], options['concurrency'])
+            metrics_url = options['url'].rstrip('/') + reverse('metrics')
+
+        run(calls[:warmup])
+        before = query_stats(scrape_metrics(metrics_url))
+        started = time.perf_counter()
+        latencies, codes = run(calls[warmup:])
+        elapsed = time.perf_counter() - started
+        after = query_stats(scrape_metrics(metrics_url))
+
+        return {
+            'route': scenario.route,
+            'method': calls[0].method,
+            'requests': len(latencies),
+            'rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+            'queries': queries_per_request(before, after, scenario.route),
+            'peak_rss_mb': peak_rss_mb(None if mode == 'client' else options['server_pid'])
+            if mode == 'client' or options['server_pid'] else None,
+            'codes': dict(sorted(codes.items(), key=str)),
+            'errors': sum(count for code, count in codes.items() if code not in scenario.expected),
+        }
+
+    def _client(self, calls):
+        client = Client(raise_request_exception=False)
+
+        def run(batch):
+            latencies, codes = [], Counter()
+            for call in batch:
+                client.cookies.clear()
+                if call.session:
+                    client.cookies['session_id'] = call.session
+                started = time.perf_counter()
+                response = client.generic(call.method, call.path, call.body, call.content_type,
+                                          HTTP_ACCEPT='application/json')
+                if response.streaming:
+                    for _ in response.streaming_content:
+                        pass
+                latencies.append(time.perf_counter() - started)
+                codes[response.status_code] += 1
+            return latencies, codes
+        return run
+
+    def _http(self, calls, url, concurrency):
+        parts = urlsplit(url)
+        if parts.scheme != 'http':
+            raise CommandError(f'Поддерживается только http://: {url}')
+        prefix = parts.path.rstrip('/')
+        csrf_token = get_random_string(32)
+
+        async def load(batch):
+            latencies, codes = [], Counter()
+            pending = iter(batch)
+
+            async def worker():
+                connection = Connection(parts.hostname, parts.port or 80)
+                for call in pending:
+                    headers = {'Accept': 'application/json'}
+                    if call.session:
+                        # Any token passes the CSRF check as long as cookie and header agree.
+                        headers['Cookie'] = f'session_id={call.session}; csrftoken={csrf_token}'
+                        headers['X-CSRFToken'] = csrf_token
+                    if call.body:
+                        headers['Content-Type'] = call.content_type
+                    started = time.perf_counter()
+                    try:
+                        codes[await connection.request(call.method, prefix + call.path, headers, call.body)] += 1
+                    except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+                        codes['error'] += 1
+                        await connection.close()
+                        continue
+                    latencies.append(time.perf_counter() - started)
+                await connection.close()
+
+            await asyncio.gather(*(worker() for _ in range(min(concurrency, len(batch)) or 1)))
+            return latencies, codes
+
+        return lambda batch: asyncio.run(load(batch))
+
+    def _compare(self, report, path, tolerance):
+        with open(path) as baseline_file:
+            baseline = json.load(baseline_file)
+        self.stdout.write(f"\nСравнение с {path} ({baseline.get('created_at', '?')}), допуск {tolerance:.0%}:")
+        regressions = []
+        for mode, results in report['results'].items():
+            for name, result in results.items():
+                base = baseline.get('results', {}).get(mode, {}).get(name)
+                if base is None:
+                    continue
+                problems = []
+                # Below a millisecond the difference is noise.
+                if result['p95_ms'] > base['p95_ms'] * (1 + tolerance) and result['p95_ms'] - base['p95_ms'] > 1:
+                    problems.append(f"p95 {base['p95_ms']} -> {result['p95_ms']} ms")
+                if result['rps'] < base['rps'] * (1 - tolerance):
+                    problems.append(f"req/s {base['rps']} -> {result['rps']}")
+                if None not in (result['queries'], base['queries']) and result['queries'] > base['queries'] + 0.5:
+                    problems.append(f"SQL {base['queries']} -> {result['queries']}")
+                if result['errors'] > base['errors']:
+                    problems.append(f"ошибок {base['errors']} -> {result['errors']}")
+                change = (result['p95_ms'] / base['p95_ms'] - 1) if base['p95_ms'] else 0
+                self.stdout.write(f"{mode:<7}{name:<24} p95 {change:+.0%}" + (
+                    '  РЕГРЕССИЯ: ' + '; '.join(problems) if problems else ''))
+                if problems:
+                    regressions.append(f'{mode}/{name}')
+        if regressions:
+            raise CommandError(f"Регрессии: {', '.join(regressions)}")
+        self.stdout.write(self.style.SUCCESS('Регрессий нет'))
@@ -0,0 +1,132 @@
+import asyncio
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * share), len(values) - 1)]
+
+
+class Connection:
+    """Minimal HTTP/1.1 keep-alive client: enough for GETs against our own API."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method, target, headers, body=b''):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        lines = [f'{method} {target} HTTP/1.1', f'Host: {self.host}:{self.port}', 'Connection: keep-alive']
+        lines += [f'{name}: {value}' for name, value in headers.items()]
+        if body:
+            lines.append(f'Content-Length: {len(body)}')
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('соединение закрыто сервером')
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        if response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        elif method != 'HEAD':
+            # DRF sends a body even with 204, so go by Content-Length rather than the status.
+            await self.reader.readexactly(int(response_headers.get('content-length', 0)))
+        if response_headers.get('connection', '').lower() == 'close':
+            await self.close()
+        return status
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+        self.reader = self.writer = None
+
+
+class Command(BaseCommand):
+    help = ('Нагружает URL параллельными keep-alive запросами и печатает пропускную способность и задержки. '
+            'Для сравнения WSGI и ASGI запустите оба сервера на одной базе, например '
+            '`ASYNC_VIEWS=0 uvicorn bmstu_lab.wsgi:application --interface wsgi --port 8000` и '
+            '`uvicorn bmstu_lab.asgi:application --port 8001`, и передайте оба адреса')
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+', help='Полные http:// адреса, каждый меряется отдельно')
+        parser.add_argument('--concurrency', type=int, default=64, help='Одновременных соединений')
+        parser.add_argument('--requests', type=int, default=2000, help='Запросов на каждый адрес')
+        parser.add_argument('--warmup', type=int, default=50, help='Запросов до начала замера')
+        parser.add_argument('--session', help='Значение cookie session_id, чтобы мерить от имени пользователя')
+        parser.add_argument('--method', default='GET')
+        parser.add_argument('--header', action='append', default=[], help='Дополнительный заголовок "Имя: значение"')
+
+    def handle(self, *args, **options):
+        headers = {'Accept': 'application/json'}
+        if options['session']:
+            headers['Cookie'] = f"session_id={options['session']}"
+        for header in options['header']:
+            name, _, value = header.partition(':')
+            headers[name.strip()] = value.strip()
+
+        self.stdout.write(f"{'url':<50} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  коды")
+        for url in options['urls']:
+            parts = urlsplit(url)
+            if parts.scheme != 'http':
+                raise CommandError(f'Поддерживается только http://: {url}')
+            target = parts.path + (f'?{parts.query}' if parts.query else '') or '/'
+            run = self._run(parts.hostname, parts.port or 80, options['method'], target, headers, options)
+            elapsed, latencies, codes = asyncio.run(run)
+            self.stdout.write(
+                f'{url[:50]:<50} {len(latencies) / elapsed:>9.1f} {percentile(latencies, 0.5) * 1000:>8.1f} '
+                f'{percentile(latencies, 0.95) * 1000:>8.1f} {percentile(latencies, 0.99) * 1000:>8.1f}  '
+                f'{dict(sorted(codes.items(), key=str))}')
+
+    async def _run(self, host, port, method, target, headers, options):
+        await self._load(host, port, method, target, headers, options['warmup'], options['concurrency'])
+        started = time.perf_counter()
+        latencies, codes = await self._load(host, port, method, target, headers, options['requests'],
+                                            options['concurrency'])
+        return time.perf_counter() - started, latencies, codes
+
+    async def _load(self, host, port, method, target, headers, total, concurrency):
+        latencies = []
+        codes = Counter()
+        remaining = [total]
+
+        async def worker():
+            connection = Connection(host, port)
+            while remaining[0] > 0:
+                remaining[0] -= 1
+                started = time.perf_counter()
+                try:
+                    codes[await connection.request(method, target, headers)] += 1
+                except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+                    codes['error'] += 1
+                    await connection.close()
+                    continue
+                latencies.append(time.perf_counter() - started)
+            await connection.close()
+
+        await asyncio.gather(*(worker() for _ in range(min(concurrency, total) or 1)))
+        return latencies, codes
@@ -0,0 +1,58 @@
+import uuid
+
+from django.core.management.base import BaseCommand
+
+from bmstu_lab.clients import get_redis
+from bmstu_lab.sessions import SESSION_PREFIX
+
+
+def is_legacy_session_key(key):
+    try:
+        uuid.UUID(key)
+    except ValueError:
+        return False
+    return True
+
+
+class Command(BaseCommand):
+    help = 'Находит сессии старого формата (uuid -> username без TTL) и при необходимости удаляет их'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--evict', action='store_true', help='Удалить найденные ключи')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Подсказка COUNT для SCAN')
+
+    def handle(self, *args, **options):
+        scanned = 0
+        found = 0
+        batch = []
+        # SCAN instead of KEYS so a large keyspace never blocks Redis.
+        for key in get_redis().scan_iter(count=options['batch_size']):
+            scanned += 1
+            batch.append(key.decode('utf-8'))
+            if len(batch) >= options['batch_size']:
+                found += self._process(batch, options['evict'])
+                batch = []
+        if batch:
+            found += self._process(batch, options['evict'])
+
+        action = 'Удалено' if options['evict'] else 'Найдено'
+        self.stdout.write(f'Просмотрено ключей: {scanned}. {action} устаревших сессий: {found}')
+
+    def _process(self, keys, evict):
+        candidates = [key for key in keys if is_legacy_session_key(key) or key.startswith(SESSION_PREFIX)]
+        if not candidates:
+            return 0
+        pipe = get_redis().pipeline(transaction=False)
+        for key in candidates:
+            pipe.type(key)
+            pipe.ttl(key)
+        results = pipe.execute()
+        orphans = []
+        for key, key_type, ttl in zip(candidates, results[::2], results[1::2]):
+            if ttl != -1:
+                continue
+            if key.startswith(SESSION_PREFIX) or key_type == b'string':
+                orphans.append(key)
+        if evict and orphans:
+            get_redis().unlink(*orphans)
+        return len(orphans)
@@ -0,0 +1,199 @@
+import itertools
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from bmstu_lab.cache import bump_catalogue_version
+from bmstu_lab.maps_data import all_maps
+from bmstu_lab.models import Map, MapMapPool, MapPool
+from bmstu_lab.popularity import POOL_SCORE_MIN, rebuild
+from bmstu_lab.pools import RANK_STEP
+
+WORDS = ['Храм', 'Пустошь', 'Бездна', 'Цитадель', 'Рубеж', 'Каньон', 'Улей', 'Кратер', 'Оплот', 'Разлом',
+         'Temple', 'Outpost', 'Nexus', 'Frontier', 'Abyss', 'Haven', 'Ridge', 'Void', 'Spire', 'Dominion']
+ADJECTIVES = ['Северный', 'Забытый', 'Тёмный', 'Ледяной', 'Последний', 'Old', 'Lost', 'Burning', 'Silent', 'Fallen']
+# Share of pools in each status; drafts are handed out separately, one per user at most.
+POOL_STATUSES = [('completed', 50), ('submitted', 20), ('rejected', 15), ('deleted', 15)]
+
+
+@contextmanager
+def manual_timestamps(*fields):
+    """Lets bulk_create write the generated dates instead of now() into auto_now/auto_now_add fields."""
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу синтетическими данными для нагрузочных тестов: карты, пользователи, заявки и карты '
+            'в заявках, всё через bulk_create. Рассчитано на отдельную базу: данные добавляются к существующим. '
+            'Все пользователи получают пароль --password; первые --staff из них — модераторы')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--maps', type=int, default=100_000)
+        parser.add_argument('--users', type=int, default=5_000)
+        parser.add_argument('--staff', type=int, default=20)
+        parser.add_argument('--pools', type=int, default=1_000_000)
+        parser.add_argument('--maps-per-pool', type=int, default=10,
+                            help='Среднее число карт в заявке; 1M заявок по 10 карт дают 10M строк MapMapPool')
+        parser.add_argument('--drafts', type=float, default=0.3, help='Доля пользователей с черновиком')
+        parser.add_argument('--batch-size', type=int, default=5_000, help='Строк в одном INSERT')
+        parser.add_argument('--prefix', default='bench', help='Начало имён пользователей')
+        parser.add_argument('--password', default='bench-password')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--skip-popularity', action='store_true', help='Не пересчитывать популярность в конце')
+
+    def handle(self, *args, **options):
+        if options['staff'] > options['users']:
+            raise CommandError('--staff не может быть больше --users')
+        if options['maps_per_pool'] < 1:
+            raise CommandError('--maps-per-pool должно быть не меньше 1')
+        self.random = random.Random(options['seed'])
+        self.now = timezone.now()
+        self.batch_size = options['batch_size']
+
+        map_ids = self._maps(options['maps'])
+        if options['pools'] and not map_ids:
+            raise CommandError('Нет активных карт для заявок: задайте --maps')
+        user_ids, staff_ids = self._users(options['users'], options['staff'], options['prefix'], options['password'])
+        self._pools(options['pools'], options['maps_per_pool'], options['drafts'], map_ids, user_ids, staff_ids)
+
+        bump_catalogue_version()
+        if connection.vendor == 'postgresql':
+            # Fresh statistics, or the planner judges the new tables by their old size.
+            started = time.monotonic()
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+            self.stdout.write(f'ANALYZE: {time.monotonic() - started:.1f} с')
+        if not options['skip_popularity'] and options['pools']:
+            started = time.monotonic()
+            rows = rebuild(rescore_pools=True)
+            self.stdout.write(f'Популярность: {rows} строк за {time.monotonic() - started:.1f} с')
+        self.stdout.write(self.style.SUCCESS('Готово'))
+
+    def _progress(self, what, done, total, started):
+        elapsed = time.monotonic() - started
+        self.stdout.write(f'{what}: {done}/{total}, {done / elapsed if elapsed else 0:.0f} в секунду')
+
+    def _moment(self, days=365):
+        return self.now - timedelta(seconds=self.random.uniform(0, days * 24 * 3600))
+
+    def _maps(self, count):
+        started = time.monotonic()
+        created = 0
+        with manual_timestamps(Map._meta.get_field('updated_at')):
+            while created < count:
+                batch = []
+                for number in range(created, min(created + self.batch_size, count)):
+                    source = self.random.choice(all_maps)
+                    title = f'{self.random.choice(ADJECTIVES)} {self.random.choice(WORDS)} {number + 1}'
+                    batch.append(Map(
+                        title=title,
+                        description=source['description'],
+                        # About 3% of the catalogue has been taken down.
+                        status='deleted' if self.random.random() < 0.03 else 'active',
+                        image_url=source['image_url'],
+                        players=source['players'],
+                        tileset=source['tileset'],
+                        overview=source['overview'],
+                        updated_at=self._moment(),
+                    ))
+                Map.objects.bulk_create(batch, batch_size=self.batch_size)
+                created += len(batch)
+                self._progress('Карты', created, count, started)
+        return list(Map.objects.filter(status='active').values_list('id', flat=True))
+
+    def _users(self, count, staff, prefix, password):
+        started = time.monotonic()
+        # PBKDF2 is slow by design; every user shares one hash.
+        password_hash = make_password(password)
+        run = self.random.randrange(16 ** 6)
+        users = [
+            User(username=f'{prefix}-{run:06x}-{number}', password=password_hash, is_staff=number < staff,
+                 email=f'{prefix}-{run:06x}-{number}@example.com', date_joined=self._moment(730))
+            for number in range(count)
+        ]
+        User.objects.bulk_create(users, batch_size=self.batch_size)
+        self._progress('Пользователи', count, count, started)
+        return [user.id for user in users], [user.id for user in users[:staff]]
+
+    def _pool_maps(self, map_ids, cum_weights, count):
+        # A few maps are in most pools, as in real play; choices() repeats, so draw extra and dedupe.
+        chosen = list(dict.fromkeys(self.random.choices(map_ids, cum_weights=cum_weights, k=count * 2)))[:count]
+        while len(chosen) < count:
+            extra = self.random.choice(map_ids)
+            if extra not in chosen:
+                chosen.append(extra)
+        return chosen
+
+    def _pool(self, status, user_id, staff_ids):
+        created = self._moment()
+        pool = MapPool(status=status, user_id=user_id, creation_date=created, updated_at=created,
+                       player_login=f'player{self.random.randrange(100_000)}')
+        if status == 'draft':
+            pool.player_login = None if self.random.random() < 0.5 else pool.player_login
+            return pool
+        if status != 'deleted' or self.random.random() < 0.5:
+            pool.submit_date = created + timedelta(minutes=self.random.uniform(1, 48 * 60))
+        if status in ('completed', 'rejected', 'deleted'):
+            pool.complete_date = (pool.submit_date or created) + timedelta(hours=self.random.uniform(1, 7 * 24))
+            pool.updated_at = pool.complete_date
+        if status in ('completed', 'rejected'):
+            pool.moderator_id = self.random.choice(staff_ids) if staff_ids else None
+        if status == 'completed':
+            # Non-null marks the pool as counted, so rebuild() takes it into account;
+            # the real value is computed there (rescore_pools).
+            pool.popularity = POOL_SCORE_MIN
+        return pool
+
+    def _pools(self, count, maps_per_pool, draft_share, map_ids, user_ids, staff_ids):
+        if not count:
+            return
+        if not user_ids:
+            raise CommandError('Заявкам нужны пользователи: задайте --users')
+        weights = [1 / (rank + 1) ** 0.8 for rank in range(len(map_ids))]
+        popular = map_ids[:]
+        self.random.shuffle(popular)
+        cum_weights = list(itertools.accumulate(weights))
+        largest = min(2 * maps_per_pool - 1, len(map_ids))
+
+        drafters = self.random.sample(user_ids, min(int(len(user_ids) * draft_share), count))
+        statuses, shares = zip(*POOL_STATUSES)
+        started = time.monotonic()
+        rows = created = 0
+        fields = [MapPool._meta.get_field('creation_date'), MapPool._meta.get_field('updated_at')]
+        with manual_timestamps(*fields):
+            while created < count:
+                size = min(self.batch_size, count - created)
+                pools = []
+                for number in range(created, created + size):
+                    if number < len(drafters):
+                        pools.append(self._pool('draft', drafters[number], staff_ids))
+                    else:
+                        status = self.random.choices(statuses, weights=shares)[0]
+                        pools.append(self._pool(status, self.random.choice(user_ids), staff_ids))
+                    pools[-1].map_count = self.random.randint(1, largest)
+                with transaction.atomic():
+                    MapPool.objects.bulk_create(pools, batch_size=self.batch_size)
+                    links = [
+                        MapMapPool(map_pool_id=pool.id, map_id=map_id, rank=(position + 1) * RANK_STEP)
+                        for pool in pools
+                        for position, map_id in enumerate(self._pool_maps(popular, cum_weights, pool.map_count))
+                    ]
+                    MapMapPool.objects.bulk_create(links, batch_size=self.batch_size)
+                created += size
+                rows += len(links)
+                self._progress('Заявки', created, count, started)
+        self.stdout.write(f'Карт в заявках: {rows}')
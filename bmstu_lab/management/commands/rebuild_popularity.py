@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from bmstu_lab import popularity
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает таблицу популярности по всем завершённым заявкам. '
+            'Нужно после смены POPULARITY_HALF_LIFE_DAYS; запускайте при остановленном run_jobs')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Строк за одно чтение курсора')
+        parser.add_argument('--pools', action='store_true',
+                            help='Заодно пересчитать popularity учтённых заявок по текущим значениям')
+
+    def handle(self, *args, **options):
+        rows = popularity.rebuild(chunk_size=options['chunk_size'], rescore_pools=options['pools'])
+        self.stdout.write(f'Записано строк популярности: {rows}')
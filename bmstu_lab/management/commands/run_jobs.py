@@ -0,0 +1,47 @@
+import signal
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from bmstu_lab import jobs
+
+
+class Command(BaseCommand):
+    help = 'Выполняет фоновые задачи из очереди в Redis (удаление объектов MinIO, обработка изображений)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--burst', action='store_true', help='Выйти, когда очередь опустеет')
+        parser.add_argument('--recover', action='store_true',
+                            help='Вернуть в очередь задачи, оставшиеся в обработке после падения воркера')
+        parser.add_argument('--retry-dead', action='store_true', help='Вернуть задачи из dead-letter в очередь')
+        parser.add_argument('--stats', action='store_true', help='Показать размеры очередей и выйти')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.stdout.write(str(jobs.queue_stats()))
+            return
+        if options['retry_dead']:
+            self.stdout.write(f'Возвращено задач: {jobs.retry_dead()}')
+            return
+        if options['recover']:
+            self.stdout.write(f'Возвращено незавершённых задач: {jobs.requeue_processing()}')
+
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        done = 0
+        while not self.stopping:
+            jobs.promote_delayed()
+            close_old_connections()
+            if jobs.run_one(timeout=1):
+                done += 1
+                continue
+            if options['burst']:
+                # Delayed retries are left for a long-running worker.
+                break
+        self.stdout.write(f'Выполнено задач: {done}')
+
+    def _stop(self, signum, frame):
+        # The job in progress is finished; the loop exits before taking the next one.
+        self.stopping = True
@@ -0,0 +1,217 @@
+"""
+Prometheus metrics, served on /metrics to the addresses in METRICS_ALLOWED_IPS
+and to requests bearing METRICS_TOKEN.
+
+- MetricsMiddleware times every request by route name from urls.py and, per
+  request, counts the SQL queries and the time spent in them;
+- every database connection gets an execute_wrapper (connection_created), so
+  queries are timed whichever thread runs them;
+- clients.py builds its Redis and MinIO clients from the classes below, which
+  time each command / HTTP call.
+
+Under gunicorn, PROMETHEUS_MULTIPROC_DIR is set (gunicorn.conf.py) and each
+worker writes its samples to files there; /metrics adds up all workers.
+Without it (runserver) the numbers are the current process only.
+"""
+import hmac
+import os
+import time
+from contextvars import ContextVar
+
+import redis
+import redis.asyncio
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseForbidden
+from minio import Minio
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+# Redis, SQL and MinIO calls are mostly sub-millisecond to tens of milliseconds.
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+REQUEST_DURATION = Histogram('http_request_duration_seconds', 'Time to respond, by route name from urls.py',
+                             ['route', 'method', 'status'])
+REQUEST_QUERIES = Histogram('http_request_db_queries', 'SQL queries per request', ['route'],
+                            buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100, 250))
+REQUEST_DB_TIME = Histogram('http_request_db_seconds', 'Time per request spent in SQL queries', ['route'],
+                            buckets=FAST_BUCKETS)
+QUERY_DURATION = Histogram('db_query_duration_seconds', 'SQL query time', ['database'], buckets=FAST_BUCKETS)
+REDIS_DURATION = Histogram('redis_command_duration_seconds', 'Redis command time; a pipeline counts as one',
+                           ['command'], buckets=FAST_BUCKETS)
+MINIO_DURATION = Histogram('minio_call_duration_seconds', 'MinIO HTTP call time, up to the response headers',
+                           ['operation'], buckets=FAST_BUCKETS)
+
+# [queries, seconds] of the request being served; sync_to_async copies it into
+# executor threads, so the ORM work of async views is counted too.
+_request_db = ContextVar('request_db', default=None)
+
+
+def route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return (match.url_name or match.view_name) if match else 'unmatched'
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self._acall(request)
+        started, token = time.perf_counter(), _request_db.set([0, 0.0])
+        try:
+            response = self.get_response(request)
+            self.record(request, response, started)
+        finally:
+            _request_db.reset(token)
+        return response
+
+    async def _acall(self, request):
+        started, token = time.perf_counter(), _request_db.set([0, 0.0])
+        try:
+            response = await self.get_response(request)
+            self.record(request, response, started)
+        finally:
+            _request_db.reset(token)
+        return response
+
+    def record(self, request, response, started):
+        # Streaming responses are timed up to the first byte, not the whole body; queries
+        # made while the body streams (MapExport) are not counted either.
+        route = route_name(request)
+        REQUEST_DURATION.labels(route, request.method, response.status_code).observe(time.perf_counter() - started)
+        queries, seconds = _request_db.get()
+        REQUEST_QUERIES.labels(route).observe(queries)
+        REQUEST_DB_TIME.labels(route).observe(seconds)
+
+
+def time_query(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        QUERY_DURATION.labels(context['connection'].alias).observe(elapsed)
+        request_db = _request_db.get()
+        if request_db is not None:
+            request_db[0] += 1
+            request_db[1] += elapsed
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    # Sent again when a persistent connection reconnects; the wrapper list stays.
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+class InstrumentedRedis(redis.StrictRedis):
+
+    def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            REDIS_DURATION.labels(str(args[0]).upper()).observe(time.perf_counter() - started)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class InstrumentedPipeline(redis.client.Pipeline):
+
+    def execute(self, raise_on_error=True):
+        started = time.perf_counter()
+        try:
+            return super().execute(raise_on_error)
+        finally:
+            REDIS_DURATION.labels('PIPELINE').observe(time.perf_counter() - started)
+
+
+class AsyncInstrumentedRedis(redis.asyncio.StrictRedis):
+
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            REDIS_DURATION.labels(str(args[0]).upper()).observe(time.perf_counter() - started)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return AsyncInstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class AsyncInstrumentedPipeline(redis.asyncio.client.Pipeline):
+
+    async def execute(self, raise_on_error=True):
+        started = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            REDIS_DURATION.labels('PIPELINE').observe(time.perf_counter() - started)
+
+
+def minio_operation(method, object_name, headers, query_params):
+    """Names the S3 call behind one HTTP request, e.g. PUT ?partNumber&uploadId -> upload_part."""
+    query = query_params or {}
+    if 'uploadId' in query:
+        return {'PUT': 'upload_part', 'POST': 'complete_multipart_upload',
+                'DELETE': 'abort_multipart_upload'}.get(method, 'list_parts')
+    if 'uploads' in query:
+        return 'create_multipart_upload'
+    if 'location' in query:
+        return 'get_bucket_location'
+    if object_name is None:
+        return {'GET': 'list_objects', 'HEAD': 'bucket_exists'}.get(method, f'bucket_{method.lower()}')
+    if method == 'PUT' and 'x-amz-copy-source' in (headers or {}):
+        return 'copy_object'
+    return {'GET': 'get_object', 'HEAD': 'stat_object', 'PUT': 'put_object',
+            'DELETE': 'remove_object'}.get(method, method.lower())
+
+
+class InstrumentedMinio(Minio):
+    # Every public and multipart call goes through _url_open.
+
+    def _url_open(self, method, region, bucket_name=None, object_name=None, body=None, headers=None,
+                  query_params=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super()._url_open(method, region, bucket_name, object_name, body, headers, query_params,
+                                     **kwargs)
+        finally:
+            MINIO_DURATION.labels(minio_operation(method, object_name, headers, query_params)).observe(
+                time.perf_counter() - started)
+
+
+def exposition():
+    """Current metrics in the Prometheus text format, summed over workers in multiprocess mode."""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
+
+
+def metrics_allowed(request):
+    token = settings.METRICS_TOKEN
+    if token:
+        scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() == 'bearer' and hmac.compare_digest(credentials.encode(), token.encode()):
+            return True
+    return request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+
+
+def metrics_view(request):
+    # Route names, query counts and pool sizes are not for the public API.
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(exposition(), content_type=CONTENT_TYPE_LATEST)
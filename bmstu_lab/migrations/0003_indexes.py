@@ -0,0 +1,54 @@
+# Generated by Django 5.1.1 on 2026-10-18 08:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def delete_duplicate_drafts(apps, schema_editor):
+    # one_draft_per_user would fail on users that already have several drafts;
+    # keep the newest one, as AddMapToDraft always did.
+    MapPool = apps.get_model('bmstu_lab', 'MapPool')
+    seen = set()
+    duplicates = []
+    for pool_id, user_id in MapPool.objects.filter(status='draft').order_by('user_id', '-creation_date') \
+            .values_list('id', 'user_id'):
+        if user_id in seen:
+            duplicates.append(pool_id)
+        seen.add(user_id)
+    MapPool.objects.filter(id__in=duplicates).update(status='deleted')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bmstu_lab', '0002_alter_mappool_popularity'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='map',
+            index=models.Index(condition=models.Q(('status', 'active')), fields=['id'], name='map_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mapmappool',
+            index=models.Index(fields=['map_pool', 'position'], name='mapmappool_pool_position_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mappool',
+            index=models.Index(fields=['user', 'status', '-creation_date'], name='mappool_user_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mappool',
+            index=models.Index(condition=models.Q(('status__in', ['deleted', 'draft']), _negated=True), fields=['submit_date', 'id'], name='mappool_listed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mappool',
+            index=models.Index(fields=['status', 'submit_date'], name='mappool_status_submit_idx'),
+        ),
+        migrations.RunPython(delete_duplicate_drafts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='mappool',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'draft')), fields=('user',), name='one_draft_per_user'),
+        ),
+    ]
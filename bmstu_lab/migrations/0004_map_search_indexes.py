@@ -0,0 +1,61 @@
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models.functions import Upper
+
+# These indexes are Postgres-only, so they are created here rather than declared
+# in Map.Meta: SQLite test databases simply skip them.
+
+
+def search_vector_index():
+    return GinIndex(
+        SearchVector('title', weight='A', config='russian')
+        + SearchVector('tileset', weight='B', config='russian')
+        + SearchVector('description', 'overview', weight='C', config='russian'),
+        name='map_search_vector_idx',
+    )
+
+
+def trigram_indexes():
+    return [
+        # Serves title__icontains, which Django renders as UPPER(title) LIKE UPPER(...).
+        GinIndex(OpClass(Upper('title'), name='gin_trgm_ops'), name='map_title_upper_trgm_idx'),
+        # Serves title__trigram_word_similar in search_maps.
+        GinIndex(OpClass('title', name='gin_trgm_ops'), name='map_title_trgm_idx'),
+    ]
+
+
+def pg_trgm_available(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Map = apps.get_model('bmstu_lab', 'Map')
+    schema_editor.add_index(Map, search_vector_index())
+    if not pg_trgm_available(schema_editor):
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for index in trigram_indexes():
+        schema_editor.add_index(Map, index)
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in ['map_search_vector_idx'] + [index.name for index in trigram_indexes()]:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {schema_editor.quote_name(name)}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bmstu_lab', '0003_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
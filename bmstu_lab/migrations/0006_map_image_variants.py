@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 08:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bmstu_lab', '0005_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='map',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
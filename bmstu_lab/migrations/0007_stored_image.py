@@ -0,0 +1,49 @@
+# Generated by Django 5.1.1 on 2026-10-18 08:52
+
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_existing_images(apps, schema_editor):
+    # Images uploaded before content addressing keep their names; counting
+    # them lets MapDetail.delete release them like any other object.
+    Map = apps.get_model('bmstu_lab', 'Map')
+    StoredImage = apps.get_model('bmstu_lab', 'StoredImage')
+    bucket_prefix = f"{settings.MINIO_STORAGE_BUCKET_NAME}/"
+    counts = {}
+    for row in Map.objects.exclude(image_url='').values('image_url').annotate(maps=Count('id')):
+        path = urlparse(row['image_url']).path.lstrip('/')
+        if not path.startswith(bucket_prefix):
+            continue
+        object_name = path[len(bucket_prefix):]
+        counts[object_name] = counts.get(object_name, 0) + row['maps']
+    StoredImage.objects.bulk_create(
+        [StoredImage(object_name=name, ref_count=count, stored=True) for name, count in counts.items()],
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bmstu_lab', '0006_map_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredImage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_name', models.CharField(max_length=255, unique=True)),
+                ('sha256', models.CharField(blank=True, max_length=64)),
+                ('content_type', models.CharField(blank=True, max_length=100)),
+                ('size', models.BigIntegerField(default=0)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('stored', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RunPython(count_existing_images, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.1.1 on 2026-10-18 09:05
+
+from django.db import migrations, models
+
+RANK_STEP = 1 << 16
+
+
+def renumber(apps, schema_editor, target, source, step):
+    MapMapPool = apps.get_model('bmstu_lab', 'MapMapPool')
+    table = schema_editor.quote_name(MapMapPool._meta.db_table)
+    schema_editor.execute(
+        f"UPDATE {table} SET {target} = numbered.rn * {step} FROM ("
+        f"SELECT id, ROW_NUMBER() OVER (PARTITION BY map_pool_id ORDER BY {source}, id) AS rn FROM {table}"
+        f") AS numbered WHERE {table}.id = numbered.id"
+    )
+
+
+def rank_from_position(apps, schema_editor):
+    # Spreads each pool out in its old order; duplicate or missing positions
+    # left by the old endpoints are resolved by id.
+    renumber(apps, schema_editor, 'rank', 'position', RANK_STEP)
+
+
+def position_from_rank(apps, schema_editor):
+    renumber(apps, schema_editor, 'position', 'rank', 1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bmstu_lab', '0007_stored_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mapmappool',
+            name='rank',
+            field=models.BigIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.RunPython(rank_from_position, position_from_rank),
+        migrations.RemoveIndex(
+            model_name='mapmappool',
+            name='mapmappool_pool_position_idx',
+        ),
+        # Only so that unapplying can add the column back to a filled table.
+        migrations.AlterField(
+            model_name='mapmappool',
+            name='position',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RemoveField(
+            model_name='mapmappool',
+            name='position',
+        ),
+        migrations.AddConstraint(
+            model_name='mapmappool',
+            constraint=models.UniqueConstraint(fields=('map_pool', 'rank'), name='unique_map_pool_rank'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.1 on 2026-10-18 10:12
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_pool_maps(apps, schema_editor):
+    MapPool = apps.get_model('bmstu_lab', 'MapPool')
+    MapMapPool = apps.get_model('bmstu_lab', 'MapMapPool')
+    counts = (MapMapPool.objects.filter(map_pool_id=OuterRef('id')).order_by()
+              .values('map_pool_id').annotate(maps=Count('id')).values('maps'))
+    MapPool.objects.update(map_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bmstu_lab', '0008_mapmappool_rank'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mappool',
+            name='map_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_pool_maps, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.1 on 2026-10-18 09:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bmstu_lab', '0009_mappool_map_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PopularityScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('map', 'Карта'), ('tileset', 'Тайлсет'), ('players', 'Количество игроков')], max_length=10)),
+                ('key', models.CharField(max_length=50)),
+                ('completions', models.PositiveIntegerField(default=0)),
+                ('score', models.FloatField(default=0)),
+                ('last_completed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['scope', '-score'], name='popularity_rank_idx')],
+                'constraints': [models.UniqueConstraint(fields=('scope', 'key'), name='unique_popularity_scope_key')],
+            },
+        ),
+    ]
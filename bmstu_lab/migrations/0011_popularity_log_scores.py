@@ -0,0 +1,79 @@
+import itertools
+import math
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import migrations
+from django.utils import timezone as django_timezone
+
+# Same as popularity.EPOCH, log_weight(), log_add() and pool_score(); migrations do not import app code.
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+POOL_SCORE_MIN = 1
+POOL_SCORE_MAX = 10
+
+
+def log_add(score, increment):
+    if score is None:
+        return increment
+    high, low = max(score, increment), min(score, increment)
+    return high + math.log2(1 + math.pow(2, low - high))
+
+
+def pool_score(map_scores, top_score):
+    if not map_scores or top_score is None:
+        return POOL_SCORE_MIN
+    share = sum(math.pow(2, score - top_score) for score in map_scores) / len(map_scores)
+    return POOL_SCORE_MIN + round(share * (POOL_SCORE_MAX - POOL_SCORE_MIN))
+
+
+def count_completed_pools(apps, schema_editor):
+    """
+    Scores every completed pool in log2 space, replacing rows an earlier 0010
+    stored as plain weights, and replaces the random popularity that pools
+    completed before popularity.py got with one computed from these scores.
+    """
+    MapMapPool = apps.get_model('bmstu_lab', 'MapMapPool')
+    MapPool = apps.get_model('bmstu_lab', 'MapPool')
+    PopularityScore = apps.get_model('bmstu_lab', 'PopularityScore')
+    half_life = settings.POPULARITY_HALF_LIFE_DAYS * 86400
+    completed = {'map_pool__status': 'completed', 'map_pool__complete_date__isnull': False}
+    totals = {}
+    rows = MapMapPool.objects.filter(**completed) \
+        .values_list('map_id', 'map__tileset', 'map__players', 'map_pool__complete_date').iterator(chunk_size=10000)
+    for map_id, tileset, players, completed_at in rows:
+        increment = (completed_at - EPOCH).total_seconds() / half_life
+        for item in (('map', str(map_id)), ('tileset', tileset), ('players', players)):
+            completions, score, last = totals.get(item, (0, None, completed_at))
+            totals[item] = (completions + 1, log_add(score, increment), max(last, completed_at))
+    PopularityScore.objects.all().delete()
+    PopularityScore.objects.bulk_create([
+        PopularityScore(scope=scope, key=key, completions=completions, score=score, last_completed_at=last)
+        for (scope, key), (completions, score, last) in totals.items()
+    ], batch_size=1000)
+
+    map_scores = {key: score for (scope, key), (_, score, _) in totals.items() if scope == 'map'}
+    top_score = max(map_scores.values(), default=None)
+    pools_by_score = {}
+    rows = MapMapPool.objects.filter(**completed).order_by('map_pool_id') \
+        .values_list('map_pool_id', 'map_id').iterator(chunk_size=10000)
+    for map_pool_id, pool_rows in itertools.groupby(rows, key=lambda row: row[0]):
+        scores = [map_scores[str(map_id)] for _, map_id in pool_rows]
+        pools_by_score.setdefault(pool_score(scores, top_score), []).append(map_pool_id)
+    now = django_timezone.now()
+    # Everything else completed, counted or not, starts from the minimum.
+    MapPool.objects.filter(status='completed').update(popularity=POOL_SCORE_MIN, updated_at=now)
+    for popularity, map_pool_ids in pools_by_score.items():
+        for start in range(0, len(map_pool_ids), 10000):
+            MapPool.objects.filter(id__in=map_pool_ids[start:start + 10000]) \
+                .update(popularity=popularity, updated_at=now)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bmstu_lab', '0010_popularity_score'),
+    ]
+
+    operations = [
+        migrations.RunPython(count_completed_pools, migrations.RunPython.noop),
+    ]
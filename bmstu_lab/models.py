@@ -2,6 +2,8 @@ from django.conf import settings
 from django.contrib.auth.base_user import AbstractBaseUser
 from django.contrib.auth.models import AbstractUser, Group, Permission, PermissionsMixin
 from django.db import models
+from django.db.models.expressions import Window
+from django.db.models.functions import RowNumber
 
 
 class Map(models.Model):
@@ -9,14 +11,49 @@ class Map(models.Model):
     description = models.TextField()
     status = models.CharField(max_length=20, choices=[('active', 'Действует'), ('deleted', 'Удалён')], default='active')
     image_url = models.URLField(max_length=500)
+    image_variants = models.JSONField(default=dict, blank=True)
     players = models.CharField(max_length=50)
     tileset = models.CharField(max_length=50)
     overview = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # The public catalogue only ever reads active maps, paged by id.
+            models.Index(fields=['id'], condition=models.Q(status='active'), name='map_active_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
 
+class StoredImage(models.Model):
+    """
+    A content-addressed object in the bucket. Maps with identical images share
+    one object; ``ref_count`` says how many point at it, and the object is
+    removed once that drops to zero.
+    """
+    object_name = models.CharField(max_length=255, unique=True)
+    sha256 = models.CharField(max_length=64, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    size = models.BigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0)
+    # False until the bytes are actually in the bucket under object_name.
+    stored = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.object_name} ({self.ref_count})"
+
+
+class MapPoolQuerySet(models.QuerySet):
+    def with_maps(self):
+        # Everything MapPoolSerializer touches, in two queries for any number of pools.
+        return self.select_related('user', 'moderator').prefetch_related(
+            models.Prefetch('mapmappool', queryset=MapMapPool.objects.select_related('map').with_positions())
+        )
+
+
 class MapPool(models.Model):
     STATUS_CHOICES = [
         ('draft', 'Черновик'),
@@ -34,25 +71,99 @@ class MapPool(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='map_pools')
     moderator = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True,
                                   related_name='moderated_map_pools')
+    updated_at = models.DateTimeField(auto_now=True)
+    # Kept in step with MapMapPool by the touch_map_pool signal and pools.edit_pool_maps,
+    # so the catalogue can show the draft size without counting rows.
+    map_count = models.PositiveIntegerField(default=0)
+
+    objects = MapPoolQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user'], condition=models.Q(status='draft'), name='one_draft_per_user'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'status', '-creation_date'], name='mappool_user_status_idx'),
+            models.Index(fields=['submit_date', 'id'], condition=~models.Q(status__in=['deleted', 'draft']),
+                         name='mappool_listed_idx'),
+            models.Index(fields=['status', 'submit_date'], name='mappool_status_submit_idx'),
+        ]
 
     def __str__(self):
         return f"MapPool {self.id} - {self.status}"
 
 
+class MapMapPoolQuerySet(models.QuerySet):
+    def with_positions(self):
+        """Orders by rank and annotates the gap-free 1-based ``position`` within each pool."""
+        return self.annotate(position=Window(RowNumber(), partition_by=[models.F('map_pool_id')],
+                                             order_by=models.F('rank').asc())).order_by('map_pool_id', 'rank')
+
+
 class MapMapPool(models.Model):
     map_pool = models.ForeignKey(MapPool, related_name='mapmappool', on_delete=models.CASCADE)
     map = models.ForeignKey(Map, on_delete=models.CASCADE)
-    position = models.PositiveIntegerField()
+    # Sparse sort key, see pools.py: inserting or moving a map writes only that row.
+    rank = models.BigIntegerField()
+
+    objects = MapMapPoolQuerySet.as_manager()
 
     class Meta:
         constraints = [
-            models.UniqueConstraint(fields=['map_pool', 'map'], name='unique_map_pool_map')
+            models.UniqueConstraint(fields=['map_pool', 'map'], name='unique_map_pool_map'),
+            models.UniqueConstraint(fields=['map_pool', 'rank'], name='unique_map_pool_rank'),
         ]
 
+    def __init__(self, *args, **kwargs):
+        self._position = None
+        super().__init__(*args, **kwargs)
+
+    @property
+    def position(self):
+        """1-based place in the pool; annotated by with_positions(), counted otherwise."""
+        if self._position is None and self.pk is not None:
+            self._position = MapMapPool.objects.filter(map_pool_id=self.map_pool_id, rank__lte=self.rank).count()
+        return self._position
+
+    @position.setter
+    def position(self, value):
+        self._position = value
+
     def __str__(self):
         return f"Map {self.map.title} in MapPool {self.map_pool.id} (Position: {self.position})"
 
 
+class PopularityScore(models.Model):
+    """
+    How often a map, a tileset or a player count appears in completed pools,
+    weighted towards recent ones. Maintained incrementally by
+    popularity.record_pool; ``score`` is log2 of the forward-decayed weight
+    (see popularity.log_weight), so ordering by it ranks by popularity today.
+    """
+    SCOPE_CHOICES = [
+        ('map', 'Карта'),
+        ('tileset', 'Тайлсет'),
+        ('players', 'Количество игроков'),
+    ]
+    scope = models.CharField(max_length=10, choices=SCOPE_CHOICES)
+    # Map id for scope='map', otherwise the tileset or players value.
+    key = models.CharField(max_length=50)
+    completions = models.PositiveIntegerField(default=0)
+    score = models.FloatField(default=0)
+    last_completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key'], name='unique_popularity_scope_key'),
+        ]
+        indexes = [
+            models.Index(fields=['scope', '-score'], name='popularity_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope} {self.key}: {self.score}"
+
+
 '''
 class NewUserManager(UserManager):
     def create_user(self, email, password=None, **extra_fields):
@@ -0,0 +1,120 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (seek) pagination: the cursor holds the ordering values of the last
+    row on the page, and the next page is ``WHERE (a, b) > (x, y) LIMIT n``, so
+    deep pages cost the same as the first one. Every ordering field must be a
+    plain column; the last one must be unique. NULLs sort last, as in a default
+    Postgres btree index, so the seek can be served from that index.
+    """
+    ordering = ('id',)
+    page_size = 50
+    max_page_size = 200
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Неверный курсор'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        position = self.decode_cursor(request, queryset.model)
+
+        queryset = queryset.order_by(*[F(field).asc(nulls_last=True) for field in self.ordering])
+        if position is not None:
+            queryset = queryset.filter(self.after(position))
+
+        page = list(queryset[:self.page_size + 1])
+        has_next = len(page) > self.page_size
+        page = page[:self.page_size]
+        self.next_cursor = self.encode_cursor(self.position_of(page[-1])) if has_next else None
+        return page
+
+    def restore(self, request, next_cursor):
+        # For pages served from a cache: links are rebuilt without touching the queryset.
+        self.request = request
+        self.next_cursor = next_cursor
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def position_of(self, obj):
+        values = []
+        for field in self.ordering:
+            value = getattr(obj, field)
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        return values
+
+    def after(self, position):
+        condition = Q(pk__in=[])
+        equal = Q()
+        for field, value in zip(self.ordering, position):
+            if value is None:
+                greater = Q(pk__in=[])
+                same = Q(**{f'{field}__isnull': True})
+            else:
+                greater = Q(**{f'{field}__gt': value}) | Q(**{f'{field}__isnull': True})
+                same = Q(**{field: value})
+            condition |= equal & greater
+            equal &= same
+        return condition
+
+    def encode_cursor(self, position):
+        data = json.dumps(position, separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, request, model):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            position = json.loads(data)
+            if not isinstance(position, list) or len(position) != len(self.ordering):
+                raise ValueError(position)
+            # Cast back to the column types, so a tampered cursor is a 404 and not a 500 from the query.
+            return [model._meta.get_field(field).to_python(value) for field, value in zip(self.ordering, position)]
+        except (binascii.Error, ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_headers(self):
+        next_link = self.get_next_link()
+        if next_link is None:
+            return {}
+        return {'Link': f'<{next_link}>; rel="next"'}
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data}, headers=self.get_headers())
+
+
+class MapPagination(KeysetPagination):
+    ordering = ('id',)
+    page_size = settings.MAPS_PAGE_SIZE
+    max_page_size = settings.MAX_PAGE_SIZE
+
+
+class MapPoolPagination(KeysetPagination):
+    ordering = ('submit_date', 'id')
+    page_size = settings.MAP_POOLS_PAGE_SIZE
+    max_page_size = settings.MAX_PAGE_SIZE
@@ -0,0 +1,172 @@
+"""
+Changes to the ordered list of maps in a pool.
+
+Order is kept in ``MapMapPool.rank``, a sparse key unique within the pool:
+appending takes the last rank plus RANK_STEP and moving takes the midpoint of
+the new neighbours, so either writes a single row; removing deletes one row
+and leaves a gap nobody sees, because the API's ``position`` is the row number
+by rank. Only when two neighbours have no room left between them is the pool
+renumbered. Every write locks the pool row first, so concurrent edits of one
+pool apply one after another.
+"""
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Map, MapPool, MapMapPool
+
+RANK_STEP = 1 << 16
+
+
+class PoolEditError(Exception):
+    pass
+
+
+def lock_pool(map_pool_id):
+    """Locks the pool row until the surrounding transaction ends and returns its status."""
+    return MapPool.objects.select_for_update().filter(id=map_pool_id).values_list('status', flat=True).get()
+
+
+def lock_draft(user):
+    """
+    Returns the user's draft pool, created if missing and locked until the
+    surrounding transaction ends. Must be called inside ``transaction.atomic``.
+    """
+    drafts = MapPool.objects.select_for_update().filter(user=user, status='draft')
+    map_pool = drafts.first()
+    if map_pool is None:
+        # INSERT ... ON CONFLICT DO NOTHING against one_draft_per_user: of two parallel
+        # requests one inserts, the other waits for it to commit and then reads its row.
+        MapPool.objects.bulk_create([MapPool(user=user, status='draft')], ignore_conflicts=True)
+        map_pool = drafts.get()
+    return map_pool
+
+
+def draft_summary(request):
+    """``(id, updated_at, map_count)`` of the user's draft or None, read once per request."""
+    if not hasattr(request, '_draft_summary'):
+        request._draft_summary = MapPool.objects.filter(user=request.user, status='draft') \
+            .values_list('id', 'updated_at', 'map_count').first()
+    return request._draft_summary
+
+
+def renumber(map_pool_id, row_ids):
+    """Gives the rows ranks RANK_STEP, 2 * RANK_STEP, ... in the order of ``row_ids``."""
+    # Two passes through negative ranks, so no intermediate state hits unique_map_pool_rank.
+    rows = [MapMapPool(id=row_id, map_pool_id=map_pool_id, rank=-index) for index, row_id in enumerate(row_ids, 1)]
+    MapMapPool.objects.bulk_update(rows, ['rank'])
+    for row in rows:
+        row.rank = -row.rank * RANK_STEP
+    MapMapPool.objects.bulk_update(rows, ['rank'])
+
+
+def _rank_at(map_pool_id, position, exclude_id=None):
+    """A free rank that puts a row at 1-based ``position`` among the other rows of the pool."""
+    others = MapMapPool.objects.filter(map_pool_id=map_pool_id)
+    if exclude_id is not None:
+        others = others.exclude(id=exclude_id)
+    others = others.order_by('rank')
+    start = max(position - 2, 0)
+    window = list(others.values_list('rank', flat=True)[start:position])
+    before = window[0] if position > 1 and window else 0
+    after_ranks = window[1:] if position > 1 else window
+    if not after_ranks:
+        last = others.aggregate(last=Max('rank'))['last']
+        return (last or 0) + RANK_STEP
+    after = after_ranks[0]
+    if after - before > 1:
+        return (before + after) // 2
+    # No room between the neighbours: spread the whole pool out (the excluded row too) and look again.
+    renumber(map_pool_id, list(MapMapPool.objects.filter(map_pool_id=map_pool_id).order_by('rank')
+                               .values_list('id', flat=True)))
+    return _rank_at(map_pool_id, position, exclude_id)
+
+
+def _touch(map_pool_id, map_count):
+    # Bulk writes skip the touch_map_pool signal.
+    MapPool.objects.filter(id=map_pool_id).update(updated_at=timezone.now(), map_count=map_count)
+
+
+def add_map(map_pool_id, map_id, position=None):
+    """Adds a map at ``position`` (default: the end)."""
+    with transaction.atomic():
+        lock_pool(map_pool_id)
+        if MapMapPool.objects.filter(map_pool_id=map_pool_id, map_id=map_id).exists():
+            raise PoolEditError('Карта уже добавлена')
+        if position is None:
+            last = MapMapPool.objects.filter(map_pool_id=map_pool_id).aggregate(last=Max('rank'))['last']
+            rank = (last or 0) + RANK_STEP
+        else:
+            rank = _rank_at(map_pool_id, position)
+        return MapMapPool.objects.create(map_pool_id=map_pool_id, map_id=map_id, rank=rank)
+
+
+def move_map(map_pool_id, map_id, position):
+    """Moves a map to 1-based ``position``; positions past the end mean the end."""
+    with transaction.atomic():
+        lock_pool(map_pool_id)
+        row = MapMapPool.objects.get(map_pool_id=map_pool_id, map_id=map_id)
+        row.rank = _rank_at(map_pool_id, position, exclude_id=row.id)
+        row.position = None
+        row.save(update_fields=['rank'])
+        return row
+
+
+def apply_ops(map_ids, ops):
+    """Applies add/remove/move ops to an ordered list of map ids and returns the new list."""
+    map_ids = list(map_ids)
+    for index, op in enumerate(ops, start=1):
+        map_id = op['map_id']
+        if op['op'] == 'add':
+            if map_id in map_ids:
+                raise PoolEditError(f'Операция {index}: карта {map_id} уже добавлена')
+            position = op.get('position', len(map_ids) + 1)
+            map_ids.insert(min(position, len(map_ids) + 1) - 1, map_id)
+        else:
+            if map_id not in map_ids:
+                raise PoolEditError(f'Операция {index}: карты {map_id} нет в заявке')
+            map_ids.remove(map_id)
+            if op['op'] == 'move':
+                map_ids.insert(min(op['position'], len(map_ids) + 1) - 1, map_id)
+    return map_ids
+
+
+def edit_pool_maps(map_pool_id, maps=None, ops=None):
+    """
+    Replaces the pool's maps with ``maps`` (or the result of ``ops``) in one
+    transaction: one DELETE for removed maps, one bulk INSERT for new ones and
+    a renumbering bulk UPDATE if the order changed.
+    """
+    with transaction.atomic():
+        # Checked under the lock MapPoolSubmitView takes, so a pool cannot be submitted mid-edit.
+        if lock_pool(map_pool_id) != 'draft':
+            raise PoolEditError('Менять карты можно только в черновике')
+        rows = list(MapMapPool.objects.filter(map_pool_id=map_pool_id).order_by('rank'))
+        current = [row.map_id for row in rows]
+        new = apply_ops(current, ops) if ops is not None else list(maps)
+
+        added = set(new) - set(current)
+        if added:
+            found = set(Map.objects.filter(id__in=added).values_list('id', flat=True))
+            if found != added:
+                raise PoolEditError(f'Карты не найдены: {sorted(added - found)}')
+
+        removed = set(current) - set(new)
+        if removed:
+            # _raw_delete is a single DELETE ... WHERE; delete() would load the rows to send signals.
+            MapMapPool.objects.filter(map_pool_id=map_pool_id, map_id__in=removed)._raw_delete(MapMapPool.objects.db)
+
+        row_ids = {row.map_id: row.id for row in rows}
+        kept = [map_id for map_id in new if map_id not in added]
+        reordered = kept != [map_id for map_id in current if map_id not in removed]
+        if added:
+            # Parked below any rank renumber() uses on the way; they get their place right after.
+            created = MapMapPool.objects.bulk_create([
+                MapMapPool(map_pool_id=map_pool_id, map_id=map_id, rank=-(len(new) + index))
+                for index, map_id in enumerate(added, start=1)
+            ])
+            row_ids.update({row.map_id: row.id for row in created})
+        if reordered or added:
+            renumber(map_pool_id, [row_ids[map_id] for map_id in new])
+        if added or removed or reordered:
+            _touch(map_pool_id, len(new))
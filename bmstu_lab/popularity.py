@@ -0,0 +1,175 @@
+"""
+Popularity of maps, tilesets and player counts, computed from completed pools.
+
+Each completed pool adds a weight to the PopularityScore row of every map in it
+and of their tilesets and player counts. A pool's weight halves every
+POPULARITY_HALF_LIFE_DAYS; instead of decaying every row as time passes, the
+weight is measured against a fixed EPOCH and grows over time (forward decay),
+so rows never need rewriting and ORDER BY score is the current ranking.
+The weight doubles every half-life and would overflow a float within a few
+years at short half-lives, so rows store log2 of their summed weight.
+``current_score`` turns a stored score back into "completions today".
+
+record_pool runs from the job queue once per completed pool and touches only
+the rows of that pool's maps; rebuild() recomputes everything from history.
+"""
+import itertools
+import math
+from collections import Counter
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .jobs import job
+from .models import MapMapPool, MapPool, PopularityScore
+
+EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+POOL_SCORE_MIN = 1
+POOL_SCORE_MAX = 10
+
+
+def log_weight(moment):
+    """log2 of the forward-decayed weight of one completion at ``moment``: half-lives since EPOCH."""
+    return (moment - EPOCH).total_seconds() / (settings.POPULARITY_HALF_LIFE_DAYS * 86400)
+
+
+def log_add(score, increment):
+    """log2(2**score + 2**increment) without leaving log space; ``score`` None is an empty row."""
+    if score is None:
+        return increment
+    high, low = max(score, increment), min(score, increment)
+    return high + math.log2(1 + math.pow(2, low - high))
+
+
+def current_score(row, now=None):
+    if not row.completions:
+        return 0.0
+    return math.pow(2, row.score - log_weight(now or timezone.now()))
+
+
+def _pool_items(map_pool_id):
+    """(scope, key) of every row a pool contributes to, with multiplicity."""
+    items = Counter()
+    for map_id, tileset, players in MapMapPool.objects.filter(map_pool_id=map_pool_id) \
+            .values_list('map_id', 'map__tileset', 'map__players'):
+        items['map', str(map_id)] += 1
+        items['tileset', tileset] += 1
+        items['players', players] += 1
+    return items
+
+
+def _add(items, completed_at):
+    """Adds one completion at ``completed_at`` for every item; returns the updated rows by (scope, key)."""
+    # Rows are created empty (ON CONFLICT DO NOTHING) and then locked in id order,
+    # so concurrent jobs for pools sharing maps wait for each other instead of deadlocking.
+    PopularityScore.objects.bulk_create([PopularityScore(scope=scope, key=key) for scope, key in items],
+                                        ignore_conflicts=True)
+    keys_by_scope = {}
+    for scope, key in items:
+        keys_by_scope.setdefault(scope, []).append(key)
+    rows = []
+    for scope, keys in keys_by_scope.items():
+        rows += PopularityScore.objects.select_for_update().filter(scope=scope, key__in=keys).order_by('id')
+    increment = log_weight(completed_at)
+    for row in rows:
+        count = items[row.scope, row.key]
+        # Rows created just above start with completions=0 and hold no weight yet.
+        row.score = log_add(row.score if row.completions else None, math.log2(count) + increment)
+        row.completions += count
+        if row.last_completed_at is None or row.last_completed_at < completed_at:
+            row.last_completed_at = completed_at
+    PopularityScore.objects.bulk_update(rows, ['completions', 'score', 'last_completed_at'])
+    return {(row.scope, row.key): row for row in rows}
+
+
+def pool_score(map_scores, top_score):
+    """Scales the mean score of a pool's maps against the most popular map to 1..10 (scores in log2)."""
+    if not map_scores or top_score is None:
+        return POOL_SCORE_MIN
+    share = sum(math.pow(2, score - top_score) for score in map_scores) / len(map_scores)
+    return POOL_SCORE_MIN + round(share * (POOL_SCORE_MAX - POOL_SCORE_MIN))
+
+
+@job('popularity.record_pool')
+def record_pool(map_pool_id):
+    """Counts a completed pool and sets its popularity; a pool that already has one is skipped."""
+    with transaction.atomic():
+        completed_at = MapPool.objects.select_for_update() \
+            .filter(id=map_pool_id, status='completed', popularity__isnull=True) \
+            .values_list('complete_date', flat=True).first()
+        if completed_at is None:
+            return
+        items = _pool_items(map_pool_id)
+        rows = _add(items, completed_at) if items else {}
+        top_score = PopularityScore.objects.filter(scope='map').order_by('-score') \
+            .values_list('score', flat=True).first()
+        map_scores = [row.score for (scope, _), row in rows.items() if scope == 'map']
+        # update() skips auto_now; the pool's ETag depends on updated_at.
+        MapPool.objects.filter(id=map_pool_id).update(popularity=pool_score(map_scores, top_score),
+                                                      updated_at=timezone.now())
+
+
+def schedule_pool(map_pool):
+    record_pool.enqueue(map_pool.id, key=f'popularity:{map_pool.id}')
+
+
+def top(scope, limit, now=None):
+    """The ``limit`` most popular rows of ``scope``, read through popularity_rank_idx."""
+    rows = list(PopularityScore.objects.filter(scope=scope).order_by('-score')[:limit])
+    now = now or timezone.now()
+    for row in rows:
+        row.current_score = current_score(row, now)
+    return rows
+
+
+def rebuild(chunk_size=10000, rescore_pools=False):
+    """
+    Recomputes every score from all completed pools in one pass over their
+    maps. Pools still waiting for record_pool (popularity is null) are left to
+    it, so the two never count a pool twice; a record_pool finishing while the
+    rebuild runs may be lost, so run it with the workers stopped.
+
+    With ``rescore_pools`` the counted pools also get their popularity
+    recomputed, against today's scores rather than those at completion.
+    """
+    totals = {}
+    rows = MapMapPool.objects.filter(map_pool__status='completed', map_pool__popularity__isnull=False) \
+        .values_list('map_id', 'map__tileset', 'map__players', 'map_pool__complete_date') \
+        .iterator(chunk_size=chunk_size)
+    for map_id, tileset, players, completed_at in rows:
+        if completed_at is None:
+            continue
+        increment = log_weight(completed_at)
+        for item in (('map', str(map_id)), ('tileset', tileset), ('players', players)):
+            completions, score, last = totals.get(item, (0, None, completed_at))
+            totals[item] = (completions + 1, log_add(score, increment), max(last, completed_at))
+    with transaction.atomic():
+        PopularityScore.objects.all().delete()
+        PopularityScore.objects.bulk_create([
+            PopularityScore(scope=scope, key=key, completions=completions, score=score, last_completed_at=last)
+            for (scope, key), (completions, score, last) in totals.items()
+        ], batch_size=1000)
+        if rescore_pools:
+            _rescore_pools(totals, chunk_size)
+    return len(totals)
+
+
+def _rescore_pools(totals, chunk_size):
+    map_scores = {key: score for (scope, key), (_, score, _) in totals.items() if scope == 'map'}
+    top_score = max(map_scores.values(), default=None)
+    pools_by_score = {}
+    rows = MapMapPool.objects.filter(map_pool__status='completed', map_pool__popularity__isnull=False) \
+        .order_by('map_pool_id').values_list('map_pool_id', 'map_id').iterator(chunk_size=chunk_size)
+    for map_pool_id, pool_rows in itertools.groupby(rows, key=lambda row: row[0]):
+        scores = [map_scores[str(map_id)] for _, map_id in pool_rows if str(map_id) in map_scores]
+        pools_by_score.setdefault(pool_score(scores, top_score), []).append(map_pool_id)
+    now = timezone.now()
+    # Pools left without maps have nothing to be popular for.
+    MapPool.objects.filter(status='completed', popularity__isnull=False, mapmappool__isnull=True) \
+        .update(popularity=POOL_SCORE_MIN, updated_at=now)
+    for popularity, map_pool_ids in pools_by_score.items():
+        for start in range(0, len(map_pool_ids), chunk_size):
+            MapPool.objects.filter(id__in=map_pool_ids[start:start + chunk_size]) \
+                .update(popularity=popularity, updated_at=now)
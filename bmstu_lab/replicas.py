@@ -0,0 +1,101 @@
+"""
+Read replicas (settings.DATABASE_REPLICAS) for the read-only views.
+
+A view method marked with @read_from_replica runs its queries, ETag included,
+against a random replica; everything else, and every write, uses 'default'.
+After a successful write the client gets a short-lived cookie and reads from
+the primary until it expires, so whoever just added a map to a draft sees it
+on the next page load however far the replicas lag.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+PIN_COOKIE = 'db_pin'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# A ContextVar rather than a thread-local: sync_to_async copies it into the
+# executor thread, so async views route the ORM work they hand off as well.
+_read_alias = ContextVar('read_alias', default=None)
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Real replicas are read-only and follow the primary's schema; a local
+        # stand-in database is migrated with `migrate --database replica1`.
+        return True
+
+
+def pinned(request):
+    return PIN_COOKIE in request.COOKIES
+
+
+@contextmanager
+def replica_reads(request):
+    alias = random.choice(settings.DATABASE_REPLICAS) if settings.DATABASE_REPLICAS and not pinned(request) else None
+    token = _read_alias.set(alias)
+    try:
+        yield alias
+    finally:
+        _read_alias.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    token = _read_alias.set(None)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def read_from_replica(view_method):
+    @wraps(view_method)
+    def wrapper(view, request, *args, **kwargs):
+        with replica_reads(request):
+            return view_method(view, request, *args, **kwargs)
+
+    return wrapper
+
+
+class ReplicaPinMiddleware:
+    """Sets PIN_COOKIE on successful unsafe requests. Not loaded without replicas."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self._acall(request)
+        return self.pin(request, self.get_response(request))
+
+    async def _acall(self, request):
+        return self.pin(request, await self.get_response(request))
+
+    def pin(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            response.set_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True,
+                                samesite='Lax')
+        return response
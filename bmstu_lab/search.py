@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity
+from django.db import connections
+from django.db.models import Q
+
+SEARCH_CONFIG = 'russian'
+
+# alias -> whether pg_trgm is installed there; checked once per process.
+_trigram_installed = {}
+
+
+def map_search_vector():
+    # Must stay identical to map_search_vector_idx from migration 0004,
+    # otherwise Postgres will not use the index.
+    return (SearchVector('title', weight='A', config=SEARCH_CONFIG)
+            + SearchVector('tileset', weight='B', config=SEARCH_CONFIG)
+            + SearchVector('description', 'overview', weight='C', config=SEARCH_CONFIG))
+
+
+def trigram_enabled(alias):
+    """Migration 0004 skips pg_trgm where the extension is not available; search is full-text only there."""
+    if not settings.MAP_SEARCH_TRIGRAM:
+        return False
+    if alias not in _trigram_installed:
+        with connections[alias].cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            _trigram_installed[alias] = cursor.fetchone() is not None
+    return _trigram_installed[alias]
+
+
+def search_maps(queryset, query, limit):
+    """Returns up to ``limit`` maps matching ``query``, best matches first."""
+    if connections[queryset.db].vendor != 'postgresql':
+        return list(queryset.filter(
+            Q(title__icontains=query) | Q(tileset__icontains=query)
+            | Q(description__icontains=query) | Q(overview__icontains=query)
+        ).order_by('id')[:limit])
+
+    search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type='websearch')
+    queryset = queryset.alias(search=map_search_vector()).annotate(rank=SearchRank(map_search_vector(), search_query))
+    condition = Q(search=search_query)
+    ordering = ['-rank']
+    if trigram_enabled(queryset.db):
+        # Catches typos and partial words in titles that full-text search misses.
+        queryset = queryset.annotate(similarity=TrigramWordSimilarity(query, 'title'))
+        condition |= Q(title__trigram_word_similar=query)
+        ordering.append('-similarity')
+    return list(queryset.filter(condition).order_by(*ordering, 'id')[:limit])
@@ -1,9 +1,11 @@
 from collections import OrderedDict
 
+from django.conf import settings
 from rest_framework import serializers
 from rest_framework.authtoken.admin import User
 
-from .models import Map, MapPool, MapMapPool
+from .models import Map, MapPool, MapMapPool, PopularityScore
+from .utils import image_link
 
 
 class MapSerializer(serializers.ModelSerializer):
@@ -12,6 +14,7 @@ class MapSerializer(serializers.ModelSerializer):
     status = serializers.ChoiceField(choices=[('active', 'Действует'), ('deleted', 'Удалён')], required=False,
                                      allow_blank=True)
     image_url = serializers.URLField(required=False, allow_null=True)
+    image_variants = serializers.JSONField(read_only=True)
     players = serializers.CharField(max_length=50, required=False, allow_blank=True)
     tileset = serializers.CharField(max_length=50, required=False, allow_blank=True)
     overview = serializers.CharField(required=False, allow_blank=True)
@@ -27,10 +30,20 @@ class MapSerializer(serializers.ModelSerializer):
                 new_fields[name] = field
             return new_fields
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if settings.MINIO_PRESIGNED_GET:
+            data['image_url'] = image_link(data['image_url'])
+            data['image_variants'] = {
+                name: {key: value if key == 'width' else image_link(value) for key, value in variant.items()}
+                for name, variant in (data['image_variants'] or {}).items()
+            }
+        return data
+
 
 class MapMapPoolSerializer(serializers.ModelSerializer):
     map = MapSerializer()
-    position = serializers.IntegerField(min_value=1)
+    position = serializers.IntegerField(min_value=1, read_only=True)
 
     class Meta:
         model = MapMapPool
@@ -53,9 +66,9 @@ class MapPoolSerializer(serializers.ModelSerializer):
         model = MapPool
         fields = ['id', 'status', 'player_login', 'popularity', 'creation_date', 'submit_date', 'complete_date',
                   'user_login',
-                  'moderator_login', 'maps']
+                  'moderator_login', 'map_count', 'maps']
         read_only_fields = ['user_login', 'moderator_login', 'creation_date', 'submit_date', 'complete_date',
-                            'popularity']
+                            'popularity', 'map_count']
 
         def get_fields(self):
             new_fields = OrderedDict()
@@ -124,6 +137,30 @@ class DraftSerializer(serializers.Serializer):
     map_id = serializers.IntegerField(default=1)
 
 
+class MapPoolOpSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=['add', 'remove', 'move'])
+    map_id = serializers.IntegerField()
+    position = serializers.IntegerField(min_value=1, required=False)
+
+    def validate(self, attrs):
+        if attrs['op'] == 'move' and 'position' not in attrs:
+            raise serializers.ValidationError('Для move нужна position')
+        return attrs
+
+
+class MapPoolMapsSerializer(serializers.Serializer):
+    maps = serializers.ListField(child=serializers.IntegerField(), required=False,
+                                 help_text='Полный упорядоченный список id карт')
+    ops = MapPoolOpSerializer(many=True, required=False, help_text='Операции add/remove/move по порядку')
+
+    def validate(self, attrs):
+        if ('maps' in attrs) == ('ops' in attrs):
+            raise serializers.ValidationError('Нужно передать либо maps, либо ops')
+        if 'maps' in attrs and len(set(attrs['maps'])) != len(attrs['maps']):
+            raise serializers.ValidationError('Карты в maps повторяются')
+        return attrs
+
+
 class PlayerLoginSerializer(serializers.Serializer):
     player_login = serializers.CharField()
 
@@ -134,12 +171,35 @@ class CompleteSerializer(serializers.Serializer):
 
 class MapFilterSerializer(serializers.Serializer):
     title = serializers.CharField(required=False)
+    search = serializers.CharField(required=False, help_text="Полнотекстовый поиск по названию, описанию и тайлсету.")
+    cursor = serializers.CharField(required=False, help_text="Курсор следующей страницы из поля next.")
+    page_size = serializers.IntegerField(required=False, min_value=1)
+
+
+class PopularityFilterSerializer(serializers.Serializer):
+    scope = serializers.ChoiceField(choices=PopularityScore.SCOPE_CHOICES, default='map')
+    limit = serializers.IntegerField(default=10, min_value=1, max_value=100)
+
+
+class PopularityScoreSerializer(serializers.ModelSerializer):
+    score = serializers.FloatField(source='current_score', read_only=True,
+                                   help_text="Число завершённых заявок с учётом давности на текущий момент.")
+    title = serializers.SerializerMethodField()
+
+    class Meta:
+        model = PopularityScore
+        fields = ['scope', 'key', 'title', 'completions', 'score', 'last_completed_at']
+
+    def get_title(self, obj):
+        return self.context.get('titles', {}).get(obj.key) if obj.scope == 'map' else obj.key
 
 
 class MapPoolFilterSerializer(serializers.Serializer):
     start_date = serializers.DateField(required=False, help_text="Дата начала для фильтрации (в формате ГГГГ-ММ-ДД).")
     end_date = serializers.DateField(required=False, help_text="Дата окончания для фильтрации (в формате ГГГГ-ММ-ДД).")
     status_query = serializers.CharField(required=False)
+    cursor = serializers.CharField(required=False, help_text="Курсор следующей страницы из заголовка Link.")
+    page_size = serializers.IntegerField(required=False, min_value=1)
 
 
 class UserProfileSerializer(serializers.ModelSerializer):
@@ -0,0 +1,165 @@
+import threading
+import time
+import uuid
+
+import redis
+from django.conf import settings
+from django.contrib.auth.models import User
+
+from .clients import get_async_redis, get_redis, run_sync
+
+SESSION_PREFIX = 'session:'
+USER_SESSIONS_PREFIX = 'user_sessions:'
+
+
+def session_key(session_id):
+    return f'{SESSION_PREFIX}{session_id}'
+
+
+def user_sessions_key(user_id):
+    return f'{USER_SESSIONS_PREFIX}{user_id}'
+
+
+def extract_between_quotes(data):
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    if data.startswith("'") and data.endswith("'"):
+        return data[1:-1]
+    return data
+
+
+def _write_session(pipe, session_id, user_id, username, is_staff):
+    pipe.hset(session_key(session_id), mapping={
+        'uid': user_id,
+        'u': username,
+        's': int(bool(is_staff)),
+        'iat': int(time.time()),
+    })
+    pipe.expire(session_key(session_id), settings.SESSION_TTL)
+    pipe.sadd(user_sessions_key(user_id), session_id)
+    pipe.expire(user_sessions_key(user_id), settings.SESSION_TTL)
+
+
+def create_session(user):
+    session_id = str(uuid.uuid4())
+    pipe = get_redis().pipeline()
+    _write_session(pipe, session_id, user.id, user.username, user.is_staff)
+    pipe.execute()
+    return session_id
+
+
+def _load_legacy_session(session_id):
+    # Sessions issued before the hash format are plain `uuid -> username` strings
+    # without a TTL. Upgrade them on first use so nobody gets logged out.
+    try:
+        username = get_redis().get(session_id)
+    except redis.ResponseError:
+        return None
+    if not username:
+        return None
+    username = extract_between_quotes(username)
+    row = User.objects.filter(username=username).values_list('id', 'username', 'is_staff').first()
+    if row is None:
+        return None
+    pipe = get_redis().pipeline()
+    _write_session(pipe, session_id, *row)
+    pipe.delete(session_id)
+    pipe.execute()
+    return row
+
+
+def load_session(session_id):
+    """Returns (user_id, username, is_staff) for a live session or None."""
+    data = get_redis().hgetall(session_key(session_id))
+    if not data:
+        return _load_legacy_session(session_id)
+    session_refresher.touch(session_id, int(data[b'uid']))
+    return int(data[b'uid']), data[b'u'].decode('utf-8'), data[b's'] == b'1'
+
+
+async def aload_session(session_id):
+    """load_session() for async views: the lookup and the refresh go through redis.asyncio."""
+    data = await get_async_redis().hgetall(session_key(session_id))
+    if not data:
+        # Legacy sessions are rare and upgraded on first use; not worth an async copy.
+        return await run_sync(_load_legacy_session, session_id)
+    pending = session_refresher.collect(session_id, int(data[b'uid']))
+    if pending:
+        pipe = get_async_redis().pipeline(transaction=False)
+        session_refresher.queue_expiry(pipe, pending)
+        await pipe.execute()
+    return int(data[b'uid']), data[b'u'].decode('utf-8'), data[b's'] == b'1'
+
+
+def delete_session(session_id):
+    user_id = get_redis().hget(session_key(session_id), 'uid')
+    pipe = get_redis().pipeline()
+    pipe.delete(session_key(session_id))
+    pipe.delete(session_id)
+    if user_id is not None:
+        pipe.srem(user_sessions_key(int(user_id)), session_id)
+    pipe.execute()
+
+
+def update_user_sessions(user):
+    """Rewrites username/is_staff in every live session of the user."""
+    session_ids = [sid.decode('utf-8') for sid in get_redis().smembers(user_sessions_key(user.id))]
+    if not session_ids:
+        return
+    pipe = get_redis().pipeline()
+    for session_id in session_ids:
+        pipe.exists(session_key(session_id))
+    alive = pipe.execute()
+    pipe = get_redis().pipeline()
+    for session_id, exists in zip(session_ids, alive):
+        if exists:
+            pipe.hset(session_key(session_id), mapping={'u': user.username, 's': int(bool(user.is_staff))})
+        else:
+            pipe.srem(user_sessions_key(user.id), session_id)
+    pipe.execute()
+
+
+class SessionRefresher:
+    """
+    Sliding expiry without an EXPIRE per request: a session is re-armed at most
+    once per SESSION_REFRESH_INTERVAL seconds, and pending refreshes are sent
+    together in one pipeline.
+    """
+
+    def __init__(self, interval, batch_size):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._touched = {}
+        self._pending = {}
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def touch(self, session_id, user_id):
+        pending = self.collect(session_id, user_id)
+        if pending:
+            pipe = get_redis().pipeline(transaction=False)
+            self.queue_expiry(pipe, pending)
+            pipe.execute()
+
+    def collect(self, session_id, user_id):
+        """Records a use of the session; returns the batch to refresh now, if any."""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._touched.get(session_id, 0) < self.interval:
+                return None
+            self._touched[session_id] = now
+            self._pending[session_id] = user_id
+            if len(self._pending) < self.batch_size and now - self._last_flush < self.interval:
+                return None
+            pending, self._pending = self._pending, {}
+            self._last_flush = now
+            self._touched = {key: value for key, value in self._touched.items() if now - value < self.interval}
+        return pending
+
+    def queue_expiry(self, pipe, pending):
+        for session_id, user_id in pending.items():
+            pipe.expire(session_key(session_id), settings.SESSION_TTL)
+            pipe.expire(user_sessions_key(user_id), settings.SESSION_TTL)
+
+
+session_refresher = SessionRefresher(settings.SESSION_REFRESH_INTERVAL, settings.SESSION_REFRESH_BATCH)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -39,6 +40,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'bmstu_lab',
     'django_filters',
     'rest_framework',
@@ -52,8 +54,30 @@ MINIO_STORAGE_ACCESS_KEY = 'minio'
 MINIO_STORAGE_SECRET_KEY = 'minio124'
 MINIO_STORAGE_BUCKET_NAME = 'mybucket'
 MINIO_STORAGE_USE_HTTPS = False
+MINIO_STORAGE_REGION = 'us-east-1'
+MINIO_MAX_POOL_SIZE = 10
+MINIO_CONNECT_TIMEOUT = 5
+MINIO_READ_TIMEOUT = 60
+MINIO_UPLOAD_PART_SIZE = 8 * 1024 * 1024
+MAP_IMAGE_MAX_SIZE = 20 * 1024 * 1024
+# Images are stored as <IMAGE_OBJECT_PREFIX><sha256[:2]>/<sha256>.<ext>; uploads are staged under
+# UPLOAD_TEMP_PREFIX (give that prefix a short lifecycle expiry in MinIO to clear interrupted ones).
+IMAGE_OBJECT_PREFIX = 'images/'
+UPLOAD_TEMP_PREFIX = 'uploads/'
+IMAGE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Presigned direct uploads (POST /api/maps/<id>/image/upload_url/) stay valid this long, in seconds.
+MAP_IMAGE_PRESIGN_EXPIRY = 15 * 60
+# For a private bucket: hand out presigned GET links instead of plain object URLs. They must outlive
+# CATALOGUE_CACHE_TTL, since cached catalogue pages keep them.
+MINIO_PRESIGNED_GET = False
+MINIO_PRESIGNED_GET_EXPIRY = 6 * 60 * 60
+# Width in pixels of each derivative; see images.py. Needs Pillow.
+MAP_IMAGE_VARIANTS = {'thumbnail': 160, 'card': 480, 'full': 1280}
+MAP_IMAGE_CONTENT_TYPES = ['image/webp', 'image/avif', 'image/png', 'image/jpeg', 'image/gif']
 
 MIDDLEWARE = [
+    # First, so the timings cover the rest of the stack.
+    'bmstu_lab.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -62,6 +86,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
+    'bmstu_lab.replicas.ReplicaPinMiddleware',
 
 ]
 
@@ -95,6 +120,25 @@ SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
 WSGI_APPLICATION = 'bmstu_lab.wsgi.application'
 REDIS_HOST = '127.0.0.1'
 REDIS_PORT = 6379
+REDIS_MAX_CONNECTIONS = 50
+REDIS_SOCKET_TIMEOUT = 5
+REDIS_SOCKET_CONNECT_TIMEOUT = 2
+# Async views (async_views.py) hand blocking ORM and MinIO calls to a thread pool
+# of this size, which also bounds the DB connections they hold open.
+ASYNC_EXECUTOR_WORKERS = 8
+# Route the I/O-bound endpoints to their async variants; asgi.py turns this on.
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS') == '1'
+SESSION_TTL = 60 * 60 * 24 * 14
+SESSION_REFRESH_INTERVAL = 300
+SESSION_REFRESH_BATCH = 100
+SESSION_CACHE_SIZE = 10000
+SESSION_CACHE_TTL = 30
+# Background jobs (jobs.py, manage.py run_jobs) share the Redis above.
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_BACKOFF = 5
+JOB_RETRY_BACKOFF_MAX = 60 * 10
+JOB_KEY_TTL = 60 * 60 * 24
+JOB_DEAD_LETTER_SIZE = 10000
 
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -102,6 +146,8 @@ CORS_ALLOWED_ORIGINS = [
 ]
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
+# The frontend sends X-CSRFToken with cookie-authenticated writes; its Origin has to be trusted.
+CSRF_TRUSTED_ORIGINS = CORS_ALLOWED_ORIGINS
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 LOGIN_REDIRECT_URL = '/swagger/'
@@ -113,10 +159,68 @@ DATABASES = {
         'PASSWORD': 'password',
         'HOST': 'postgres',
         'PORT': '5432',
+        # Keep the connection between requests; check it before reuse so a restarted
+        # server or a dropped socket costs a reconnect instead of a failed request.
+        # Connections are per thread: count workers x threads (or ASYNC_EXECUTOR_WORKERS)
+        # against max_connections.
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
+
+
+def replica_databases(default, spec):
+    """
+    DATABASES entries for read replicas of ``default``, from a comma-separated
+    list of ``host[:port][/name]``: replica1, replica2, ...
+    """
+    replicas = {}
+    for number, item in enumerate(filter(None, (item.strip() for item in spec.split(','))), start=1):
+        address, _, name = item.partition('/')
+        host, _, port = address.partition(':')
+        replicas[f'replica{number}'] = {
+            **default,
+            'HOST': host or default['HOST'],
+            'PORT': port or default['PORT'],
+            'NAME': name or default['NAME'],
+            'TEST': {'MIRROR': 'default'},
+        }
+    return replicas
+
+
+# Streaming replicas of the primary. Reads of the views marked with
+# replicas.read_from_replica go there; see replicas.py. Two databases on one
+# server are enough to try it locally: POSTGRES_REPLICAS=localhost/db_replica
+DATABASES.update(replica_databases(DATABASES['default'], os.environ.get('POSTGRES_REPLICAS', '')))
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['bmstu_lab.replicas.ReplicaRouter']
+# After a successful write a client reads from the primary for this long, so it
+# sees its own changes however far the replicas lag.
+REPLICA_PIN_SECONDS = 15
+CATALOGUE_CACHE_TTL = 60 * 60
+CATALOGUE_L1_SIZE = 256
+
+MAPS_PAGE_SIZE = 50
+MAP_POOLS_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# Rows per bulk_create/bulk_update in POST /api/maps/bulk/ and per cursor fetch in the export.
+MAP_BULK_BATCH_SIZE = 500
+MAP_EXPORT_CHUNK_SIZE = 2000
+# Needs the pg_trgm extension (postgres contrib); where it is not installed search falls back to
+# full-text only (search.trigram_enabled). MAP_SEARCH_TRIGRAM=0 turns it off everywhere.
+MAP_SEARCH_TRIGRAM = os.environ.get('MAP_SEARCH_TRIGRAM', '1') == '1'
+# A completed pool counts half as much towards popularity after this many days.
+# Stored scores depend on it: run manage.py rebuild_popularity after changing it.
+POPULARITY_HALF_LIFE_DAYS = 30
+# /metrics answers these client addresses, plus requests with "Authorization: Bearer <METRICS_TOKEN>"
+# when a token is set. Behind nginx every client has the proxy's address, so do not list it here.
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
+        # A stale cookie leaves the request anonymous; views that need a user say so themselves.
+        'bmstu_lab.authentication.OptionalRedisSessionAuthentication',
         'rest_framework.authentication.TokenAuthentication',
         'rest_framework.authentication.BasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
@@ -0,0 +1,64 @@
+"""
+Production settings, selected with DJANGO_SETTINGS_MODULE=bmstu_lab.settings_production
+(the Docker image does this; see entrypoint.sh and gunicorn.conf.py).
+
+Everything not overridden here comes from settings.py, which stays the
+development configuration for manage.py runserver. Hosts and secrets are read
+from the environment so the same image runs anywhere.
+"""
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, DATABASES, METRICS_ALLOWED_IPS, REST_FRAMEWORK, replica_databases
+
+
+def env_list(name, default):
+    value = os.environ.get(name)
+    return [item.strip() for item in value.split(',') if item.strip()] if value else default
+
+
+# With DEBUG on Django keeps every SQL query in connection.queries and serves tracebacks.
+DEBUG = False
+
+SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY')
+if not SECRET_KEY:
+    raise ImproperlyConfigured('DJANGO_SECRET_KEY must be set in production')
+ALLOWED_HOSTS = env_list('DJANGO_ALLOWED_HOSTS', ['*'])
+
+_default = DATABASES['default']
+DATABASES = {'default': {
+    **_default,
+    'NAME': os.environ.get('POSTGRES_DB', _default['NAME']),
+    'USER': os.environ.get('POSTGRES_USER', _default['USER']),
+    'PASSWORD': os.environ.get('POSTGRES_PASSWORD', _default['PASSWORD']),
+    'HOST': os.environ.get('POSTGRES_HOST', _default['HOST']),
+    'PORT': os.environ.get('POSTGRES_PORT', _default['PORT']),
+    'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', _default['CONN_MAX_AGE'])),
+}}
+# Rebuilt from the primary above, so replicas inherit its credentials and connection settings.
+DATABASES.update(replica_databases(DATABASES['default'], os.environ.get('POSTGRES_REPLICAS', '')))
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+REDIS_HOST = os.environ.get('REDIS_HOST', 'redis')
+REDIS_PORT = int(os.environ.get('REDIS_PORT', 6379))
+# The Prometheus scraper: its address on the internal network, or METRICS_TOKEN (read in settings.py).
+METRICS_ALLOWED_IPS = env_list('METRICS_ALLOWED_IPS', METRICS_ALLOWED_IPS)
+
+# The browsable API renders HTML forms on every request that asks for text/html.
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    'DEFAULT_RENDERER_CLASSES': ['rest_framework.renderers.JSONRenderer'],
+}
+
+# Filled by collectstatic in the image; served by the reverse proxy, not by Django.
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'root': {'handlers': ['console'], 'level': os.environ.get('LOG_LEVEL', 'INFO')},
+}
@@ -0,0 +1,31 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .cache import bump_catalogue_version
+from .models import Map, MapPool, MapMapPool
+
+
+@receiver(post_save, sender=Map)
+@receiver(post_delete, sender=Map)
+def invalidate_catalogue(sender, instance, **kwargs):
+    # Covers MapList.post, MapDetail.put/delete and image uploads. QuerySet.update()
+    # does not send signals, so bulk changes must call bump_catalogue_version() themselves.
+    transaction.on_commit(bump_catalogue_version)
+
+
+def _touch_map_pool(map_pool_id, added):
+    # Adding, moving or removing a map changes the pool's representation and its ETag.
+    MapPool.objects.filter(id=map_pool_id).update(updated_at=timezone.now(), map_count=F('map_count') + added)
+
+
+@receiver(post_save, sender=MapMapPool)
+def touch_map_pool(sender, instance, created, **kwargs):
+    _touch_map_pool(instance.map_pool_id, 1 if created else 0)
+
+
+@receiver(post_delete, sender=MapMapPool)
+def touch_map_pool_on_delete(sender, instance, **kwargs):
+    _touch_map_pool(instance.map_pool_id, -1)
@@ -0,0 +1,70 @@
+import threading
+from unittest import skipUnless
+
+from django.contrib.auth.models import User
+from django.db import connection, connections
+from django.test import Client, TransactionTestCase
+from django.urls import reverse
+
+from bmstu_lab.models import Map, MapMapPool, MapPool
+from bmstu_lab.sessions import create_session, delete_session
+
+
+@skipUnless(connection.vendor == 'postgresql', 'SELECT ... FOR UPDATE и гонки черновиков проверяются на Postgres')
+class ConcurrentDraftTests(TransactionTestCase):
+    """
+    Many requests add maps to the same user's draft at once. Each thread has its
+    own connection, so the requests really race and the data has to be committed.
+    """
+    threads = 16
+    rounds = 5
+
+    def setUp(self):
+        self.user = User.objects.create_user('draft-race', password='pw')
+        self.maps = [
+            Map.objects.create(title=f'Карта {index}', description='d', image_url='', players='1v1',
+                               tileset='t', overview='o')
+            for index in range(4)
+        ]
+        self.session_id = create_session(self.user)
+
+    def tearDown(self):
+        delete_session(self.session_id)
+
+    def volley(self):
+        barrier = threading.Barrier(self.threads)
+        codes = []
+        url = reverse('add-map-to-draft')
+
+        def worker(index):
+            client = Client(raise_request_exception=False)
+            client.cookies['session_id'] = self.session_id
+            try:
+                barrier.wait()
+                response = client.post(url, {'map_id': self.maps[index % len(self.maps)].id},
+                                       content_type='application/json')
+                codes.append(response.status_code)
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=worker, args=(index,)) for index in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return codes
+
+    def test_parallel_adds_keep_one_draft(self):
+        for _ in range(self.rounds):
+            codes = self.volley()
+            # Repeats of a map already in the draft are 400; nothing may fail with 500.
+            self.assertLessEqual(set(codes), {201, 400}, codes)
+            self.assertEqual(codes.count(201), len(self.maps), codes)
+
+            drafts = list(MapPool.objects.filter(user=self.user, status='draft'))
+            self.assertEqual(len(drafts), 1, f'черновиков: {len(drafts)}')
+            map_ids = list(MapMapPool.objects.filter(map_pool=drafts[0]).values_list('map_id', flat=True))
+            self.assertCountEqual(map_ids, [map_obj.id for map_obj in self.maps])
+            self.assertEqual(drafts[0].map_count, len(self.maps))
+
+            MapPool.objects.filter(user=self.user, status='draft').update(status='deleted')
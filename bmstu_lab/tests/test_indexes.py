@@ -0,0 +1,57 @@
+from unittest import skipUnless
+
+from django.contrib.postgres.search import SearchQuery
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+from bmstu_lab.models import Map, MapMapPool, MapPool, PopularityScore
+from bmstu_lab.search import SEARCH_CONFIG, map_search_vector, trigram_enabled
+
+
+def planned_queries():
+    now = timezone.now()
+    queries = [
+        ('каталог активных карт', 'map_active_idx',
+         Map.objects.filter(status='active').order_by('id')[:51]),
+        ('полнотекстовый поиск карт', 'map_search_vector_idx',
+         Map.objects.alias(search=map_search_vector()).filter(search=SearchQuery('храм', config=SEARCH_CONFIG))),
+        ('черновик пользователя', 'one_draft_per_user',
+         MapPool.objects.filter(user_id=1, status='draft')[:1]),
+        ('заявки пользователя по статусу', 'mappool_user_status_idx',
+         MapPool.objects.filter(user_id=1, status='submitted').order_by('-creation_date')),
+        ('список заявок', 'mappool_listed_idx',
+         MapPool.objects.exclude(status__in=['deleted', 'draft']).order_by('submit_date', 'id')[:51]),
+        ('заявки по статусу и дате', 'mappool_status_submit_idx',
+         MapPool.objects.filter(status='completed', submit_date__range=[now - timezone.timedelta(days=30), now])),
+        ('карты заявки по порядку', 'unique_map_pool_rank',
+         MapMapPool.objects.filter(map_pool_id=1).order_by('rank')),
+        ('рейтинг популярности', 'popularity_rank_idx',
+         PopularityScore.objects.filter(scope='map').order_by('-score')[:10]),
+    ]
+    if trigram_enabled(connection.alias):
+        queries += [
+            ('поиск по подстроке названия', 'map_title_upper_trgm_idx',
+             Map.objects.filter(title__icontains='temple')),
+            ('нечёткий поиск по названию', 'map_title_trgm_idx',
+             Map.objects.filter(title__trigram_word_similar='temple')),
+        ]
+    return queries
+
+
+@skipUnless(connection.vendor == 'postgresql', 'EXPLAIN-проверка рассчитана на Postgres')
+class IndexUsageTests(TestCase):
+    """The hot queries have an index the planner can use."""
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            # On small tables the planner rightly prefers seq scans; we only want to
+            # know that a usable index exists for each query shape. LOCAL ends with
+            # the test's transaction.
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def test_hot_queries_use_indexes(self):
+        for title, index_name, queryset in planned_queries():
+            with self.subTest(title):
+                plan = queryset.explain()
+                self.assertIn(index_name, plan, f'{title}: план не использует {index_name}\n{plan}')
@@ -0,0 +1,58 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from bmstu_lab.models import Map, MapMapPool, MapPool
+from bmstu_lab.pools import RANK_STEP
+from bmstu_lab.sessions import create_session, delete_session
+
+
+class MapPoolMapsTests(TestCase):
+    """PATCH /api/map_pools/<id>/maps/ edits drafts only."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.player = User.objects.create_user('pool-maps-player', password='pw')
+        cls.maps = [
+            Map.objects.create(title=f'Карта {index}', description='d', image_url='', players='1v1',
+                               tileset='t', overview='o')
+            for index in range(3)
+        ]
+
+    def setUp(self):
+        self.session_id = create_session(self.player)
+        self.client.cookies['session_id'] = self.session_id
+
+    def tearDown(self):
+        delete_session(self.session_id)
+
+    def make_pool(self, status):
+        map_pool = MapPool.objects.create(user=self.player, status=status, player_login='player',
+                                          submit_date=None if status == 'draft' else timezone.now())
+        for index, map_obj in enumerate(self.maps[:2], start=1):
+            MapMapPool.objects.create(map_pool=map_pool, map=map_obj, rank=index * RANK_STEP)
+        return map_pool
+
+    def pool_map_ids(self, map_pool):
+        return list(MapMapPool.objects.filter(map_pool=map_pool).order_by('rank').values_list('map_id', flat=True))
+
+    def patch(self, map_pool, map_ids):
+        return self.client.patch(reverse('map_pool-maps', args=[map_pool.id]), {'maps': map_ids},
+                                 content_type='application/json')
+
+    def test_draft(self):
+        map_pool = self.make_pool('draft')
+        new_order = [self.maps[2].id, self.maps[0].id]
+        response = self.patch(map_pool, new_order)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.pool_map_ids(map_pool), new_order)
+
+    def test_not_draft(self):
+        for status in ('submitted', 'completed', 'rejected', 'deleted'):
+            with self.subTest(status=status):
+                map_pool = self.make_pool(status)
+                before = self.pool_map_ids(map_pool)
+                response = self.patch(map_pool, [self.maps[2].id])
+                self.assertEqual(response.status_code, 400, response.content)
+                self.assertEqual(self.pool_map_ids(map_pool), before)
@@ -0,0 +1,87 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from bmstu_lab.cache import bump_catalogue_version
+from bmstu_lab.models import Map, MapMapPool, MapPool
+from bmstu_lab.pools import RANK_STEP
+from bmstu_lab.sessions import create_session, delete_session
+
+from .utils import QueryBudget
+
+
+class QueryCountTests(TestCase):
+    """The read endpoints run a fixed number of queries, however many rows they return."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.moderator = User.objects.create_user('query-count-moderator', password='pw', is_staff=True)
+        cls.player = User.objects.create_user('query-count-player', password='pw')
+        cls.maps = [
+            Map.objects.create(title=f'Карта {index}', description='d', image_url='', players='1v1',
+                               tileset='t', overview='o')
+            for index in range(6)
+        ]
+
+    def setUp(self):
+        self.sessions = []
+        # A new catalogue version, so the first read really builds the page.
+        bump_catalogue_version()
+
+    def tearDown(self):
+        for session_id in self.sessions:
+            delete_session(session_id)
+
+    def log_in(self, user):
+        session_id = create_session(user)
+        self.sessions.append(session_id)
+        self.client.cookies['session_id'] = session_id
+
+    def add_pools(self, count, status='submitted'):
+        for _ in range(count):
+            map_pool = MapPool.objects.create(user=self.player, status=status, submit_date=timezone.now(),
+                                              player_login='player')
+            for index, map_obj in enumerate(self.maps[:3], start=1):
+                MapMapPool.objects.create(map_pool=map_pool, map=map_obj, rank=index * RANK_STEP)
+        return map_pool
+
+    def count_queries(self, url, max_queries):
+        with QueryBudget(max_queries, name=url) as budget:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(budget.queries)
+
+    def test_catalogue(self):
+        url = reverse('map-list')
+        cold = self.count_queries(url, 1)
+        self.assertEqual(self.count_queries(url, 0), 0)
+
+        Map.objects.bulk_create(Map(title=f'Ещё {index}', description='d', image_url='', players='1v1',
+                                    tileset='t', overview='o') for index in range(20))
+        bump_catalogue_version()
+        self.assertEqual(self.count_queries(url, 1), cold)
+
+    def test_catalogue_with_draft(self):
+        self.add_pools(1, status='draft')
+        self.log_in(self.player)
+        # The page comes from the cache; the draft summary is one more query.
+        self.count_queries(reverse('map-list'), 2)
+
+    def test_pool_list(self):
+        url = reverse('map_pool_list')
+        self.add_pools(2)
+        for user in (self.moderator, self.player):
+            with self.subTest(user=user.username):
+                self.log_in(user)
+                few = self.count_queries(url, 3)
+                self.add_pools(5)
+                self.assertEqual(self.count_queries(url, 3), few)
+
+    def test_pool_detail(self):
+        map_pool = self.add_pools(1)
+        self.log_in(self.player)
+        self.count_queries(reverse('map_pool-detail', args=[map_pool.id]), 3)
+
+    def test_popularity(self):
+        self.count_queries(reverse('popularity') + '?scope=map', 2)
@@ -0,0 +1,39 @@
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryBudget:
+    """
+    Counts SQL queries run inside the block and fails when there are more than
+    ``max_queries``. Unlike assertNumQueries it hooks every alias in DATABASES,
+    so reads routed to a replica count too, and it keeps the SQL for the message.
+    """
+
+    def __init__(self, max_queries, name=None):
+        self.max_queries = max_queries
+        self.name = name or 'block'
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        with ExitStack() as stack:
+            for alias in settings.DATABASES:
+                stack.enter_context(connections[alias].execute_wrapper(self))
+            self._wrappers = stack.pop_all()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._wrappers.__exit__(exc_type, exc_value, traceback)
+        if exc_type is None and len(self.queries) > self.max_queries:
+            raise QueryBudgetExceeded(f"{self.name}: {len(self.queries)} SQL queries, budget is "
+                                      f"{self.max_queries}:\n" + "\n".join(self.queries))
+        return False
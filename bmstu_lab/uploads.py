@@ -0,0 +1,354 @@
+import hashlib
+import inspect
+import io
+import json
+import mimetypes
+import uuid
+from datetime import timedelta
+
+import minio
+from django.conf import settings
+from django.core import checks
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+from django.utils import timezone
+from minio import Minio, S3Error
+from minio.commonconfig import REPLACE, CopySource
+from minio.datatypes import Part, PostPolicy
+from minio.helpers import MIN_PART_SIZE
+from rest_framework import status
+
+from .clients import get_minio, get_redis
+
+
+class UploadRejected(Exception):
+    def __init__(self, message, status_code=status.HTTP_400_BAD_REQUEST):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+EXTENSIONS = {
+    'image/webp': 'webp',
+    'image/avif': 'avif',
+    'image/png': 'png',
+    'image/jpeg': 'jpg',
+    'image/gif': 'gif',
+}
+
+
+def content_object_name(sha256, content_type):
+    extension = EXTENSIONS.get(content_type) or (mimetypes.guess_extension(content_type) or '.bin').lstrip('.')
+    return f"{settings.IMAGE_OBJECT_PREFIX}{sha256[:2]}/{sha256}.{extension}"
+
+
+def immutable_headers(content_type):
+    # Content-addressed keys never change meaning, so caches may keep them forever.
+    return {'Content-Type': content_type, 'Cache-Control': settings.IMAGE_CACHE_CONTROL}
+
+
+class MultipartUpload:
+    """
+    The one place that uses minio's private multipart calls. The public client
+    only uploads by pulling from a stream (put_object), while upload handlers
+    push chunks as the request body arrives. Written against the minio version
+    pinned in requirements.txt; check_minio_multipart() fails ``manage.py
+    check`` if an upgrade changes these signatures.
+    """
+    METHODS = {
+        '_create_multipart_upload': ['bucket_name', 'object_name', 'headers'],
+        '_upload_part': ['bucket_name', 'object_name', 'data', 'headers', 'upload_id', 'part_number'],
+        '_complete_multipart_upload': ['bucket_name', 'object_name', 'upload_id', 'parts'],
+        '_abort_multipart_upload': ['bucket_name', 'object_name', 'upload_id'],
+    }
+
+    def __init__(self, bucket_name, object_name, content_type):
+        self.bucket_name = bucket_name
+        self.object_name = object_name
+        self.parts = []
+        self.upload_id = get_minio()._create_multipart_upload(bucket_name, object_name,
+                                                               {'Content-Type': content_type})
+
+    def upload_part(self, data):
+        part_number = len(self.parts) + 1
+        etag = get_minio()._upload_part(self.bucket_name, self.object_name, data, None, self.upload_id,
+                                        part_number)
+        self.parts.append(Part(part_number, etag))
+
+    def complete(self):
+        get_minio()._complete_multipart_upload(self.bucket_name, self.object_name, self.upload_id, self.parts)
+
+    def abort(self):
+        get_minio()._abort_multipart_upload(self.bucket_name, self.object_name, self.upload_id)
+
+
+@checks.register()
+def check_minio_multipart(app_configs, **kwargs):
+    errors = []
+    for name, expected in MultipartUpload.METHODS.items():
+        method = getattr(Minio, name, None)
+        if method is None:
+            found = 'missing'
+        else:
+            parameters = list(inspect.signature(method).parameters)[1:]
+            if parameters == expected:
+                continue
+            found = f'({", ".join(parameters)})'
+        errors.append(checks.Error(
+            f'Minio.{name} is {found}; MultipartUpload calls it as ({", ".join(expected)})',
+            hint=f'minio {minio.__version__} is not the version uploads.py was written for; '
+                 'install the one pinned in requirements.txt or update MultipartUpload.',
+            id='bmstu_lab.E001',
+        ))
+    return errors
+
+
+class MinioObjectWriter:
+    """
+    Streams bytes into MinIO under a content-addressed name. Data is sent as a
+    multipart upload to a temporary key in ``part_size`` pieces, so at most one
+    part is ever held in memory. The final name depends on the SHA-256 and is
+    only known at ``close()``; ``publish()`` then copies the object there
+    server-side. Objects smaller than one part stay in memory and go out as a
+    single PUT.
+    """
+
+    def __init__(self, content_type, part_size=None):
+        self.bucket_name = settings.MINIO_STORAGE_BUCKET_NAME
+        self.content_type = content_type
+        self.part_size = max(part_size or settings.MINIO_UPLOAD_PART_SIZE, MIN_PART_SIZE)
+        self.temp_name = f"{settings.UPLOAD_TEMP_PREFIX}{uuid.uuid4().hex}"
+        self.object_name = None
+        self.sha256 = None
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._buffer = bytearray()
+        self._upload = None
+        self._completed = False
+
+    @classmethod
+    def from_object(cls, object_name, content_type):
+        """
+        Wraps an object a client already put under the temporary prefix (presigned
+        POST) so it can be published like a streamed one. The bytes are read back
+        once, inside the cluster, to compute the digest.
+        """
+        writer = cls(content_type)
+        writer.temp_name = object_name
+        response = get_minio().get_object(writer.bucket_name, object_name)
+        try:
+            for chunk in response.stream(writer.part_size):
+                writer._hash.update(chunk)
+                writer.size += len(chunk)
+        finally:
+            response.close()
+            response.release_conn()
+        writer._completed = True
+        writer.close()
+        return writer
+
+    def write(self, data):
+        self._hash.update(data)
+        self.size += len(data)
+        self._buffer += data
+        while len(self._buffer) >= self.part_size:
+            self._upload_part(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+
+    def _upload_part(self, data):
+        if self._upload is None:
+            self._upload = MultipartUpload(self.bucket_name, self.temp_name, self.content_type)
+        self._upload.upload_part(data)
+
+    def close(self):
+        """Finishes receiving data and returns the content-addressed object name."""
+        if self._upload is not None:
+            if self._buffer:
+                self._upload_part(bytes(self._buffer))
+                self._buffer = bytearray()
+            self._upload.complete()
+            self._upload = None
+            self._completed = True
+        self.sha256 = self._hash.hexdigest()
+        self.object_name = content_object_name(self.sha256, self.content_type)
+        return self.object_name
+
+    def publish(self):
+        """Stores the data under ``object_name``."""
+        client = get_minio()
+        if self._completed:
+            client.copy_object(self.bucket_name, self.object_name, CopySource(self.bucket_name, self.temp_name),
+                               metadata=immutable_headers(self.content_type), metadata_directive=REPLACE)
+        else:
+            client.put_object(self.bucket_name, self.object_name, io.BytesIO(bytes(self._buffer)),
+                              len(self._buffer), content_type=self.content_type,
+                              metadata={'Cache-Control': settings.IMAGE_CACHE_CONTROL})
+        self.discard()
+
+    def discard(self):
+        """Drops whatever was received but not published: buffered bytes and the temporary object."""
+        self._buffer = bytearray()
+        if self._upload is not None:
+            self._upload.abort()
+            self._upload = None
+        if self._completed:
+            get_minio().remove_object(self.bucket_name, self.temp_name)
+            self._completed = False
+
+
+class StoredObject(UploadedFile):
+    """
+    What ``request.FILES`` holds once a file was streamed straight to MinIO.
+    The data is not under its final name yet: ``utils.add_image`` publishes it.
+    """
+
+    def __init__(self, writer, file_name):
+        super().__init__(file=None, name=file_name, content_type=writer.content_type, size=writer.size)
+        self.writer = writer
+        self.object_name = writer.object_name
+        self.sha256 = writer.sha256
+
+
+class MinioImageUploadHandler(FileUploadHandler):
+    """
+    Upload handler for map images: validates size and content type before the
+    body is read and pipes the ``image`` field into MinIO chunk by chunk
+    instead of buffering it in memory or in a temporary file.
+    """
+    image_field = 'image'
+
+    def __init__(self, request):
+        super().__init__(request)
+        self.writer = None
+        self.stored = None
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # Multipart framing adds a little on top of the file itself.
+        if content_length and content_length > settings.MAP_IMAGE_MAX_SIZE + 64 * 1024:
+            raise UploadRejected('Изображение слишком большое', status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None,
+                 content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self.writer = None
+        if field_name != self.image_field or self.stored is not None:
+            # Any other file part is read and dropped.
+            raise StopFutureHandlers()
+        if content_type not in settings.MAP_IMAGE_CONTENT_TYPES:
+            raise UploadRejected('Недопустимый тип изображения', status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        self.writer = MinioObjectWriter(content_type)
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.writer is None:
+            return None
+        if self.writer.size + len(raw_data) > settings.MAP_IMAGE_MAX_SIZE:
+            self.writer.discard()
+            raise UploadRejected('Изображение слишком большое', status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        try:
+            self.writer.write(raw_data)
+        except S3Error:
+            self.writer.discard()
+            raise
+        return None
+
+    def file_complete(self, file_size):
+        if self.writer is None:
+            return None
+        self.writer.close()
+        self.stored = StoredObject(self.writer, self.file_name)
+        self.writer = None
+        return self.stored
+
+    def upload_interrupted(self):
+        if self.writer is not None:
+            self.writer.discard()
+
+
+def discard_upload(request):
+    """Removes the image MinioImageUploadHandler already streamed for a request that is turned away."""
+    for handler in request.upload_handlers:
+        if isinstance(handler, MinioImageUploadHandler) and handler.stored is not None:
+            handler.stored.writer.discard()
+            handler.stored = None
+
+
+PENDING_UPLOAD_PREFIX = 'upload:'
+
+
+def bucket_url():
+    scheme = 'https' if settings.MINIO_STORAGE_USE_HTTPS else 'http'
+    return f"{scheme}://{settings.MINIO_STORAGE_ENDPOINT}/{settings.MINIO_STORAGE_BUCKET_NAME}/"
+
+
+def create_presigned_upload(map_obj, content_type):
+    """
+    Issues a presigned POST that lets the client send the image straight to
+    MinIO. The policy pins the key, the content type and the size range, which
+    a presigned PUT cannot express.
+    """
+    if content_type not in settings.MAP_IMAGE_CONTENT_TYPES:
+        raise UploadRejected('Недопустимый тип изображения', status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+    upload_id = uuid.uuid4().hex
+    object_name = f"{settings.UPLOAD_TEMP_PREFIX}{upload_id}"
+    expires_at = timezone.now() + timedelta(seconds=settings.MAP_IMAGE_PRESIGN_EXPIRY)
+    policy = PostPolicy(settings.MINIO_STORAGE_BUCKET_NAME, expires_at)
+    policy.add_equals_condition('key', object_name)
+    policy.add_equals_condition('Content-Type', content_type)
+    policy.add_content_length_range_condition(1, settings.MAP_IMAGE_MAX_SIZE)
+    fields = get_minio().presigned_post_policy(policy)
+    fields.update({'key': object_name, 'Content-Type': content_type})
+    pending = {'map_id': map_obj.id, 'object_name': object_name, 'content_type': content_type}
+    get_redis().set(PENDING_UPLOAD_PREFIX + upload_id, json.dumps(pending), ex=settings.MAP_IMAGE_PRESIGN_EXPIRY)
+    return {'upload_id': upload_id, 'url': bucket_url(), 'fields': fields, 'expires_at': expires_at.isoformat()}
+
+
+def claim_presigned_upload(map_obj, upload_id):
+    """
+    Checks the object a presigned upload produced and returns it as a StoredObject.
+    The pending entry is taken atomically, so a concurrent claim gets a 404;
+    when the object cannot be read or published, restore_presigned_upload puts
+    the entry back so the client can retry.
+    """
+    key = PENDING_UPLOAD_PREFIX + str(upload_id)
+    pipe = get_redis().pipeline()
+    pipe.get(key)
+    pipe.ttl(key)
+    pipe.delete(key)
+    raw, ttl, _ = pipe.execute()
+    pending = json.loads(raw) if raw else None
+    if pending is None or pending['map_id'] != map_obj.id:
+        if pending is not None:
+            _restore(key, raw, ttl)
+        raise UploadRejected('Загрузка не найдена или истекла', status.HTTP_404_NOT_FOUND)
+    client = get_minio()
+    try:
+        try:
+            stat = client.stat_object(settings.MINIO_STORAGE_BUCKET_NAME, pending['object_name'])
+        except S3Error as e:
+            if e.code in ('NoSuchKey', 'NoSuchObject'):
+                raise UploadRejected('Файл ещё не загружен')
+            raise
+        # MinIO enforced the policy already; this guards against a policy that was changed since.
+        if stat.size > settings.MAP_IMAGE_MAX_SIZE or stat.content_type != pending['content_type']:
+            client.remove_object(settings.MINIO_STORAGE_BUCKET_NAME, pending['object_name'])
+            # Nothing left to retry with.
+            raw = None
+            raise UploadRejected('Загруженный файл не соответствует запросу')
+        writer = MinioObjectWriter.from_object(pending['object_name'], pending['content_type'])
+    except Exception:
+        if raw is not None:
+            _restore(key, raw, ttl)
+        raise
+    stored = StoredObject(writer, upload_id)
+    stored.pending = (key, raw, ttl)
+    return stored
+
+
+def restore_presigned_upload(stored):
+    """Makes a claimed upload claimable again after publishing it failed."""
+    _restore(*stored.pending)
+
+
+def _restore(key, raw, ttl):
+    get_redis().set(key, raw, ex=ttl if ttl > 0 else settings.MAP_IMAGE_PRESIGN_EXPIRY)
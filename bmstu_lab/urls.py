@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path, include
 from drf_yasg import openapi
 from drf_yasg.views import get_schema_view
@@ -5,14 +6,19 @@ from rest_framework import permissions
 from rest_framework import routers
 
 from . import views
+from .metrics import metrics_view
 from .views import (
-    MapList, MapDetail, AddMapToDraft,
-    UploadImageForMap,
-    MapPoolListView, MapPoolDetailView,
+    MapList, MapDetail, AddMapToDraft, MapBulkImport, MapExport,
+    UploadImageForMap, MapImageUploadURL, CompleteMapImageUpload,
+    MapPoolListView, MapPoolDetailView, MapPoolMapsView,
     MapPoolSubmitView, CompleteOrRejectMapPool, RemoveMapFromMapPool,
-    UpdateMapPosition, RegisterView, UserLogin, ProfileView
+    UpdateMapPosition, PopularityView, RegisterView, UserLogin, ProfileView
 )
 
+if settings.ASYNC_VIEWS:
+    # Same URLs and responses; the I/O-bound endpoints no longer block the event loop.
+    from .async_views import MapList, MapDetail, UploadImageForMap  # noqa: F811
+
 router = routers.DefaultRouter()
 # router.register(r'user', views.UserViewSet, basename='user')
 schema_view = get_schema_view(
@@ -30,11 +36,17 @@ schema_view = get_schema_view(
 urlpatterns = [
     path('swagger.json', schema_view.without_ui(cache_timeout=0), name='schema-json'),
     path('api/maps/', MapList.as_view(), name='map-list'),
+    path('api/maps/bulk/', MapBulkImport.as_view(), name='map-bulk-import'),
+    path('api/maps/export/', MapExport.as_view(), name='map-export'),
     path('api/maps/<int:id>/', MapDetail.as_view(), name='map-detail'),
     path('api/maps/<int:id>/image/', UploadImageForMap.as_view(), name='upload-image'),
+    path('api/maps/<int:id>/image/upload_url/', MapImageUploadURL.as_view(), name='image-upload-url'),
+    path('api/maps/<int:id>/image/complete/', CompleteMapImageUpload.as_view(), name='image-upload-complete'),
     path('api/maps/draft/', AddMapToDraft.as_view(), name='add-map-to-draft'),
     path('api/map_pools/', MapPoolListView.as_view(), name='map_pool_list'),
+    path('api/popularity/', PopularityView.as_view(), name='popularity'),
     path('api/map_pools/<int:id>/', MapPoolDetailView.as_view(), name='map_pool-detail'),
+    path('api/map_pools/<int:id>/maps/', MapPoolMapsView.as_view(), name='map_pool-maps'),
     path('api/map_pools/<int:id>/submit/', MapPoolSubmitView.as_view(), name='map_pool-submit'),
     path('api/map_pools/<int:id>/complete/', CompleteOrRejectMapPool.as_view(), name='map_pool-complete'),
     path('api/users/register/', RegisterView.as_view(), name='user-register'),
@@ -48,4 +60,6 @@ urlpatterns = [
     path('api/', include(router.urls)),
     path('api/users/login/', UserLogin.as_view(), name='login'),
     path('api/users/logout/', views.logout_view, name='logout'),
+    # Scraped by Prometheus; keep it off the public proxy.
+    path('metrics', metrics_view, name='metrics'),
 ]
@@ -1,24 +1,168 @@
+import posixpath
+from collections import Counter
+from datetime import timedelta
+from urllib.parse import urlparse
+
 from django.conf import settings
-from minio import Minio, S3Error
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from minio import S3Error
 from rest_framework import status
 from rest_framework.response import Response
 
+from .clients import get_minio
+from .jobs import job
+from .models import Map, StoredImage
+from .uploads import MinioObjectWriter, StoredObject
+
+
+def object_url(object_name):
+    return f"http://{settings.MINIO_STORAGE_ENDPOINT}/{settings.MINIO_STORAGE_BUCKET_NAME}/{object_name}"
+
+
+def object_name_from_url(image_url):
+    """Turns http://host/<bucket>/<object> back into <object>."""
+    path = urlparse(image_url).path.lstrip('/')
+    bucket_prefix = f"{settings.MINIO_STORAGE_BUCKET_NAME}/"
+    return path[len(bucket_prefix):] if path.startswith(bucket_prefix) else path
+
+
+def image_link(image_url):
+    """The URL clients should load an image from: the object URL, or a presigned GET for a private bucket."""
+    if not image_url or not settings.MINIO_PRESIGNED_GET:
+        return image_url
+    return get_minio().presigned_get_object(settings.MINIO_STORAGE_BUCKET_NAME, object_name_from_url(image_url),
+                                            expires=timedelta(seconds=settings.MINIO_PRESIGNED_GET_EXPIRY))
+
+
+@job('storage.remove_objects')
+def remove_objects(object_names):
+    """Deletes objects from the bucket; objects that are already gone count as deleted."""
+    for object_name in object_names:
+        try:
+            get_minio().remove_object(settings.MINIO_STORAGE_BUCKET_NAME, object_name)
+        except S3Error as e:
+            if e.code != 'NoSuchKey':
+                raise
+
+
+def acquire_object(writer):
+    """
+    Adds a reference to the writer's content-addressed object, committing
+    before anything is written so a concurrent collect_object cannot delete
+    it underneath. Returns True when the bytes are already in the bucket.
+    """
+    while True:
+        with transaction.atomic():
+            stored_image = StoredImage.objects.select_for_update().filter(object_name=writer.object_name).first()
+            if stored_image is not None:
+                StoredImage.objects.filter(pk=stored_image.pk).update(ref_count=F('ref_count') + 1)
+                return stored_image.stored
+            try:
+                with transaction.atomic():
+                    StoredImage.objects.create(object_name=writer.object_name, sha256=writer.sha256,
+                                               content_type=writer.content_type, size=writer.size, ref_count=1)
+            except IntegrityError:
+                # Someone else created it first; lock theirs instead.
+                continue
+            return False
+
+
+def release_object(object_name):
+    """Drops one reference; the object is collected by a job once nothing points at it."""
+    released = StoredImage.objects.filter(object_name=object_name, ref_count__gt=0) \
+        .update(ref_count=F('ref_count') - 1)
+    # Objects without a row (external URLs set by hand) are not ours to delete.
+    if released and StoredImage.objects.filter(object_name=object_name, ref_count=0).exists():
+        collect_object.enqueue(object_name, key=f'collect:{object_name}')
+
+
+def relink_images(changes):
+    """
+    Moves references for image URLs set by hand (MapList.post, MapDetail.put,
+    bulk.MapImport): ``changes`` holds (old_url, new_url) pairs. Call it in the
+    transaction that saves the maps. URLs outside the bucket have no
+    StoredImage and are skipped; returns the object names that were ours.
+    """
+    acquired, released = Counter(), Counter()
+    for old_url, new_url in changes:
+        old_object_name = object_name_from_url(old_url) if old_url else None
+        new_object_name = object_name_from_url(new_url) if new_url else None
+        if old_object_name == new_object_name:
+            continue
+        if new_object_name:
+            acquired[new_object_name] += 1
+        if old_object_name:
+            released[old_object_name] += 1
+    linked = set()
+    for object_name, count in acquired.items():
+        if StoredImage.objects.filter(object_name=object_name).update(ref_count=F('ref_count') + count):
+            linked.add(object_name)
+    for object_name, count in released.items():
+        for _ in range(count):
+            release_object(object_name)
+    return linked
+
+
+@job('storage.collect_object')
+def collect_object(object_name):
+    """Deletes an unreferenced object together with the image variants derived from it."""
+    with transaction.atomic():
+        # Locking the row makes acquire_object wait until the object is gone, then store it again.
+        stored_image = StoredImage.objects.select_for_update().filter(object_name=object_name).first()
+        if stored_image is None or stored_image.ref_count > 0:
+            return
+        if Map.objects.filter(image_url=object_url(object_name)).exists():
+            # Linked by hand before such links were counted (relink_images); keep it and start counting again.
+            stored_image.ref_count = Map.objects.filter(image_url=object_url(object_name)).count()
+            stored_image.save(update_fields=['ref_count'])
+            return
+        derived = get_minio().list_objects(settings.MINIO_STORAGE_BUCKET_NAME,
+                                           prefix=f"{posixpath.splitext(object_name)[0]}/", recursive=True)
+        remove_objects([object_name] + [obj.object_name for obj in derived])
+        stored_image.delete()
+
 
 def add_image(map_obj, image):
-    try:
-        minio_client = Minio(
-            settings.MINIO_STORAGE_ENDPOINT,
-            access_key=settings.MINIO_STORAGE_ACCESS_KEY,
-            secret_key=settings.MINIO_STORAGE_SECRET_KEY,
-            secure=False
-        )
-        bucket_name = settings.MINIO_STORAGE_BUCKET_NAME
-        file_name = f"{map_obj.id}/{image.name}"
-
-        minio_client.put_object(bucket_name, file_name, image, len(image))
-        map_obj.image_url = f"http://{settings.MINIO_STORAGE_ENDPOINT}/{bucket_name}/{file_name}"
-        map_obj.save()
+    if isinstance(image, StoredObject):
+        writer = image.writer
+    else:
+        # Files that did not come through MinioImageUploadHandler are streamed
+        # here, so they get the same checks.
+        if image.content_type not in settings.MAP_IMAGE_CONTENT_TYPES:
+            return Response({'error': 'Недопустимый тип изображения'}, status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        if image.size is None or image.size > settings.MAP_IMAGE_MAX_SIZE:
+            return Response({'error': 'Изображение слишком большое'}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        writer = MinioObjectWriter(image.content_type)
+        try:
+            for chunk in image.chunks():
+                writer.write(chunk)
+            writer.close()
+        except S3Error as e:
+            writer.discard()
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    old_object_name = object_name_from_url(map_obj.image_url) if map_obj.image_url else None
+    if writer.object_name == old_object_name:
+        # Same bytes as before: nothing to store or to count.
+        writer.discard()
         return Response({'message': 'Image uploaded successfully'}, status=status.HTTP_200_OK)
+
+    already_stored = acquire_object(writer)
+    try:
+        if already_stored:
+            writer.discard()
+        else:
+            writer.publish()
+            StoredImage.objects.filter(object_name=writer.object_name).update(stored=True)
+        with transaction.atomic():
+            map_obj.image_url = object_url(writer.object_name)
+            map_obj.image_variants = {}
+            map_obj.save()
+            if old_object_name:
+                release_object(old_object_name)
     except S3Error as e:
+        release_object(writer.object_name)
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return Response({'message': 'Image uploaded successfully'}, status=status.HTTP_200_OK)
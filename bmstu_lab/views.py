@@ -1,20 +1,16 @@
-import random
-import uuid
-from urllib.parse import urlparse
-
-import redis
-from django.conf import settings
 from django.contrib.auth import authenticate, login
 from django.contrib.auth import logout
-from django.http import HttpResponse
+from django.db import transaction
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from django.utils.dateparse import parse_date
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie
+from django.views.decorators.http import condition
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
-from minio import S3Error, Minio
+from minio import S3Error
 from rest_framework import status
 from rest_framework.authtoken.admin import User
 from rest_framework.decorators import permission_classes, authentication_classes, api_view
@@ -22,29 +18,30 @@ from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from .authentication import session_cache, OptionalRedisSessionAuthentication, RedisSessionAuthentication
+from .bulk import MapImport, export_maps
+from .cache import get_catalogue_page
+from .etags import catalogue_etag, map_etag, map_pool_etag
+from .images import schedule_variants
 from .models import Map, MapPool, MapMapPool
+from .pagination import MapPagination, MapPoolPagination
+from .pools import PoolEditError, add_map, draft_summary, edit_pool_maps, lock_draft, move_map
+from .popularity import schedule_pool, top
+from .replicas import read_from_replica
+from .search import search_maps
 from .serializers import MapSerializer, MapMapPoolSerializer, \
-    MapPoolSerializer, DraftSerializer, \
+    MapPoolSerializer, MapPoolMapsSerializer, DraftSerializer, \
     CompleteSerializer, RegisterSerializer, LoginSerializer, PlayerLoginSerializer, \
-    MapFilterSerializer, MapPoolFilterSerializer, UserProfileSerializer
-from .utils import add_image
-
-minio_client = Minio(settings.MINIO_STORAGE_ENDPOINT,
-                     access_key=settings.MINIO_STORAGE_ACCESS_KEY,
-                     secret_key=settings.MINIO_STORAGE_SECRET_KEY,
-                     secure=settings.MINIO_STORAGE_USE_HTTPS)
-
-session_storage = redis.StrictRedis(host=settings.REDIS_HOST, port=settings.REDIS_PORT)
+    MapFilterSerializer, MapPoolFilterSerializer, PopularityFilterSerializer, PopularityScoreSerializer, \
+    UserProfileSerializer
+from .sessions import create_session, delete_session, update_user_sessions
+from .uploads import MinioImageUploadHandler, UploadRejected, claim_presigned_upload, create_presigned_upload, \
+    discard_upload, restore_presigned_upload
+from .utils import add_image, object_name_from_url, release_object, relink_images
 
 
 # def get_creator():
 #   return User.objects.get(username=settings.CREATOR_USERNAME)
-def extract_between_quotes(data):
-    if isinstance(data, bytes):
-        data = data.decode('utf-8')
-    if data.startswith("'") and data.endswith("'"):
-        return data[1:-1]
-    return data
 
 
 def method_permission_classes(classes):
@@ -59,87 +56,119 @@ def method_permission_classes(classes):
     return decorator
 
 
+def catalogue_params(request, paginator):
+    return {
+        'title': request.query_params.get('title', ''),
+        'search': request.query_params.get('search', ''),
+        'cursor': request.query_params.get('cursor', ''),
+        'page_size': paginator.get_page_size(request),
+    }
+
+
+def build_catalogue_page(request, paginator, params):
+    maps = Map.objects.filter(status='active')
+    if params['title']:
+        maps = maps.filter(title__icontains=params['title'])
+    if params['search']:
+        # Ranked results are not keyset-paginated: only the best page_size hits are returned.
+        page = search_maps(maps, params['search'], params['page_size'])
+        paginator.next_cursor = None
+    else:
+        page = paginator.paginate_queryset(maps, request)
+    return {'maps': MapSerializer(page, many=True).data, 'next_cursor': paginator.next_cursor}
+
+
+def catalogue_data(request, paginator, catalogue, authenticated, draft):
+    paginator.restore(request, catalogue['next_cursor'])
+    draft_pool_id = None
+    draft_pool_count = None
+    if authenticated:
+        draft_pool_id, draft_pool_count = (draft[0], draft[2]) if draft else (None, 0)
+    return {
+        'maps': catalogue['maps'],
+        'draft_pool_id': draft_pool_id,
+        'draft_pool_count': draft_pool_count,
+        'next': paginator.get_next_link(),
+    }
+
+
 class MapList(APIView):
     # permission_classes = [IsAuthenticated]
-    authentication_classes = []
+    authentication_classes = [RedisSessionAuthentication]
     # authentication_classes = [SessionAuthentication, BasicAuthentication]
     permission_classes = [AllowAny]
 
     @csrf_exempt
     @swagger_auto_schema(query_serializer=MapFilterSerializer, responses={200: MapFilterSerializer(many=True)})
+    @read_from_replica
+    @method_decorator(condition(etag_func=catalogue_etag))
     def get(self, request):
-        ssid = request.COOKIES.get("session_id")
-        username = None
-        real_user = None
-        if ssid:
-            username = session_storage.get(ssid)
-            if isinstance(username, bytes):
-                username = username.decode('utf-8')
-            real_user = extract_between_quotes(username)
-            if not username:
-                return Response({"status": "error", "error": "Invalid session"}, status=status.HTTP_403_FORBIDDEN)
-        is_staff = False
-        if real_user:
-            if real_user:
-                user = User.objects.filter(username=real_user).first()
-            if user:
-                is_staff = user.is_staff
-        maps = Map.objects.filter(status='active')
-        title = request.query_params.get('title', None)
-        if title:
-            maps = maps.filter(title__icontains=title)
-        serializer = MapSerializer(maps, many=True)
-        draft_pool_id = None
-        draft_pool_count = None
-        if real_user is not None:
-            draft_map_pool = MapPool.objects.filter(user=user, status='draft').first()
-            draft_pool_id = draft_map_pool.id if draft_map_pool else None
-            draft_pool_count = draft_map_pool.mapmappool.count() if draft_map_pool else 0
-        return Response({
-            'maps': serializer.data,
-            'draft_pool_id': draft_pool_id,
-            'draft_pool_count': draft_pool_count
-        })
+        paginator = MapPagination()
+        params = catalogue_params(request, paginator)
+        catalogue = get_catalogue_page(params, lambda: build_catalogue_page(request, paginator, params))
+        # Already read by catalogue_etag; the count is kept on the pool itself.
+        authenticated = request.user.is_authenticated
+        draft = draft_summary(request) if authenticated else None
+        return Response(catalogue_data(request, paginator, catalogue, authenticated, draft),
+                        headers=paginator.get_headers())
 
     # @method_permission_classes((IsAdmin,))
     @swagger_auto_schema(request_body=MapSerializer)
     @csrf_exempt
     def post(self, request):
-        ssid = request.COOKIES.get("session_id")
-        username = None
-        real_user = None
-        if ssid:
-            username = session_storage.get(ssid)
-            if isinstance(username, bytes):
-                username = username.decode('utf-8')
-            if username:
-                real_user = extract_between_quotes(username)
-            else:
-                return Response({"status": "error", "error": "Invalid session"}, status=status.HTTP_403_FORBIDDEN)
-            if not real_user:
-                return Response({"status": "error", "error": "Invalid session"}, status=status.HTTP_403_FORBIDDEN)
-        is_staff = False
-        if real_user:
-            if real_user:
-                user = User.objects.filter(username=real_user).first()
-            if user:
-                is_staff = user.is_staff
-
-        if is_staff == False:
+        if not request.user.is_staff:
             return Response({'status': 'error', 'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
         serializer = MapSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            with transaction.atomic():
+                map_obj = serializer.save()
+                relink_images([(None, map_obj.image_url)])
+            schedule_variants(map_obj)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class MapBulkImport(APIView):
+    permission_classes = [AllowAny]
+
+    @swagger_auto_schema(
+        operation_description='Тело запроса — NDJSON: по одной карте в строке. Строки с id обновляют карту, '
+                              'остальные создают новую. ?strict=1 отменяет весь импорт при любой ошибке.',
+    )
+    def post(self, request):
+        if not request.user.is_staff:
+            return Response({'status': 'error', 'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+        # The body is read line by line straight from the socket, never as a whole. Form
+        # bodies are the one kind Django has already parsed (for the CSRF token) by now.
+        if request.content_type.startswith(('multipart/form-data', 'application/x-www-form-urlencoded')):
+            return Response({'status': 'error', 'error': 'Ожидается NDJSON: по одной карте в строке'},
+                            status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        strict = request.query_params.get('strict') in ('1', 'true')
+        result = MapImport(strict=strict).run(request._request)
+        if strict and result['errors']:
+            return Response(result, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result, status=status.HTTP_200_OK)
+
+
+class MapExport(APIView):
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        if not request.user.is_staff:
+            return Response({'status': 'error', 'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+        response = StreamingHttpResponse(export_maps(), content_type='application/x-ndjson; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename="maps.ndjson"'
+        return response
+
+
 class MapDetail(APIView):
     # permission_classes = [IsAuthenticated]
-    authentication_classes = []
+    authentication_classes = [OptionalRedisSessionAuthentication]
     # authentication_classes = [SessionAuthentication, BasicAuthentication]
     permission_classes = [AllowAny]
 
+    @read_from_replica
+    @method_decorator(condition(etag_func=map_etag))
     def get(self, request, id):
         try:
             map_obj = Map.objects.get(id=id, status='active')
@@ -151,63 +180,33 @@ class MapDetail(APIView):
     @swagger_auto_schema(request_body=MapSerializer)
     @csrf_exempt
     def put(self, request, id):
-        ssid = request.COOKIES.get("session_id")
-        username = None
-        real_user = None
-        if ssid:
-            username = session_storage.get(ssid)
-            if isinstance(username, bytes):
-                username = username.decode('utf-8')
-            real_user = extract_between_quotes(username)
-            if not username:
-                return Response({"status": "error", "error": "Invalid session"}, status=status.HTTP_403_FORBIDDEN)
-        is_staff = False
-        if real_user:
-            if real_user:
-                user = User.objects.filter(username=real_user).first()
-            if user:
-                is_staff = user.is_staff
-
-        if is_staff == False:
+        if not request.user.is_staff:
             return Response({'status': 'error', 'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
-        map_obj = get_object_or_404(Map, id=id)
-        serializer = MapSerializer(map_obj, data=request.data)
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            # Locked, so two edits of image_url cannot both release the same old object.
+            map_obj = get_object_or_404(Map.objects.select_for_update(), id=id)
+            old_image_url = map_obj.image_url
+            serializer = MapSerializer(map_obj, data=request.data)
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            image_changed = serializer.validated_data.get('image_url', old_image_url) != old_image_url
+            # Variants of the old image are dropped along with its reference.
+            map_obj = serializer.save(**({'image_variants': {}} if image_changed else {}))
+            if image_changed:
+                relink_images([(old_image_url, map_obj.image_url)])
+        if image_changed:
+            schedule_variants(map_obj)
+        return Response(serializer.data, status=status.HTTP_200_OK)
 
     @csrf_exempt
     def delete(self, request, id):
-        ssid = request.COOKIES.get("session_id")
-        username = None
-        real_user = None
-        if ssid:
-            username = session_storage.get(ssid)
-            if isinstance(username, bytes):
-                username = username.decode('utf-8')
-            real_user = extract_between_quotes(username)
-            if not username:
-                return Response({"status": "error", "error": "Invalid session"}, status=status.HTTP_403_FORBIDDEN)
-        is_staff = False
-        if real_user:
-            if real_user:
-                user = User.objects.filter(username=real_user).first()
-            if user:
-                is_staff = user.is_staff
-
-        if is_staff == False:
+        if not request.user.is_staff:
             return Response({'status': 'error', 'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
         map_obj = get_object_or_404(Map, id=id)
-        if map_obj.image_url:
-            try:
-                parsed_url = urlparse(map_obj.image_url)
-                object_name = parsed_url.path.lstrip('/')
-                minio_client.remove_object(settings.MINIO_STORAGE_BUCKET_NAME, object_name)
-            except S3Error as e:
-                return Response({'error': f"Ошибка при удалении из Minio: {str(e)}"},
-                                status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        map_obj.delete()
+        with transaction.atomic():
+            map_obj.delete()
+            if map_obj.image_url:
+                release_object(object_name_from_url(map_obj.image_url))
         return Response({'message': 'Карта успешно удалена'}, status=status.HTTP_204_NO_CONTENT)
 
 
@@ -218,22 +217,8 @@ class AddMapToDraft(APIView):
     @csrf_exempt
     @swagger_auto_schema(request_body=DraftSerializer)
     def post(self, request):
-        ssid = request.COOKIES.get("session_id")
-        username = None
-        real_user = None
-        if ssid:
-            username = session_storage.get(ssid)
-            if isinstance(username, bytes):
-                username = username.decode('utf-8')
-            real_user = extract_between_quotes(username)
-            if not username:
-                return Response({"status": "error", "error": "Invalid session"}, status=status.HTTP_403_FORBIDDEN)
-        is_staff = False
-        if real_user:
-            user = User.objects.filter(username=real_user).first()
-            if user:
-                is_staff = user.is_staff
-
+        if not request.user.is_authenticated:
+            return Response({"status": "error", "error": "Invalid session"}, status=status.HTTP_403_FORBIDDEN)
         serializer = DraftSerializer(data=request.data)
         map_id = request.data.get('map_id')
         if not map_id:
@@ -242,27 +227,15 @@ class AddMapToDraft(APIView):
             map_obj = Map.objects.get(id=map_id)
         except Map.DoesNotExist:
             return Response({"error": "Карта не найдена"}, status=status.HTTP_404_NOT_FOUND)
-        map_pool = MapPool.objects.filter(user=user, status='draft').order_by('-creation_date').first()
-        if not map_pool:
-            map_pool = MapPool.objects.create(
-                status='draft',
-                player_login=None,
-                creation_date=timezone.now(),
-                complete_date=None,
-                user=user,
-                submit_date=None,
-                moderator=None,
-            )
-
-        if MapMapPool.objects.filter(map_pool=map_pool, map=map_obj).exists():
-            return Response({'error': 'Карта уже добавлена'}, status=status.HTTP_400_BAD_REQUEST)
-        current_position = MapMapPool.objects.filter(map_pool=map_pool).count() + 1
-        MapMapPool.objects.create(
-            map_pool=map_pool,
-            map=map_obj,
-            position=current_position
-        )
-        map_pool_serializer = MapPoolSerializer(map_pool)
+        # The draft is found or created and the map added under one lock, so parallel
+        # clicks end up in a single draft and a repeated map gets a 400, not a 500.
+        with transaction.atomic():
+            map_pool = lock_draft(request.user)
+            try:
+                add_map(map_pool.id, map_obj.id)
+            except PoolEditError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        map_pool_serializer = MapPoolSerializer(MapPool.objects.with_maps().get(id=map_pool.id))
         return Response({
             "message": "Карта успешно добавлена",
             "map_pool": map_pool_serializer.data
@@ -272,32 +245,15 @@ class AddMapToDraft(APIView):
 class MapPoolListView(APIView):
 
     @swagger_auto_schema(query_serializer=MapPoolFilterSerializer, responses={200: MapPoolFilterSerializer(many=True)})
+    @read_from_replica
     def get(self, request):
-        ssid = request.COOKIES.get("session_id")
-        username = None
-        real_user = None
-        user = None
-        if ssid:
-            username = session_storage.get(ssid)
-            if isinstance(username, bytes):
-                username = username.decode('utf-8')
-            real_user = extract_between_quotes(username)
-            if not username:
-                return Response({"status": "error", "error": "Invalid session"}, status=status.HTTP_403_FORBIDDEN)
-        is_staff = False
-        if real_user:
-            if real_user:
-                user = User.objects.filter(username=real_user).first()
-            if user:
-                is_staff = user.is_staff
-        map_pools = MapPool.objects.exclude(status__in=['deleted', 'draft'])
+        map_pools = MapPool.objects.with_maps().exclude(status__in=['deleted', 'draft'])
         # map_pools = MapPool.objects.exclude(status__in=['deleted'])
 
-        if user == None:
+        if not request.user.is_authenticated:
             return Response({"status": "error", "error": "Invalid session"}, status=status.HTTP_403_FORBIDDEN)
-        if is_staff == False:
-            map_pools = MapPool.objects.exclude(status__in=['deleted', 'draft'])
-            map_pools = map_pools.filter(user=user)
+        if not request.user.is_staff:
+            map_pools = map_pools.filter(user=request.user)
             # map_pools = MapPool.objects.all()
 
         start_date = request.query_params.get('start_date')
@@ -312,33 +268,21 @@ class MapPoolListView(APIView):
         if status_query:
             map_pools = map_pools.filter(status=status_query)
 
-        serializer = MapPoolSerializer(map_pools, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        paginator = MapPoolPagination()
+        page = paginator.paginate_queryset(map_pools, request)
+        serializer = MapPoolSerializer(page, many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK, headers=paginator.get_headers())
 
 
 class MapPoolDetailView(APIView):
     # @method_permission_classes((IsAuthenticated,))
     permission_classes = [AllowAny]
 
+    @read_from_replica
+    @method_decorator(condition(etag_func=map_pool_etag))
     def get(self, request, id):
-        ssid = request.COOKIES.get("session_id")
-        username = None
-        real_user = None
-        if ssid:
-            username = session_storage.get(ssid)
-            if isinstance(username, bytes):
-                username = username.decode('utf-8')
-            real_user = extract_between_quotes(username)
-            if not username:
-                return Response({"status": "error", "error": "Invalid session"}, status=status.HTTP_403_FORBIDDEN)
-        is_staff = False
-        if real_user:
-            if real_user:
-                user = User.objects.filter(username=real_user).first()
-            if user:
-                is_staff = user.is_staff
-        map_pool = get_object_or_404(MapPool, id=id)
-        if not is_staff and str(map_pool.user) != str(real_user):
+        map_pool = get_object_or_404(MapPool.objects.with_maps(), id=id)
+        if not request.user.is_staff and map_pool.user_id != request.user.id:
             return Response(status=status.HTTP_403_FORBIDDEN)
         serializer = MapPoolSerializer(map_pool)
         return Response(serializer.data)
@@ -346,25 +290,8 @@ class MapPoolDetailView(APIView):
     @swagger_auto_schema(request_body=PlayerLoginSerializer)
     # @method_permission_classes((IsAuthenticated,))
     def put(self, request, id):
-        ssid = request.COOKIES.get("session_id")
-        username = None
-        real_user = None
-        if ssid:
-            username = session_storage.get(ssid)
-            if isinstance(username, bytes):
-                username = username.decode('utf-8')
-            real_user = extract_between_quotes(username)
-            if not real_user:
-                return Response({"status": "error", "error": "Invalid session"}, status=status.HTTP_403_FORBIDDEN)
-        is_staff = False
-        if real_user:
-            if real_user:
-                user = User.objects.filter(username=real_user).first()
-            if user:
-                is_staff = user.is_staff
-
-        map_pool = get_object_or_404(MapPool, id=id)
-        if not is_staff and str(map_pool.user) != str(real_user):
+        map_pool = get_object_or_404(MapPool.objects.with_maps(), id=id)
+        if not request.user.is_staff and map_pool.user_id != request.user.id:
             return Response(status=status.HTTP_403_FORBIDDEN)
         player_login = request.data.get('player_login')
         if player_login == None:
@@ -376,25 +303,9 @@ class MapPoolDetailView(APIView):
 
     # @method_permission_classes((IsAuthenticated,))
     def delete(self, request, id):
-        ssid = request.COOKIES.get("session_id")
-        username = None
-        real_user = None
-        if ssid:
-            username = session_storage.get(ssid)
-            if isinstance(username, bytes):
-                username = username.decode('utf-8')
-            real_user = extract_between_quotes(username)
-            if not username:
-                return Response({"status": "error", "error": "Invalid session"}, status=status.HTTP_403_FORBIDDEN)
-        is_staff = False
-        if real_user:
-            if real_user:
-                user = User.objects.filter(username=real_user).first()
-            if user:
-                is_staff = user.is_staff
         try:
             map_pool = MapPool.objects.get(id=id)
-            if not is_staff and str(map_pool.user) != str(real_user):
+            if not request.user.is_staff and map_pool.user_id != request.user.id:
                 return Response(status=status.HTTP_403_FORBIDDEN)
         except MapPool.DoesNotExist:
             return Response({"error": "Заявка не найдена"}, status=status.HTTP_404_NOT_FOUND)
@@ -406,39 +317,45 @@ class MapPoolDetailView(APIView):
         return Response({"message": "Заявка успешно удалена"}, status=status.HTTP_200_OK)
 
 
+class MapPoolMapsView(APIView):
+    permission_classes = [AllowAny]
+
+    @swagger_auto_schema(request_body=MapPoolMapsSerializer, responses={200: MapPoolSerializer})
+    def patch(self, request, id):
+        map_pool = get_object_or_404(MapPool, id=id)
+        if not request.user.is_staff and map_pool.user_id != request.user.id:
+            return Response(status=status.HTTP_403_FORBIDDEN)
+        serializer = MapPoolMapsSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            edit_pool_maps(map_pool.id, **serializer.validated_data)
+        except PoolEditError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        map_pool = MapPool.objects.with_maps().get(id=map_pool.id)
+        return Response(MapPoolSerializer(map_pool).data, status=status.HTTP_200_OK)
+
+
 class MapPoolSubmitView(APIView):
     permission_classes = [AllowAny]
 
     # @method_permission_classes((IsAuthenticated,))
     @swagger_auto_schema(request_body=MapPoolSerializer)
     def put(self, request, id):
-        ssid = request.COOKIES.get("session_id")
-        username = None
-        real_user = None
-        if ssid:
-            username = session_storage.get(ssid)
-            if isinstance(username, bytes):
-                username = username.decode('utf-8')
-            real_user = extract_between_quotes(username)
-            if not username:
-                return Response({"status": "error", "error": "Invalid session"}, status=status.HTTP_403_FORBIDDEN)
-        is_staff = False
-        if real_user:
-            if real_user:
-                user = User.objects.filter(username=real_user).first()
-            if user:
-                is_staff = user.is_staff
-        map_pool = get_object_or_404(MapPool, id=id)
-        if str(map_pool.user) != str(real_user):
-            return Response("Вы должны быть создателем заявки", status=status.HTTP_400_BAD_REQUEST)
-        if map_pool.status != 'draft':
-            return Response("Заявка уже была сформированна", status=status.HTTP_400_BAD_REQUEST)
-        if map_pool.player_login == None:
-            return Response("Поле player_login обязательно должно быть заполнено", status=status.HTTP_400_BAD_REQUEST)
-
-        map_pool.submit_date = timezone.now()
-        map_pool.status = "submitted"
-        map_pool.save()
+        with transaction.atomic():
+            # Waits for an AddMapToDraft in progress on this draft, so a map is never added after submission.
+            map_pool = get_object_or_404(MapPool.objects.with_maps().select_for_update(of=('self',)), id=id)
+            if map_pool.user_id != request.user.id:
+                return Response("Вы должны быть создателем заявки", status=status.HTTP_400_BAD_REQUEST)
+            if map_pool.status != 'draft':
+                return Response("Заявка уже была сформированна", status=status.HTTP_400_BAD_REQUEST)
+            if map_pool.player_login == None:
+                return Response("Поле player_login обязательно должно быть заполнено",
+                                status=status.HTTP_400_BAD_REQUEST)
+
+            map_pool.submit_date = timezone.now()
+            map_pool.status = "submitted"
+            map_pool.save()
         serializer = MapPoolSerializer(map_pool)
         return Response(serializer.data)
 
@@ -449,26 +366,10 @@ class CompleteOrRejectMapPool(APIView):
     @swagger_auto_schema(request_body=CompleteSerializer)
     @csrf_exempt
     def put(self, request, id):
-        ssid = request.COOKIES.get("session_id")
-        username = None
-        real_user = None
-        if ssid:
-            username = session_storage.get(ssid)
-            if isinstance(username, bytes):
-                username = username.decode('utf-8')
-            real_user = extract_between_quotes(username)
-            if not username:
-                return Response({"status": "error", "error": "Invalid session"}, status=status.HTTP_403_FORBIDDEN)
-        is_staff = False
-        if real_user:
-            if real_user:
-                user = User.objects.filter(username=real_user).first()
-            if user:
-                is_staff = user.is_staff
-        if is_staff == False:
+        if not request.user.is_staff:
             return Response({'status': 'error', 'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
         try:
-            map_pool = MapPool.objects.get(id=id, status='submitted')
+            map_pool = MapPool.objects.with_maps().get(id=id, status='submitted')
         except MapPool.DoesNotExist:
             return Response({"error": "Заявка не найдена или не находится в статусе ожидания модерации"},
                             status=status.HTTP_404_NOT_FOUND)
@@ -477,14 +378,17 @@ class CompleteOrRejectMapPool(APIView):
         if action not in ['complete', 'reject']:
             return Response({"error": "Неверное действие. Ожидается 'complete' или 'reject'"},
                             status=status.HTTP_400_BAD_REQUEST)
-        map_pool.moderator = user
+        map_pool.moderator = request.user
         map_pool.complete_date = timezone.now()
         if action == 'complete':
             map_pool.status = 'completed'
-            map_pool.popularity = random.randint(1, 10)
+            # Set by popularity.record_pool once the pool has been counted.
+            map_pool.popularity = None
         elif action == 'reject':
             map_pool.status = 'rejected'
         map_pool.save()
+        if action == 'complete':
+            schedule_pool(map_pool)
         serializer = MapPoolSerializer(map_pool)
 
         return Response({
@@ -493,40 +397,50 @@ class CompleteOrRejectMapPool(APIView):
         }, status=status.HTTP_200_OK)
 
 
+class PopularityView(APIView):
+    authentication_classes = [OptionalRedisSessionAuthentication]
+    permission_classes = [AllowAny]
+
+    @swagger_auto_schema(query_serializer=PopularityFilterSerializer,
+                         responses={200: PopularityScoreSerializer(many=True)})
+    def get(self, request):
+        params = PopularityFilterSerializer(data=request.query_params)
+        if not params.is_valid():
+            return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+        rows = top(params.validated_data['scope'], params.validated_data['limit'])
+        titles = {}
+        if params.validated_data['scope'] == 'map':
+            map_ids = [int(row.key) for row in rows]
+            titles = {str(map_id): title for map_id, title in
+                      Map.objects.filter(id__in=map_ids).values_list('id', 'title')}
+        return Response(PopularityScoreSerializer(rows, many=True, context={'titles': titles}).data)
+
+
 class UploadImageForMap(APIView):
     permission_classes = [AllowAny]
 
+    def initialize_request(self, request, *args, **kwargs):
+        # The file is streamed to MinIO while the body is parsed, one part at a time.
+        # The handler goes in before authentication: the session CSRF check may be
+        # what parses the body.
+        request.upload_handlers = [MinioImageUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
+    def handle_exception(self, exc):
+        discard_upload(self.request)
+        if isinstance(exc, UploadRejected):
+            return Response({'error': exc.message}, status=exc.status_code)
+        if isinstance(exc, S3Error):
+            return Response({'error': str(exc)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return super().handle_exception(exc)
+
     # @method_permission_classes((IsAdmin,))
     # @swagger_auto_schema(request_body=StockSerializer)
     def post(self, request, id):
-        ssid = request.COOKIES.get("session_id")
-        username = None
-        real_user = None
-        if ssid:
-            username = session_storage.get(ssid)
-            if isinstance(username, bytes):
-                username = username.decode('utf-8')
-            real_user = extract_between_quotes(username)
-            if not username:
-                return Response({"status": "error", "error": "Invalid session"}, status=status.HTTP_403_FORBIDDEN)
-        is_staff = False
-        if real_user:
-            if real_user:
-                user = User.objects.filter(username=real_user).first()
-            if user:
-                is_staff = user.is_staff
-
-        if is_staff == False:
+        if not request.user.is_staff:
+            discard_upload(request)
             return Response({'status': 'error', 'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
         map_obj = get_object_or_404(Map, id=id)
-        if map_obj.image_url:
-            try:
-                parsed_url = urlparse(map_obj.image_url)
-                object_name = parsed_url.path.lstrip('/')
-                minio_client.remove_object(settings.MINIO_STORAGE_BUCKET_NAME, object_name)
-            except S3Error as e:
-                return Response({'error': f'Ошибка в удалении старого изображения {str(e)}'},
-                                status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         image = request.FILES.get('image')
         if not image:
             return Response({'error': 'Нет предоставленного изображения'}, status=status.HTTP_400_BAD_REQUEST)
@@ -534,12 +448,77 @@ class UploadImageForMap(APIView):
         image_result = add_image(map_obj, image)
         if 'error' in image_result.data:
             return image_result
+        schedule_variants(map_obj)
+
+        return Response({'message': 'Изображение успешно загружено', 'image_url': map_obj.image_url},
+                        status=status.HTTP_200_OK)
+
+
+class MapImageUploadURL(APIView):
+    permission_classes = [AllowAny]
+
+    @swagger_auto_schema(
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'content_type': openapi.Schema(type=openapi.TYPE_STRING, description='MIME-тип изображения'),
+            },
+        )
+    )
+    def post(self, request, id):
+        if not request.user.is_staff:
+            return Response({'status': 'error', 'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+        map_obj = get_object_or_404(Map, id=id)
+        try:
+            upload = create_presigned_upload(map_obj, request.data.get('content_type'))
+        except UploadRejected as e:
+            return Response({'error': e.message}, status=e.status_code)
+        except S3Error as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response(upload, status=status.HTTP_201_CREATED)
 
+
+class CompleteMapImageUpload(APIView):
+    permission_classes = [AllowAny]
+
+    @swagger_auto_schema(
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'upload_id': openapi.Schema(type=openapi.TYPE_STRING, description='Идентификатор из upload_url'),
+            },
+        )
+    )
+    def post(self, request, id):
+        if not request.user.is_staff:
+            return Response({'status': 'error', 'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+        map_obj = get_object_or_404(Map, id=id)
+        upload_id = request.data.get('upload_id')
+        if not upload_id:
+            return Response({'error': 'Нет upload_id'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            image = claim_presigned_upload(map_obj, upload_id)
+        except UploadRejected as e:
+            return Response({'error': e.message}, status=e.status_code)
+        except S3Error as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        try:
+            image_result = add_image(map_obj, image)
+        except Exception:
+            restore_presigned_upload(image)
+            raise
+        if 'error' in image_result.data:
+            # The temporary object is still there; let the client complete the upload again.
+            restore_presigned_upload(image)
+            return image_result
+        schedule_variants(map_obj)
         return Response({'message': 'Изображение успешно загружено', 'image_url': map_obj.image_url},
                         status=status.HTTP_200_OK)
 
 
 @permission_classes([AllowAny])
+@authentication_classes([])
 class RegisterView(APIView):
     @swagger_auto_schema(request_body=RegisterSerializer)
     def post(self, request):
@@ -566,28 +545,19 @@ class UpdateMapPosition(APIView):
     # @swagger_auto_schema(request_body=MapMapPoolSerializer)
     def put(self, request, map_pool_id, map_id):
         map_pool = get_object_or_404(MapPool, id=map_pool_id)
-        ssid = request.COOKIES.get("session_id")
-        username = None
-        real_user = None
-        if ssid:
-            username = session_storage.get(ssid)
-            if isinstance(username, bytes):
-                username = username.decode('utf-8')
-            real_user = extract_between_quotes(username)
-            if not username:
-                return Response({"status": "error", "error": "Invalid session"}, status=status.HTTP_403_FORBIDDEN)
-        is_staff = False
-        if real_user:
-            if real_user:
-                user = User.objects.filter(username=real_user).first()
-            if user:
-                is_staff = user.is_staff
-        if not is_staff and str(map_pool.user) != str(real_user):
+        if not request.user.is_staff and map_pool.user_id != request.user.id:
             return Response(status=status.HTTP_403_FORBIDDEN)
-        new_position = request.data.get('position')
-        map_map_pool = get_object_or_404(MapMapPool, map_pool_id=map_pool_id, map_id=map_id)
-        map_map_pool.position = new_position
-        map_map_pool.save()
+        try:
+            new_position = int(request.data.get('position'))
+        except (TypeError, ValueError):
+            new_position = 0
+        if new_position < 1:
+            return Response({'error': 'position должна быть целым числом не меньше 1'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            map_map_pool = move_map(map_pool.id, map_id, new_position)
+        except MapMapPool.DoesNotExist:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
         serializer = MapMapPoolSerializer(map_map_pool)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -596,30 +566,16 @@ class RemoveMapFromMapPool(APIView):
     permission_classes = [AllowAny]
 
     def delete(self, request, map_pool_id, map_id):
-        ssid = request.COOKIES.get("session_id")
-        username = None
-        real_user = None
-        if ssid:
-            username = session_storage.get(ssid)
-            if isinstance(username, bytes):
-                username = username.decode('utf-8')
-            real_user = extract_between_quotes(username)
-            if not username:
-                return Response({"status": "error", "error": "Invalid session"}, status=status.HTTP_403_FORBIDDEN)
-        is_staff = False
-        if real_user:
-            if real_user:
-                user = User.objects.filter(username=real_user).first()
-            if user:
-                is_staff = user.is_staff
         map_pool = get_object_or_404(MapPool, id=map_pool_id)
-        if not is_staff and str(map_pool.user) != str(real_user):
+        if not request.user.is_staff and map_pool.user_id != request.user.id:
             return Response(status=status.HTTP_403_FORBIDDEN)
         map_map_pool = get_object_or_404(MapMapPool, map_id=map_id, map_pool_id=map_pool_id)
         map_map_pool.delete()
         return Response({"message": "Карта успешно удалена из заявки."}, status=status.HTTP_204_NO_CONTENT)
 
 
+# Hands out the csrftoken cookie that writes authenticated by session_id must echo back.
+@method_decorator(ensure_csrf_cookie, name='dispatch')
 class UserLogin(APIView):
     permission_classes = [AllowAny]
     authentication_classes = []
@@ -641,10 +597,9 @@ class UserLogin(APIView):
             user = authenticate(request, username=username, password=password)
             if user is not None:
                 login(request, user)
-                random_key = str(uuid.uuid4())
-                session_storage.set(random_key, username)
+                session_id = create_session(user)
                 response = HttpResponse("{'status': 'ok'}")
-                response.set_cookie("session_id", random_key)
+                response.set_cookie("session_id", session_id)
                 return response
             else:
                 return Response({"status": "error", "error": "login failed"},
@@ -660,7 +615,8 @@ class UserLogin(APIView):
 def logout_view(request):
     session_id = request.COOKIES.get("session_id")
     if session_id:
-        session_storage.delete(session_id)
+        delete_session(session_id)
+        session_cache.invalidate(session_id)
     logout(request)
     response = Response({'status': 'Success'})
     response.delete_cookie("session_id")
@@ -676,26 +632,7 @@ class ProfileView(APIView):
     )
     @csrf_exempt
     def put(self, request):
-        ssid = request.COOKIES.get("session_id")
-        username = None
-        real_user = None
-        user = None
-        if ssid:
-            username = session_storage.get(ssid)
-            if isinstance(username, bytes):
-                username = username.decode('utf-8')
-            if username:
-                real_user = extract_between_quotes(username)
-            else:
-                return Response({"status": "error", "error": "Invalid session"}, status=status.HTTP_403_FORBIDDEN)
-            if not real_user:
-                return Response({"status": "error", "error": "Invalid session"}, status=status.HTTP_403_FORBIDDEN)
-        is_staff = False
-        if real_user:
-            if real_user:
-                user = User.objects.filter(username=real_user).first()
-            if user:
-                is_staff = user.is_staff
+        user = User.objects.filter(id=request.user.id).first()
         if user is None:
             return Response({"status": "error", "error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
         serializer = UserProfileSerializer(user, data=request.data, partial=True)
@@ -704,6 +641,8 @@ class ProfileView(APIView):
                 new_password = serializer.validated_data.pop('password')
                 user.set_password(new_password)
             serializer.save()
+            update_user_sessions(user)
+            session_cache.invalidate_user(user.id)
             return Response(serializer.data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -0,0 +1,21 @@
+#!/bin/sh
+# APP_SERVER=gunicorn (the image's default) runs the production server configured in
+# gunicorn.conf.py; APP_SERVER=runserver is the autoreloading development server;
+# APP_SERVER=worker runs the background job queue (jobs.py) that both of them feed.
+set -e
+
+case "${APP_SERVER:-gunicorn}" in
+    gunicorn)
+        exec gunicorn -c gunicorn.conf.py
+        ;;
+    runserver)
+        exec python manage.py runserver 0.0.0.0:8000
+        ;;
+    worker)
+        exec python manage.py run_jobs
+        ;;
+    *)
+        echo "Unknown APP_SERVER '${APP_SERVER}': expected gunicorn, runserver or worker" >&2
+        exit 1
+        ;;
+esac
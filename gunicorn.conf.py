@@ -0,0 +1,73 @@
+"""
+gunicorn settings for the production image (entrypoint.sh runs `gunicorn -c gunicorn.conf.py`).
+
+SERVER_INTERFACE=wsgi (default) serves bmstu_lab.wsgi with threaded sync workers;
+SERVER_INTERFACE=asgi serves bmstu_lab.asgi with uvicorn workers, which routes
+the I/O-bound endpoints to async_views.py.
+
+Reloading: `kill -HUP <master>` re-reads this file and replaces the workers
+gracefully, each finishing its requests first. The app is preloaded in the
+master, so HUP keeps the old code; to deploy new code send USR2 (starts a new
+master next to the old one) and then QUIT to the old master, or restart the
+container.
+"""
+import os
+import shutil
+
+interface = os.environ.get('SERVER_INTERFACE', 'wsgi')
+if interface not in ('wsgi', 'asgi'):
+    raise ValueError(f'SERVER_INTERFACE must be wsgi or asgi, not {interface!r}')
+
+# CPUs this container may actually use, not the host's.
+cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+if interface == 'asgi':
+    wsgi_app = 'bmstu_lab.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+    # One event loop per core; blocking work goes to each worker's ASYNC_EXECUTOR_WORKERS threads.
+    workers = int(os.environ.get('WEB_CONCURRENCY', cores))
+else:
+    wsgi_app = 'bmstu_lab.wsgi:application'
+    worker_class = 'gthread'
+    workers = int(os.environ.get('WEB_CONCURRENCY', 2 * cores + 1))
+    threads = int(os.environ.get('WEB_THREADS', 4))
+
+# Import Django once in the master; workers fork with it loaded.
+preload_app = True
+# Recycle workers now and then so slow leaks cannot grow forever; the jitter keeps them from restarting together.
+max_requests = int(os.environ.get('MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('MAX_REQUESTS_JITTER', 100))
+timeout = int(os.environ.get('WORKER_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+# Heartbeat files on tmpfs: a disk-backed /tmp in Docker can stall workers into timeouts.
+worker_tmp_dir = '/dev/shm'
+forwarded_allow_ips = os.environ.get('FORWARDED_ALLOW_IPS', '*')
+
+# prometheus_client multiprocess mode: workers write samples to files here and
+# /metrics adds them up. It is read when prometheus_client is imported, so it has
+# to be set before the app is preloaded.
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/dev/shm/bmstu_lab_metrics')
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('LOG_LEVEL', 'info').lower()
+
+
+def pre_fork(server, worker):
+    # A DB connection opened while preloading must not be inherited by workers. Redis
+    # and MinIO clients need nothing here: clients.py drops them in the child after fork.
+    from django.db import connections
+    connections.close_all()
+
+
+def on_starting(server):
+    # Samples left by a previous run would be added to the new one. Not called on HUP.
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)